@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Adaptive per-host timeouts and hedged requests (--adaptive-timeouts, --hedge)
+
+The scrapers pass fixed timeouts (20–30 s) whatever the host: a fast mirror
+holds a worker for 30 s on a stuck request, a slow one times out pages that
+would have loaded. With --adaptive-timeouts every fetch's time to response
+headers goes into a latency histogram per host and page type (category,
+product, image, page), and once a histogram has MIN_SAMPLES fetches the
+timeouts of that host and page type come from it:
+
+    connect timeout = p95 × CONNECT_MARGIN     (over socks5h this covers building the circuit)
+    read timeout    = p99 × READ_MARGIN
+
+both kept within MIN_TIMEOUT..MAX_TIMEOUT. Histograms are log-bucketed and
+decay (old weight is halved whenever MAX_WEIGHT is reached), so they follow
+a host that gets faster or slower, and they are saved to timeouts.json so
+the next run starts with what this one learned.
+
+With --hedge, a fetch still waiting for headers after its key's p95 gets a
+duplicate request; whichever answers first is used. Hedges are capped at
+HEDGE_RATE of all fetches so a slow market is not hit with twice the load.
+
+    python3 adaptive_timeouts.py          # learned percentiles and timeouts per host
+"""
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from termcolor import colored
+
+import http_fetch
+
+
+TIMEOUTS_FILE = "timeouts.json"
+
+# Bucket i holds latencies up to BUCKET_START * BUCKET_GROWTH ** i seconds (the last one: anything longer)
+BUCKET_START = 0.1
+BUCKET_GROWTH = 1.25
+BUCKETS = 36
+MAX_WEIGHT = 400          # halve all counts when a histogram holds more than this
+MIN_SAMPLES = 20          # fetches before a histogram overrides the caller's timeout
+
+CONNECT_MARGIN = 2.0
+READ_MARGIN = 1.5
+MIN_TIMEOUT = 5.0
+MAX_TIMEOUT = 120.0
+
+HEDGE_RATE = 0.1          # at most this share of fetches get a duplicate request
+MIN_HEDGE_DELAY = 1.0
+HEDGE_THREADS = 64
+
+TIMEOUT_STATS = {
+    'adaptive': 0,
+    'default': 0,
+    'timeouts': 0,
+    'hedged': 0,
+    'hedge_wins': 0,
+    'hedges_skipped': 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _record(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            TIMEOUT_STATS[key] = TIMEOUT_STATS.get(key, 0) + value
+
+
+def _bucket_of(seconds):
+    if seconds <= BUCKET_START:
+        return 0
+    return min(int(math.ceil(math.log(seconds / BUCKET_START, BUCKET_GROWTH))), BUCKETS - 1)
+
+
+def _bucket_bound(index):
+    return BUCKET_START * BUCKET_GROWTH ** index
+
+
+class LatencyHistogram:
+    """Decaying log-bucketed histogram of latencies in seconds."""
+
+    def __init__(self, counts=None, samples=0):
+        self.counts = list(counts or [0.0] * BUCKETS)
+        if len(self.counts) != BUCKETS:
+            self.counts = [0.0] * BUCKETS
+        self.samples = samples   # fetches ever observed (not decayed)
+
+    def add(self, seconds):
+        self.counts[_bucket_of(seconds)] += 1
+        self.samples += 1
+        if sum(self.counts) > MAX_WEIGHT:
+            self.counts = [count / 2 for count in self.counts]
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (None when empty)."""
+        total = sum(self.counts)
+        if not total:
+            return None
+        target = total * p / 100
+        cumulative = 0.0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return _bucket_bound(index)
+        return _bucket_bound(BUCKETS - 1)
+
+    def to_json(self):
+        return {'counts': [round(count, 3) for count in self.counts], 'samples': self.samples}
+
+
+def _clamp(seconds):
+    return round(min(max(seconds, MIN_TIMEOUT), MAX_TIMEOUT), 1)
+
+
+class TimeoutPolicy:
+    """Latency histograms per (host, page type), the timeouts derived from them, and hedging."""
+
+    def __init__(self, path=TIMEOUTS_FILE, hedge=False):
+        self.path = path
+        self.hedge = hedge
+        self.histograms = {}     # (host, page_type) → LatencyHistogram
+        self._lock = threading.Lock()
+        self._fetches = 0
+        self._pool = ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix='hedge') if hedge else None
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for host, page_types in json.load(f).get('hosts', {}).items():
+                        for page_type, data in page_types.items():
+                            self.histograms[(host, page_type)] = LatencyHistogram(data.get('counts'),
+                                                                                  data.get('samples', 0))
+            except Exception as e:
+                print(colored(f"⚠️  Could not load {path} ({e}); starting with empty latency histograms", "yellow"))
+
+    @staticmethod
+    def _key(url, page_type):
+        return urllib.parse.urlparse(url).netloc, page_type or 'page'
+
+    def _learned(self, url, page_type):
+        histogram = self.histograms.get(self._key(url, page_type))
+        if histogram is None or histogram.samples < MIN_SAMPLES:
+            return None
+        return histogram
+
+    def timeout(self, url, page_type, default):
+        """(connect, read) timeouts for a fetch, or the caller's default until the histogram is learned."""
+        with self._lock:
+            self._fetches += 1
+            histogram = self._learned(url, page_type)
+            if histogram is None:
+                _record(default=1)
+                return default
+            connect, read = histogram.percentile(95), histogram.percentile(99)
+        _record(adaptive=1)
+        return _clamp(connect * CONNECT_MARGIN), _clamp(read * READ_MARGIN)
+
+    def observe(self, url, page_type, seconds, timed_out=False):
+        """Time until response headers of one request (or until it timed out, which only raises the tail)."""
+        if timed_out:
+            _record(timeouts=1)
+        with self._lock:
+            key = self._key(url, page_type)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def run(self, url, page_type, call):
+        """call() — with a duplicate started if it is still running after the key's p95 (--hedge)."""
+        if self._pool is None:
+            return call()
+        with self._lock:
+            histogram = self._learned(url, page_type)
+            delay = max(histogram.percentile(95), MIN_HEDGE_DELAY) if histogram is not None else None
+        if delay is None:
+            return call()
+
+        primary = self._pool.submit(call)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        with _stats_lock:
+            allowed = TIMEOUT_STATS['hedged'] < HEDGE_RATE * self._fetches
+            if allowed:
+                TIMEOUT_STATS['hedged'] += 1
+            else:
+                TIMEOUT_STATS['hedges_skipped'] += 1
+        if not allowed:
+            return primary.result()
+
+        hedge = self._pool.submit(call)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The loser finishes in the background and is dropped
+                    if future is hedge:
+                        _record(hedge_wins=1)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def save(self, path=None):
+        """Write the histograms (atomic replace)."""
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            hosts = {}
+            for (host, page_type), histogram in self.histograms.items():
+                hosts.setdefault(host, {})[page_type] = histogram.to_json()
+            data = json.dumps({'hosts': hosts}, indent=1, sort_keys=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def rows(self):
+        """(host, page_type, samples, p50, p95, p99, (connect, read) or None) for every histogram."""
+        with self._lock:
+            items = sorted(self.histograms.items())
+        rows = []
+        for (host, page_type), histogram in items:
+            p95, p99 = histogram.percentile(95), histogram.percentile(99)
+            timeouts = None
+            if histogram.samples >= MIN_SAMPLES:
+                timeouts = (_clamp(p95 * CONNECT_MARGIN), _clamp(p99 * READ_MARGIN))
+            rows.append((host, page_type, histogram.samples, histogram.percentile(50), p95, p99, timeouts))
+        return rows
+
+    def print_stats(self):
+        """Print the adaptive timeout section of the run summary."""
+        with _stats_lock:
+            stats = dict(TIMEOUT_STATS)
+        if not (stats['adaptive'] or stats['default']):
+            return
+        print(colored(f"⏱️  Adaptive timeouts: {stats['adaptive']} fetches with learned timeouts, "
+                      f"{stats['default']} with defaults (under {MIN_SAMPLES} samples), {stats['timeouts']} timed out",
+                      "white"))
+        if self._pool is not None:
+            print(colored(f"   Hedged requests: {stats['hedged']} sent, {stats['hedge_wins']} answered first, "
+                          f"{stats['hedges_skipped']} skipped (over {HEDGE_RATE:.0%} of fetches)", "white"))
+
+
+def start(path=TIMEOUTS_FILE, hedge=False):
+    """Install a TimeoutPolicy under http_fetch.fetch() (called from the scrapers' main())."""
+    policy = TimeoutPolicy(path, hedge=hedge)
+    http_fetch.timeout_policy = policy
+    learned = sum(1 for histogram in policy.histograms.values() if histogram.samples >= MIN_SAMPLES)
+    print(colored(f"⏱️  Adaptive timeouts: {learned} host/page-type histograms learned from {path}"
+                  f"{', hedging stragglers' if hedge else ''}", "cyan"))
+    return policy
+
+
+def stop():
+    """Save the histograms, uninstall the policy and print its run summary."""
+    policy = http_fetch.timeout_policy
+    if policy is None:
+        return
+    http_fetch.timeout_policy = None
+    policy.close()
+    try:
+        policy.save()
+    except Exception as e:
+        print(colored(f"Failed saving latency histograms: {e}", "red"))
+    policy.print_stats()
+
+
+def _format_seconds(seconds):
+    return f"{seconds:.1f}s" if seconds is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show the latency histograms and adaptive timeouts per host')
+    parser.add_argument('--timeouts', type=str, default=TIMEOUTS_FILE,
+                       help=f'Histogram file (default: {TIMEOUTS_FILE})')
+    parser.add_argument('--host', type=str, default=None, help='Only this host (netloc)')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.timeouts):
+        print(colored(f"❌ {args.timeouts} not found (crawl with --adaptive-timeouts first)", "red"))
+        return
+
+    policy = TimeoutPolicy(args.timeouts)
+    print(colored(f"{'host':<40} {'type':<9} {'samples':>7} {'p50':>7} {'p95':>7} {'p99':>7}  timeouts", "cyan"))
+    for host, page_type, samples, p50, p95, p99, timeouts in policy.rows():
+        if args.host and host != args.host:
+            continue
+        learned = f"connect {timeouts[0]:.0f}s, read {timeouts[1]:.0f}s" if timeouts else "defaults"
+        print(f"{host[:40]:<40} {page_type:<9} {samples:>7} {_format_seconds(p50):>7} {_format_seconds(p95):>7} "
+              f"{_format_seconds(p99):>7}  {learned}")
+
+
+if __name__ == "__main__":
+    main()
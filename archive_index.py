@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Random-access reads from products_html.json archives
+
+The scrapers write products_html.json one record per line (see
+archive_io.JsonArrayWriter) and record each record's byte offset and length
+here as they go, keyed by listing URL:
+
+    archive_index.db   url, fetched_at, market → file, offset, length
+
+A record is then read by slicing a memory map of the archive and decoding
+just that slice, so "the HTML of listing X from crawl Y" costs one indexed
+SQLite lookup and one json.loads() however large the archive is. Batch
+lookups are read in file/offset order so the OS can read ahead.
+
+Archives written before the index existed are indexed with --build (only
+the bytes not yet indexed are scanned on later runs):
+
+    python3 archive_index.py --build products_html.json
+    python3 archive_index.py http://market.onion/shop/item/ --crawl 2026-10-19 --html
+"""
+
+import argparse
+import calendar
+import json
+import mmap
+import os
+import sqlite3
+import time
+from termcolor import colored
+
+from archive_io import JsonArrayWriter, record_url
+
+
+ARCHIVE_INDEX_FILE = "archive_index.db"
+COMMIT_EVERY = 500
+
+
+class ArchiveIndex:
+    """Listing URL → (archive file, byte offset, length) index with mmap-backed reads."""
+
+    def __init__(self, path=ARCHIVE_INDEX_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                indexed_bytes INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS records (
+                url TEXT NOT NULL,
+                file_id INTEGER NOT NULL,
+                market TEXT,
+                fetched_at INTEGER,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS records_url ON records(url, fetched_at);
+            CREATE INDEX IF NOT EXISTS records_file ON records(file_id, offset);
+        """)
+        self._file_ids = {}
+        self._paths = {}
+        self._maps = {}
+        self._pending = 0
+
+    # -- writing -----------------------------------------------------------
+
+    def file_id(self, archive_path):
+        archive_path = os.path.realpath(archive_path)
+        if archive_path not in self._file_ids:
+            self.conn.execute("INSERT OR IGNORE INTO files (path) VALUES (?)", (archive_path,))
+            row = self.conn.execute("SELECT id FROM files WHERE path = ?", (archive_path,)).fetchone()
+            self._file_ids[archive_path] = row[0]
+            self._paths[row[0]] = archive_path
+        return self._file_ids[archive_path]
+
+    def add(self, archive_path, record, offset, length):
+        """Record where a record was written (called by JsonArrayWriter)."""
+        file_id = self.file_id(archive_path)
+        self.conn.execute(
+            "INSERT INTO records (url, file_id, market, fetched_at, offset, length) VALUES (?, ?, ?, ?, ?, ?)",
+            (record_url(record), file_id, record.get('market'), record.get('fetched_at'), offset, length))
+        self.conn.execute("UPDATE files SET indexed_bytes = ? WHERE id = ?", (offset + length, file_id))
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.commit()
+
+    def truncate(self, archive_path, size):
+        """Drop entries past the end of a file that was truncated or rewritten."""
+        file_id = self.file_id(archive_path)
+        self.conn.execute("DELETE FROM records WHERE file_id = ? AND offset + length > ?", (file_id, size))
+        self.conn.execute("UPDATE files SET indexed_bytes = MIN(indexed_bytes, ?) WHERE id = ?", (size, file_id))
+        self._unmap(file_id)
+        self.commit()
+
+    def update(self, archive_path):
+        """Index the records of an archive that are not indexed yet; returns how many were added."""
+        file_id = self.file_id(archive_path)
+        start = self.conn.execute("SELECT indexed_bytes FROM files WHERE id = ?", (file_id,)).fetchone()[0]
+        if start > os.path.getsize(archive_path):
+            self.truncate(archive_path, 0)
+            start = 0
+        added = 0
+        with open(archive_path, 'rb') as f:
+            if start == 0:
+                if f.readline().strip() != b'[':
+                    raise ValueError(f"{archive_path} is not in the line-per-record layout; "
+                                     f"open it with JsonArrayWriter(resume=True) to convert it")
+                start = f.tell()
+            f.seek(start)
+            offset = start
+            for line in f:
+                line_start, offset = offset, offset + len(line)
+                record_text = line.rstrip().rstrip(b',')
+                if record_text in (b'', b']'):
+                    continue
+                try:
+                    record = json.loads(record_text)
+                except ValueError:
+                    break  # truncated trailing record of a crawl still running (or killed)
+                self.add(archive_path, record, line_start, len(record_text))
+                added += 1
+        self.commit()
+        return added
+
+    def commit(self):
+        self.conn.commit()
+        self._pending = 0
+
+    # -- reading -----------------------------------------------------------
+
+    def _map(self, file_id):
+        mapped = self._maps.get(file_id)
+        if mapped is None:
+            if file_id not in self._paths:
+                row = self.conn.execute("SELECT path FROM files WHERE id = ?", (file_id,)).fetchone()
+                self._paths[file_id] = row[0]
+            with open(self._paths[file_id], 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[file_id] = mapped
+        return mapped
+
+    def _unmap(self, file_id):
+        mapped = self._maps.pop(file_id, None)
+        if mapped is not None:
+            mapped.close()
+
+    def _read(self, file_id, offset, length):
+        mapped = self._map(file_id)
+        if offset + length > len(mapped):
+            # The archive grew since it was mapped
+            self._unmap(file_id)
+            mapped = self._map(file_id)
+        return json.loads(mapped[offset:offset + length])
+
+    def _crawl_filter(self, crawl):
+        """SQL condition for a crawl given as an archive path or a YYYY-MM-DD date."""
+        if crawl is None:
+            return '', []
+        if os.path.exists(crawl):
+            return ' AND file_id = ?', [self.file_id(crawl)]
+        day_start = calendar.timegm(time.strptime(crawl, '%Y-%m-%d'))
+        return ' AND fetched_at >= ? AND fetched_at < ?', [day_start, day_start + 86400]
+
+    def locate(self, url, crawl=None):
+        """(file_id, offset, length) of the newest matching record, or None."""
+        condition, params = self._crawl_filter(crawl)
+        return self.conn.execute(
+            "SELECT file_id, offset, length FROM records WHERE url = ?" + condition +
+            " ORDER BY fetched_at DESC LIMIT 1", [url] + params).fetchone()
+
+    def get(self, url, crawl=None):
+        """The archived record of a listing (newest, or from the given crawl), or None."""
+        location = self.locate(url, crawl)
+        return self._read(*location) if location else None
+
+    def get_many(self, urls, crawl=None):
+        """Records for several listings, read in file/offset order; returns {url: record}."""
+        locations = []
+        for url in dict.fromkeys(urls):
+            location = self.locate(url, crawl)
+            if location:
+                locations.append((location, url))
+        locations.sort()
+        return {url: self._read(*location) for location, url in locations}
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def close(self):
+        for file_id in list(self._maps):
+            self._unmap(file_id)
+        self.commit()
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Random-access lookups in products_html.json archives')
+    parser.add_argument('urls', nargs='*', help='Listing URLs to look up')
+    parser.add_argument('--index', type=str, default=ARCHIVE_INDEX_FILE,
+                       help=f'Index database (default: {ARCHIVE_INDEX_FILE})')
+    parser.add_argument('--build', nargs='+', metavar='ARCHIVE',
+                       help='Index these archives first (only records not indexed yet are scanned)')
+    parser.add_argument('--crawl', type=str, default=None,
+                       help='Only return records from this archive file or fetch date (YYYY-MM-DD)')
+    parser.add_argument('--html', action='store_true', help='Print the archived HTML instead of a summary')
+
+    args = parser.parse_args()
+
+    index = ArchiveIndex(args.index)
+    try:
+        for path in args.build or []:
+            if not os.path.exists(path):
+                print(colored(f"❌ {path} not found!", "red"))
+                continue
+            before = len(index)
+            # Converts older layouts, repairs a half-written array and indexes what is missing
+            JsonArrayWriter(path, resume=True, index=index).close()
+            added = len(index) - before
+            print(colored(f"✅ Indexed {added} new records from {path} ({len(index)} in total)", "green"))
+
+        if not args.urls:
+            return
+
+        start = time.perf_counter()
+        records = index.get_many(args.urls, crawl=args.crawl)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        for url in args.urls:
+            record = records.get(url)
+            if record is None:
+                print(colored(f"❌ {url} not in the archive", "red"))
+            elif args.html:
+                print(record.get('html', ''))
+            else:
+                print(colored(url, "green") + colored(
+                    f"  {record.get('market')} fetched_at={record.get('fetched_at')} "
+                    f"{len(record.get('html') or '')} chars of HTML", "white"))
+        print(colored(f"\n{len(records)}/{len(set(args.urls))} records in {elapsed_ms:.2f} ms", "blue"))
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Streaming helpers for the JSON archives written by the scrapers.
+
+products_html.json can grow to hundreds of MB because every record carries the
+full page HTML. These helpers walk the top-level JSON array one record at a
+time so downstream tools never have to json.load() the whole file, and
+JsonArrayWriter appends records one at a time so the scrapers never have to
+hold the whole archive in memory.
+"""
+
+import json
+import os
+import threading
+
+
+READ_CHUNK_SIZE = 1 << 20  # 1 MB
+
+
+def iter_json_array(path, chunk_size=READ_CHUNK_SIZE):
+    """Yield the elements of a top-level JSON array file one at a time."""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = ''
+        pos = 0
+        started = False
+        eof = False
+
+        while True:
+            # Skip whitespace and separators between elements
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+
+            if not started and pos < len(buf):
+                if buf[pos] != '[':
+                    raise ValueError(f"{path} is not a JSON array")
+                started = True
+                pos += 1
+                continue
+
+            if started and pos < len(buf) and buf[pos] == ']':
+                # Older append mode wrote several arrays back to back ("][")
+                started = False
+                pos += 1
+                continue
+
+            if pos < len(buf):
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                    # A value ending exactly at the buffer edge may be cut short
+                    if end < len(buf) or eof:
+                        yield obj
+                        pos = end
+                        continue
+                except json.JSONDecodeError:
+                    if eof:
+                        # Truncated trailing record (e.g. crash mid-write)
+                        return
+
+            if eof:
+                return
+
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+
+def record_url(record):
+    """Return the listing URL of a record written by either scraper."""
+    return record.get('listing url') or record.get('product_url')
+
+
+def record_category_page(record):
+    """Return the category page of a record written by either scraper."""
+    return record.get('category page') or record.get('category_page')
+
+
+class JsonArrayWriter:
+    """
+    Append records to a JSON array file as they are produced.
+
+    Each record is written on its own line and flushed immediately, so memory
+    stays at one record and a crash loses at most the record being written:
+
+        [
+        {...},
+        {...}
+        ]
+
+    The closing bracket is added by close(); a file left without it (killed
+    process) is still readable by iter_json_array() and is repaired when it is
+    reopened with resume=True. Resuming also accepts archives written by older
+    versions (indented, or several arrays appended back to back) by rewriting
+    them once in the line-per-record layout. URLs already in the file are
+    available in seen_urls.
+
+    With an archive_index.ArchiveIndex, the byte offset of every record is
+    indexed as it is written (and brought up to date when the file is opened).
+    """
+
+    def __init__(self, path, resume=False, index=None):
+        self.path = path
+        self.index = index
+        self.seen_urls = set()
+        self.count = 0
+        self._file = None
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path) and os.path.getsize(path) > 0:
+            self._open_for_resume()
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(b'[\n')
+            self._file.flush()
+            if index is not None:
+                index.truncate(path, 0)
+
+    def _scan(self):
+        """Return the byte offset after the last complete record, or None if the layout is not ours."""
+        with open(self.path, 'rb') as f:
+            if f.readline().strip() != b'[':
+                return None
+            end_offset = offset = f.tell()
+            for line in f:
+                line_start, offset = offset, offset + len(line)
+                stripped = line.rstrip()
+                if stripped == b']':
+                    break
+                if not stripped:
+                    continue
+                record_text = stripped.rstrip(b',')
+                try:
+                    record = json.loads(record_text)
+                except ValueError:
+                    if offset == os.path.getsize(self.path):
+                        break  # truncated trailing record
+                    return None
+                if not isinstance(record, dict):
+                    return None
+                url = record_url(record)
+                if url:
+                    self.seen_urls.add(url)
+                self.count += 1
+                end_offset = line_start + len(record_text)
+        return end_offset
+
+    def _migrate(self):
+        """Rewrite an archive from an older layout in the line-per-record layout."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as out:
+            out.write(b'[\n')
+            first = True
+            for record in iter_json_array(self.path):
+                if not first:
+                    out.write(b',\n')
+                out.write(json.dumps(record, ensure_ascii=False).encode('utf-8'))
+                first = False
+            out.write(b'\n]\n')
+        os.replace(tmp_path, self.path)
+
+    def _open_for_resume(self):
+        end_offset = self._scan()
+        if end_offset is None:
+            self.seen_urls.clear()
+            self.count = 0
+            self._migrate()
+            if self.index is not None:
+                self.index.truncate(self.path, 0)
+            end_offset = self._scan()
+        self._file = open(self.path, 'r+b')
+        self._file.truncate(end_offset)
+        self._file.seek(end_offset)
+        if self.index is not None:
+            self.index.truncate(self.path, end_offset)
+            self.index.update(self.path)
+
+    def write(self, record):
+        """Append one record and flush it to disk (safe to call from several threads)."""
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            separator = b',\n' if self.count else b''
+            offset = self._file.tell() + len(separator)
+            self._file.write(separator + line)
+            self._file.flush()
+            if self.index is not None:
+                self.index.add(self.path, record, offset, len(line))
+            self.count += 1
+            url = record_url(record)
+            if url:
+                self.seen_urls.add(url)
+
+    def close(self):
+        """Write the closing bracket; the file is valid JSON afterwards."""
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(b'\n]\n')
+            self._file.close()
+            self._file = None
+        if self.index is not None:
+            self.index.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
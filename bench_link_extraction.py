@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark for category page link extraction in scrape_simple
+
+Compares the streaming fast path (extract_category_links) against the
+BeautifulSoup path on large category pages and checks both return the same
+product and pagination links.
+
+Usage:
+    python3 bench_link_extraction.py                    # synthetic pages
+    python3 bench_link_extraction.py saved_page.html    # your own pages
+"""
+
+import argparse
+import random
+import time
+from termcolor import colored
+
+from scrape_simple import extract_category_links, _extract_category_links_dom, _scan_anchors
+
+
+BASE_URL = "http://marketplace.onion/product-category/example/"
+
+
+def synthetic_category_page(products=500, nav_links=300, woocommerce=True, seed=0):
+    """Build a WooCommerce-like category page with a large menu and footer."""
+    rng = random.Random(seed)
+    menu = ''.join(
+        f'<li class="menu-item"><a href="/product-category/cat-{i}/">Category {i}</a></li>'
+        for i in range(nav_links)
+    )
+    if woocommerce:
+        cards = ''.join(
+            f'<li class="product type-product post-{i} instock">'
+            f'<a href="/shop/product-{i}/" class="woocommerce-LoopProduct-link woocommerce-loop-product__link">'
+            f'<img src="/img/{i}.jpg" alt=""/><h2 class="woocommerce-loop-product__title">Product {i}</h2>'
+            f'<span class="price"><span class="amount">${rng.randint(10, 900)}.00</span></span></a>'
+            f'<a href="?add-to-cart={i}" class="button add_to_cart_button">Add to cart</a></li>'
+            for i in range(products)
+        )
+        listing = f'<ul class="products columns-4">{cards}</ul>'
+    else:
+        listing = ''.join(
+            f'<div class="card"><a href="/item/{i}/">Item {i}</a><a href="/cart/?add={i}">Buy</a></div>'
+            for i in range(products)
+        )
+    pagination = ''.join(f'<li><a class="page-numbers" href="/product-category/example/page/{i}/">{i}</a></li>'
+                         for i in range(2, 12))
+    script = '<script>var s = "<a href=\'/shop/fake/\'>x</a>";</script>'
+    return (
+        '<!DOCTYPE html><html><head><title>Example</title>' + script + '</head><body>'
+        f'<nav class="main-navigation"><ul class="menu">{menu}</ul></nav>'
+        f'<main>{listing}'
+        f'<nav class="woocommerce-pagination"><ul class="page-numbers">{pagination}</ul></nav></main>'
+        '<!-- <a href="/shop/commented-out/">hidden</a> -->'
+        f'<footer><ul>{menu}</ul></footer></body></html>'
+    )
+
+
+def bench(name, html, repeat):
+    fast_path = _scan_anchors(html) is not None
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fast = extract_category_links(html, BASE_URL)
+    fast_time = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        dom = _extract_category_links_dom(html, BASE_URL)
+    dom_time = (time.perf_counter() - start) / repeat
+
+    same = set(fast[0]) == set(dom[0]) and fast[1] == dom[1]
+    status = colored("same links", "green") if same else colored("MISMATCH", "red")
+    print(f"{name:<28} {len(html) / 1024:8.0f} KB  products={len(dom[0]):<5} "
+          f"fast={fast_time * 1000:8.2f} ms  dom={dom_time * 1000:8.2f} ms  "
+          f"x{dom_time / fast_time:5.1f}  {'stream' if fast_path else 'dom-fallback'}  {status}")
+    return same
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark category link extraction')
+    parser.add_argument('files', nargs='*', help='Saved category page HTML files to benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per page (default: 5)')
+    args = parser.parse_args()
+
+    pages = []
+    if args.files:
+        for path in args.files:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                pages.append((path, f.read()))
+    else:
+        pages = [
+            ('woocommerce 100 products', synthetic_category_page(100)),
+            ('woocommerce 1000 products', synthetic_category_page(1000)),
+            ('generic 1000 products', synthetic_category_page(1000, woocommerce=False)),
+            ('unclosed <li> markup', synthetic_category_page(50, nav_links=20).replace('</li>', '')),
+        ]
+
+    results = [bench(name, html, args.repeat) for name, html in pages]
+    if not all(results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+In-band CAPTCHA / session-expiry detection with cookie refresh
+
+Once the browser's cookies are handed to requests, an expired session or a
+DDoS-guard interstitial comes back as an ordinary 200, and without a check
+the scrapers store the challenge page as product HTML. The guard looks at
+every category and product page http_fetch.fetch() returns
+(http_fetch.challenge_guard); forum posts, keyword-search pages and API
+documents are not checked, since their text can mention anything:
+
+- a challenge signature (captcha, DDoS-guard, "checking your browser",
+  "session expired", ...) in the <title>, or anywhere on a page smaller
+  than CHALLENGE_PAGE_BYTES (interstitials are small), without product
+  markers, or
+- a login form (password field) on a page without product markers, or
+- a tiny page with a form or meta refresh and no markers
+
+Product markers are product-only markup (product_title, add-to-cart...):
+the shop's own login page is WooCommerce markup too.
+
+Signatures and markers can be extended globally or per host in
+challenges.json:
+
+    {"signatures": ["queue position"], "product_markers": ["vendor-card"],
+     "hosts": {"market.onion": {"signatures": ["/antibot/"]}}}
+
+When a host serves a challenge it is paused: its other fetches wait while one
+thread refreshes the session cookies — by loading the page in the kept-alive
+browser (and waiting for Enter with --manual), or with --manual and no
+browser, by asking for a Cookie header — then every waiting and affected
+fetch is re-sent and the crawl resumes. Fetches to other hosts carry on.
+A host that still challenges after MAX_REFRESHES refreshes in a row is
+skipped for the rest of the run (ChallengePage, a FetchAborted, so the
+challenge page is never stored as the listing).
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+from termcolor import colored
+
+import http_fetch
+
+
+CHALLENGES_FILE = "challenges.json"
+
+DEFAULT_SIGNATURES = (
+    r'captcha', r'ddos[- ]?guard', r'ddos protection', r'checking your browser', r'verify (that )?you are (a )?human',
+    r'are you a robot', r'cf-browser-verification', r'cf-challenge', r'challenge-form', r'endgame',
+    r'session (has )?expired', r'please (log|sign) ?in', r'access denied', r'too many requests',
+)
+DEFAULT_PRODUCT_MARKERS = (
+    'add-to-cart', 'add_to_cart', 'product_title', 'woocommerce-loop-product', 'woocommerce-product-gallery',
+    'itemprop="price"',
+)
+# Only these fetches are checked
+PAGE_TYPES = ('category', 'product')
+SMALL_PAGE_BYTES = 8 * 1024
+CHALLENGE_PAGE_BYTES = 32 * 1024   # bigger pages are matched against the default signatures by <title> only
+SCAN_BYTES = 256 * 1024       # challenge pages are small; only the start of big pages is searched
+MAX_REFRESHES = 3             # consecutive refreshes that did not help before a host is skipped
+REFRESH_GRACE = 15            # seconds after a refresh during which a challenge just re-sends the fetch
+REFRESH_TIMEOUT = 600         # longest a fetch waits for another thread's refresh (manual solving)
+BROWSER_SETTLE = 20           # seconds the kept-alive browser gets to pass an interstitial without --manual
+
+CHALLENGE_STATS = {
+    'detected': 0,
+    'refreshed': 0,
+    'refresh_failed': 0,
+    'recovered': 0,
+    'skipped': 0,
+}
+_stats_lock = threading.Lock()
+
+_PASSWORD_FIELD = re.compile(r'<input[^>]+type=["\']?password', re.I)
+_FORM_OR_REFRESH = re.compile(r'<form|http-equiv=["\']?refresh', re.I)
+_TITLE = re.compile(r'<title[^>]*>(.*?)</title>', re.I | re.S)
+
+
+def _record(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            CHALLENGE_STATS[key] = CHALLENGE_STATS.get(key, 0) + value
+
+
+class ChallengePage(http_fetch.FetchAborted):
+    """The host answered with a CAPTCHA, DDoS-guard or login page instead of the requested one."""
+
+
+class _HostState:
+    def __init__(self):
+        self.refreshing = None      # Event set when the running refresh finishes
+        self.refreshed_at = None
+        self.failures = 0
+        self.blocked = False
+
+
+def _compile(patterns):
+    return [re.compile(pattern, re.I) for pattern in patterns]
+
+
+def parse_cookie_header(header):
+    """{name: value} from 'a=1; b=2' (as copied from the browser's developer tools)."""
+    cookies = {}
+    for part in header.strip().removeprefix('Cookie:').split(';'):
+        name, sep, value = part.strip().partition('=')
+        if sep and name:
+            cookies[name] = value
+    return cookies
+
+
+class ChallengeGuard:
+    """Detects challenge pages, pauses the host, refreshes cookies and re-sends the fetch."""
+
+    page_types = PAGE_TYPES
+
+    def __init__(self, refresher=None, config_path=CHALLENGES_FILE):
+        self.refresher = refresher
+        self.default_signatures = _compile(DEFAULT_SIGNATURES)
+        self.signatures = []         # from the config file: matched anywhere on the page
+        self.markers = list(DEFAULT_PRODUCT_MARKERS)
+        self.host_signatures = {}
+        self.host_markers = {}
+        if config_path and os.path.exists(config_path):
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            self.signatures = _compile(config.get('signatures', []))
+            self.markers += [marker.lower() for marker in config.get('product_markers', [])]
+            for host, overrides in config.get('hosts', {}).items():
+                self.host_signatures[host] = _compile(overrides.get('signatures', []))
+                self.host_markers[host] = [marker.lower() for marker in overrides.get('product_markers', [])]
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()   # one browser / one prompt at a time
+
+    def detect(self, html, host):
+        """Why a page looks like a challenge or login page, or None."""
+        text = html[:SCAN_BYTES]
+        lowered = text.lower()
+        if any(marker in lowered for marker in self.markers + self.host_markers.get(host, [])):
+            return None
+        if len(html) < CHALLENGE_PAGE_BYTES:
+            scope = text
+        else:
+            # Words like "captcha" or "access denied" in a big page's content say nothing
+            title = _TITLE.search(text)
+            scope = title.group(1) if title else ''
+        searches = [(pattern, scope) for pattern in self.default_signatures]
+        searches += [(pattern, text) for pattern in self.signatures + self.host_signatures.get(host, [])]
+        for pattern, where in searches:
+            match = pattern.search(where)
+            if match:
+                return f"'{match.group(0)}' on a page without product markers"
+        if _PASSWORD_FIELD.search(text):
+            return "login form"
+        if len(html) < SMALL_PAGE_BYTES and _FORM_OR_REFRESH.search(text):
+            return f"{len(html)} byte page with a form and no product markers"
+        return None
+
+    def _state(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = _HostState()
+            return state
+
+    def wait(self, url):
+        """Called before each fetch: hold fetches to a host while its cookies are being refreshed."""
+        state = self._state(urllib.parse.urlparse(url).netloc)
+        event = state.refreshing
+        if event is not None:
+            event.wait(REFRESH_TIMEOUT)
+        if state.blocked:
+            raise ChallengePage("host keeps answering with challenge pages", url)
+
+    def check(self, session, url, page_type, response, refetch):
+        """Return the response, or the re-sent one after a cookie refresh; raise ChallengePage if that fails."""
+        content_type = response.headers.get('Content-Type', '')
+        if response.status_code not in (200, 403, 429, 503) or (content_type and 'html' not in content_type):
+            return response
+        host = urllib.parse.urlparse(url).netloc
+        state = self._state(host)
+        reason = self.detect(http_fetch.page_text(response), host)
+        if reason is None:
+            if response.status_code == 200:
+                state.failures = 0
+            return response
+
+        _record(detected=1)
+        print(colored(f"🛑 Challenge page from {host} ({reason}): {url}", "yellow"))
+        refreshed = self._refresh(session, url, state)
+        if refreshed is None:
+            _record(skipped=1)
+            raise ChallengePage(f"challenge page ({reason})", url)
+
+        response = refetch()
+        reason = self.detect(http_fetch.page_text(response), host)
+        if reason is not None:
+            # Only the fetch that ran the refresh counts it as failed: one URL that is always
+            # a login page must not get its whole host skipped
+            if refreshed:
+                state.failures += 1
+            if state.failures >= MAX_REFRESHES and not state.blocked:
+                state.blocked = True
+                print(colored(f"🛑 {host} still answers with challenge pages after {state.failures} cookie "
+                              f"refreshes; skipping it for the rest of the run", "red"))
+            _record(skipped=1)
+            raise ChallengePage(f"challenge page after cookie refresh ({reason})", url)
+        _record(recovered=1)
+        return response
+
+    def _refresh(self, session, url, state):
+        """
+        Refresh the host's cookies once (other threads wait for it). Returns True when this call
+        refreshed them, False when another one just did, None when the fetch cannot be re-sent.
+        """
+        if self.refresher is None:
+            # Detection only (replay, or no browser): skip the page, keep fetching the host
+            return None
+        with self._lock:
+            if state.blocked:
+                return None
+            if state.refreshing is not None:
+                event = state.refreshing
+            elif state.refreshed_at is not None and time.monotonic() - state.refreshed_at < REFRESH_GRACE:
+                # Sent with the old cookies while the refresh was running
+                return False
+            else:
+                event = None
+                state.refreshing = threading.Event()
+        if event is not None:
+            event.wait(REFRESH_TIMEOUT)
+            return None if state.blocked or state.refreshed_at is None else False
+
+        ok = False
+        try:
+            with self._refresh_lock:
+                cookies = self.refresher(url)
+            if cookies:
+                session.cookies.update(cookies)
+                ok = True
+        except Exception as e:
+            print(colored(f"   Cookie refresh failed: {e}", "red"))
+        finally:
+            with self._lock:
+                if ok:
+                    _record(refreshed=1)
+                    state.refreshed_at = time.monotonic()
+                    print(colored(f"🍪 Session cookies refreshed; resuming {urllib.parse.urlparse(url).netloc}",
+                                  "green"))
+                else:
+                    _record(refresh_failed=1)
+                    state.failures += 1
+                    if state.failures >= MAX_REFRESHES:
+                        state.blocked = True
+                        print(colored(f"🛑 Cookie refresh failed {state.failures} times; skipping "
+                                      f"{urllib.parse.urlparse(url).netloc} for the rest of the run", "red"))
+                event, state.refreshing = state.refreshing, None
+            event.set()
+        return True if ok else None
+
+    def print_stats(self):
+        """Print the challenge section of the run summary."""
+        with _stats_lock:
+            stats = dict(CHALLENGE_STATS)
+        if not stats['detected']:
+            return
+        blocked = [host for host, state in self._hosts.items() if state.blocked]
+        print(colored(f"🛑 Challenge pages: {stats['detected']} detected, {stats['refreshed']} cookie refreshes "
+                      f"({stats['refresh_failed']} failed), {stats['recovered']} pages recovered, "
+                      f"{stats['skipped']} skipped", "white"))
+        if blocked:
+            print(colored(f"   Skipped hosts: {', '.join(blocked)}", "white"))
+
+
+def browser_refresher(driver, manual=False, settle=BROWSER_SETTLE):
+    """Refresh cookies by loading the page in the kept-alive Selenium browser."""
+    def refresh(url):
+        from selenium.common.exceptions import TimeoutException
+        print(colored(f"   Reloading {url} in the browser to renew the session...", "cyan"))
+        try:
+            driver.get(url)
+        except TimeoutException:
+            driver.execute_script("window.stop();")
+        if manual:
+            input(colored("   Solve the challenge in the browser, then press Enter to resume...", "yellow"))
+        else:
+            time.sleep(settle)
+        return {cookie['name']: cookie['value'] for cookie in driver.get_cookies()}
+    return refresh
+
+
+def prompt_refresher():
+    """Refresh cookies by asking for a Cookie header (--manual without a browser)."""
+    def refresh(url):
+        print(colored(f"   Open {url} in Tor Browser, solve the challenge and copy the Cookie request header.",
+                      "yellow"))
+        return parse_cookie_header(input(colored("   Cookie: ", "yellow")))
+    return refresh
+
+
+def start(refresher=None, config_path=CHALLENGES_FILE):
+    """Check every fetched page for challenges (called from the scrapers' main())."""
+    guard = ChallengeGuard(refresher, config_path)
+    http_fetch.challenge_guard = guard
+    if refresher is not None:
+        how = "cookies refreshed when a host challenges"
+    else:
+        how = "detection only, challenge pages are skipped"
+    print(colored(f"🛑 Challenge/login page detection on ({how})", "cyan"))
+    return guard
+
+
+def stop():
+    """Uninstall the guard and print its run summary."""
+    guard = http_fetch.challenge_guard
+    if guard is None:
+        return
+    http_fetch.challenge_guard = None
+    guard.print_stats()
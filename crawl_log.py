@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Structured, queued logging for the per-record messages of the scrapers
+
+The scrapers used to print several coloured lines per listing from every
+worker thread; at high concurrency the synchronous terminal writes slow the
+workers down and the noise hides the real problems. Per-record messages now
+go through the "scraper" logger:
+
+    log = crawl_log.get_logger(__name__)
+    log.info("Stored HTML for: %s", url, extra={'event': 'stored', 'url': url})
+
+Until setup() is called the records are printed at once, coloured as before
+(by event, else by level). setup() — called from the scrapers' main() —
+moves the handlers behind a QueueHandler so a worker only enqueues the
+record and a background listener thread does the formatting and writing:
+
+- console: coloured text at --log-level; a message repeated more than
+  RATE_BURST times per RATE_WINDOW seconds (same event, or same format
+  string) is dropped and the next one that gets through says how many
+  were suppressed
+- --log-file FILE: every record as one JSON object per line (time, level,
+  logger, event, message and the extra fields such as url), not rate-limited
+- --progress: a live status line (pages/s, fetch error rate, listings,
+  ETA) replaces the per-record INFO lines on the console; warnings and
+  errors are still printed above it
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from termcolor import colored
+
+import http_fetch
+
+
+LOGGER_NAME = "scraper"
+
+RATE_WINDOW = 10.0        # seconds
+RATE_BURST = 5            # console messages per key and window before they are suppressed
+PROGRESS_INTERVAL = 1.0   # seconds between progress line redraws on a terminal
+PLAIN_PROGRESS_INTERVAL = 30.0   # ... and between progress lines when stdout is not a terminal
+RATE_SPAN = 30.0          # seconds of recent fetches the pages/s figure is taken over
+
+LEVEL_COLORS = {
+    logging.DEBUG: "white",
+    logging.INFO: "cyan",
+    logging.WARNING: "yellow",
+    logging.ERROR: "red",
+    logging.CRITICAL: "red",
+}
+EVENT_COLORS = {
+    'saved': "green",
+    'found': "green",
+    'failed': "red",
+    'stored': "blue",
+    'fetching': "blue",
+    'page': "magenta",
+    'pagination': "blue",
+    'changed': "blue",
+    'unchanged': "white",
+}
+
+# LogRecord attributes that are not extra fields
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'template',
+                                                                            'color', 'suppressed'}
+
+# Serializes console writes with the progress line
+_terminal_lock = threading.RLock()
+
+LOG_STATS = {
+    'records': 0,
+    'suppressed': 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _record(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            LOG_STATS[key] = LOG_STATS.get(key, 0) + value
+
+
+def get_logger(name=None):
+    """The scraper logger, or a child of it ("scraper.<name>")."""
+    if not name or name == '__main__':
+        return logging.getLogger(LOGGER_NAME)
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+class ColorFormatter(logging.Formatter):
+    """The message alone, coloured by its event (or level) the way the scrapers' prints were."""
+
+    def format(self, record):
+        message = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            message += f"  [{record.suppressed} similar messages suppressed]"
+        color = getattr(record, 'color', None) or EVENT_COLORS.get(getattr(record, 'event', None)) \
+            or LEVEL_COLORS.get(record.levelno, "white")
+        return colored(message, color)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record with its extra fields."""
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """Let at most RATE_BURST records per key through every RATE_WINDOW seconds (errors always pass)."""
+
+    def __init__(self, burst=RATE_BURST, window=RATE_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._windows = {}     # key → [window start, passed, suppressed]
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.levelno, getattr(record, 'event', None) or getattr(record, 'template', record.msg))
+        now = time.monotonic()
+        entry = self._windows.get(key)
+        if entry is None or now - entry[0] >= self.window:
+            suppressed = entry[2] if entry is not None else 0
+            self._windows[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if entry[1] < self.burst:
+            entry[1] += 1
+            return True
+        entry[2] += 1
+        _record(suppressed=1)
+        return False
+
+
+class ConsoleHandler(logging.StreamHandler):
+    """Console output that keeps the progress line at the bottom."""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+        self.setFormatter(ColorFormatter())
+
+    def emit(self, record):
+        try:
+            message = self.format(record)
+            with _terminal_lock:
+                active = progress
+                if active is not None:
+                    active.clear_line()
+                self.stream.write(message + '\n')
+                self.stream.flush()
+                if active is not None:
+                    active.draw_line()
+        except Exception:
+            self.handleError(record)
+
+
+class _TemplateQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps the unformatted message for rate limiting."""
+
+    def prepare(self, record):
+        record.template = record.msg
+        _record(records=1)
+        return super().prepare(record)
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class Progress:
+    """Fetch rate, fetch error rate, listings done and ETA, drawn as one live line."""
+
+    def __init__(self, total=None, limit=None):
+        self.total = total            # listings known to be queued
+        self.limit = limit            # --max-products
+        self.fetches = 0
+        self.errors = 0
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self._recent = deque()         # fetch completion times within RATE_SPAN
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._out = sys.stdout
+        self._tty = self._out.isatty()
+        self._drawn = False
+
+    def observe(self, url, seconds, error):
+        """http_fetch observer: every fetch counts toward pages/s and the error rate."""
+        now = time.monotonic()
+        with self._lock:
+            self.fetches += 1
+            if error is not None:
+                self.errors += 1
+            self._recent.append(now)
+            while self._recent and now - self._recent[0] > RATE_SPAN:
+                self._recent.popleft()
+
+    def add_total(self, count):
+        with self._lock:
+            self.total = (self.total or 0) + count
+
+    def item_done(self, ok=True):
+        with self._lock:
+            self.done += 1
+            if not ok:
+                self.failed += 1
+
+    def line(self):
+        now = time.monotonic()
+        with self._lock:
+            span = min(RATE_SPAN, now - self.started) or 1.0
+            rate = len([t for t in self._recent if now - t <= span]) / span
+            error_rate = self.errors / self.fetches if self.fetches else 0.0
+            done, failed, total, limit = self.done, self.failed, self.total, self.limit
+        elapsed = now - self.started
+        target = min(total, limit) if total and limit else (total or limit)
+        listings = f"{done}/{target} listings" if target else f"{done} listings"
+        eta = "—"
+        if target and done:
+            remaining = max(target - done, 0)
+            eta = _format_duration(remaining * elapsed / done)
+        return (f"⏳ {self.fetches} pages ({rate:.1f}/s) | {listings} ({failed} failed) | "
+                f"errors {error_rate:.1%} | {_format_duration(elapsed)} elapsed | ETA {eta}")
+
+    def clear_line(self):
+        if self._tty and self._drawn:
+            self._out.write('\r\x1b[K')
+            self._drawn = False
+
+    def draw_line(self):
+        if self._tty:
+            self._out.write('\r' + colored(self.line(), "white"))
+            self._out.flush()
+            self._drawn = True
+
+    def start(self):
+        interval = PROGRESS_INTERVAL if self._tty else PLAIN_PROGRESS_INTERVAL
+        if self._tty:
+            # The summaries other modules print() also go above the progress line
+            sys.stdout = _LineClearingStream(self._out, self)
+
+        def loop():
+            while not self._stop.wait(interval):
+                with _terminal_lock:
+                    if self._tty:
+                        self.draw_line()
+                    else:
+                        print(colored(self.line(), "white"), flush=True)
+        self._thread = threading.Thread(target=loop, name='progress-line', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=PROGRESS_INTERVAL * 2)
+        if isinstance(sys.stdout, _LineClearingStream):
+            sys.stdout = self._out
+        with _terminal_lock:
+            self.clear_line()
+            print(colored(self.line(), "white"), flush=True)
+
+
+class _LineClearingStream:
+    """sys.stdout while the progress line is drawn: clears the line before anything else is written."""
+
+    def __init__(self, stream, owner):
+        self._stream = stream
+        self._owner = owner
+
+    def write(self, text):
+        with _terminal_lock:
+            self._owner.clear_line()
+            return self._stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+# The active Progress (set by setup(progress=True)); None = no progress line
+progress = None
+_listener = None
+# The --log-level given to setup(); stop() keeps printing at it
+_level = logging.INFO
+
+
+def add_total(count):
+    """Listings queued for fetching (for the progress line's ETA)."""
+    active = progress
+    if active is not None and count:
+        active.add_total(count)
+
+
+def item_done(ok=True):
+    """One listing finished (stored, or failed for good)."""
+    active = progress
+    if active is not None:
+        active.item_done(ok)
+
+
+def _install(handlers, level):
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    for handler in handlers:
+        logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def setup(level='INFO', log_file=None, show_progress=False, limit=None):
+    """Queue the scraper's log records to a background writer (called from the scrapers' main())."""
+    global progress, _listener, _level
+    level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    _level = level
+    console = ConsoleHandler()
+    console.addFilter(RateLimitFilter())
+    # With the progress line only warnings and errors are printed as lines
+    console.setLevel(max(level, logging.WARNING) if show_progress else level)
+    handlers = [console]
+    if log_file:
+        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        file_handler.setLevel(level)
+        handlers.append(file_handler)
+
+    if show_progress:
+        progress = Progress(limit=limit)
+        http_fetch.observers.append(progress.observe)
+        progress.start()
+
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    _install([_TemplateQueueHandler(records)], min(handler.level for handler in handlers))
+    if log_file:
+        print(colored(f"📝 Logging {logging.getLevelName(level)} records as JSON lines to {log_file}", "cyan"))
+
+
+def stop():
+    """Flush the queued records, end the progress line and go back to direct console output."""
+    global progress, _listener
+    if _listener is None and progress is None:
+        return
+    listener, _listener = _listener, None
+    if listener is not None:
+        console = ConsoleHandler()
+        console.setLevel(_level)
+        _install([console], _level)
+        listener.stop()
+        for handler in listener.handlers:
+            if isinstance(handler, logging.FileHandler):
+                handler.close()
+    active, progress = progress, None
+    if active is not None:
+        if active.observe in http_fetch.observers:
+            http_fetch.observers.remove(active.observe)
+        active.stop()
+    with _stats_lock:
+        suppressed = LOG_STATS['suppressed']
+    if suppressed:
+        print(colored(f"📝 {suppressed} repeated log messages were not printed "
+                      f"(over {RATE_BURST} per {RATE_WINDOW:.0f}s)", "white"))
+
+
+# Direct, unqueued console output until setup() is called (and for the standalone tools)
+_install([ConsoleHandler()], logging.INFO)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Shared pieces for crawling several categories at once
+
+- DedupeIndex: thread-safe set of URLs; claim() atomically reserves a URL so
+  two categories listing the same product fetch it once
+- Budget: global --max-products counter shared by all category tasks
+- FairScheduler: one work queue per category feeding a bounded thread pool
+  round-robin, so a category with thousands of pages cannot starve the others
+  and a stalled one only holds the workers it already has
+- HostLimiter: caps concurrent requests per host across all categories
+"""
+
+import threading
+import urllib.parse
+from collections import OrderedDict, deque
+from concurrent.futures import wait, FIRST_COMPLETED
+from contextlib import contextmanager
+
+
+class DedupeIndex:
+    """Thread-safe set of URLs already fetched or being fetched."""
+
+    def __init__(self, urls=()):
+        self._urls = set(urls)
+        self._lock = threading.Lock()
+
+    def claim(self, url):
+        """Reserve a URL; returns False if it was already claimed."""
+        with self._lock:
+            if url in self._urls:
+                return False
+            self._urls.add(url)
+            return True
+
+    def release(self, url):
+        """Give a URL back (its fetch failed) so it can be claimed again."""
+        with self._lock:
+            self._urls.discard(url)
+
+    def __contains__(self, url):
+        with self._lock:
+            return url in self._urls
+
+    def __len__(self):
+        with self._lock:
+            return len(self._urls)
+
+
+class Budget:
+    """Global product budget (None = unlimited) shared by all workers."""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one unit of the budget; returns False when it is spent."""
+        with self._lock:
+            if self.limit is not None and self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+    def release(self):
+        """Return a unit taken for a fetch that did not produce a product."""
+        with self._lock:
+            self.used = max(self.used - 1, 0)
+
+    @property
+    def exhausted(self):
+        with self._lock:
+            return self.limit is not None and self.used >= self.limit
+
+
+class FairScheduler:
+    """
+    Round-robin dispatch of per-category work onto a thread pool.
+
+    push(category, tag, fn, *args) queues fn(*args) for a category; run()
+    keeps at most max_in_flight calls running, taking the next one from each
+    category in turn, and yields (category, tag, result, error) as calls
+    complete. Handlers may push more work while iterating.
+    """
+
+    def __init__(self, pool, max_in_flight):
+        self.pool = pool
+        self.max_in_flight = max(1, max_in_flight)
+        self.queues = OrderedDict()
+        self._ring = deque()
+        self._pending = {}
+
+    def push(self, category, tag, fn, *args):
+        if category not in self.queues:
+            self.queues[category] = deque()
+            self._ring.append(category)
+        self.queues[category].append((tag, fn, args))
+
+    def queued(self):
+        """(category, tag) of all work not finished yet: running calls first, then queued ones."""
+        return list(self._pending.values()) + [
+            (category, tag) for category, queue in self.queues.items() for tag, _, _ in queue]
+
+    def clear(self):
+        """Drop everything not dispatched yet (e.g. once the budget is spent)."""
+        for queue in self.queues.values():
+            queue.clear()
+
+    def _dispatch(self):
+        while len(self._pending) < self.max_in_flight:
+            for _ in range(len(self._ring)):
+                category = self._ring[0]
+                self._ring.rotate(-1)
+                if self.queues[category]:
+                    tag, fn, args = self.queues[category].popleft()
+                    self._pending[self.pool.submit(fn, *args)] = (category, tag)
+                    break
+            else:
+                return
+
+    def run(self):
+        try:
+            self._dispatch()
+            while self._pending:
+                done, _ = wait(self._pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    category, tag = self._pending.pop(future)
+                    error = future.exception()
+                    yield category, tag, None if error else future.result(), error
+                self._dispatch()
+        finally:
+            for future in self._pending:
+                future.cancel()
+
+
+class HostLimiter:
+    """Caps concurrent requests per host; onion services choke on parallel hits."""
+
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    @contextmanager
+    def slot(self, url):
+        host = urllib.parse.urlparse(url).netloc
+        with self._lock:
+            semaphore = self._slots.setdefault(host, threading.BoundedSemaphore(self.per_host))
+        with semaphore:
+            yield
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Columnar Parquet export of archived product data
+
+This exporter:
+1. Streams products_html.json one record at a time (no full json.load)
+2. Maps the fields from extract_product_details onto a typed Arrow schema
+3. Folds the dynamic desc_* keys into a single map<string, string> column
+4. Writes Hive-style partitions: market=<netloc>/crawl_date=<YYYY-MM-DD>/
+
+The raw HTML goes to a separate "html" dataset keyed by listing_url and
+fetched_at, so analytical queries over "listings" never read it.
+
+Usage:
+    python3 export_parquet.py --input products_html.json --output-dir products_parquet
+"""
+
+import argparse
+import datetime
+import math
+import os
+import re
+import urllib.parse
+from termcolor import colored
+
+from archive_io import iter_json_array, record_url, record_category_page
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+# Input/Output defaults
+PRODUCTS_HTML_FILE = "products_html.json"
+PARQUET_OUTPUT_DIR = "products_parquet"
+
+# Rows buffered per partition before a row group is written
+DEFAULT_BATCH_SIZE = 5000
+
+
+def listings_schema(normalized=False):
+    """Typed schema for the listings dataset (everything except raw HTML)."""
+    fields = [
+        ('listing_url', pa.string()),
+        ('category_page', pa.string()),
+        ('fetched_at', pa.timestamp('s', tz='UTC')),
+        ('title', pa.string()),
+        ('price', pa.string()),
+        ('price_numeric', pa.float64()),
+        ('stock_raw', pa.string()),
+        ('stock_status', pa.string()),
+        ('in_stock_count', pa.int32()),
+        ('description', pa.string()),
+        ('desc', pa.map_(pa.string(), pa.string())),
+        ('categories', pa.list_(pa.string())),
+        ('primary_category', pa.string()),
+        ('sku', pa.string()),
+        ('rating_percent', pa.float32()),
+        ('rating_stars', pa.float32()),
+        ('review_count', pa.int32()),
+        ('reviews', pa.list_(pa.struct([
+            ('text', pa.string()),
+            ('author', pa.string()),
+            ('rating', pa.float32()),
+        ]))),
+        ('variations', pa.list_(pa.struct([
+            ('option', pa.string()),
+            ('value', pa.string()),
+        ]))),
+        ('price_tiers', pa.list_(pa.struct([
+            ('quantity', pa.int32()),
+            ('price', pa.float64()),
+        ]))),
+        ('images', pa.list_(pa.string())),
+        ('main_image', pa.string()),
+    ]
+    if normalized:
+        # Columns filled by price_normalize.normalize_records
+        fields += [
+            ('price_min', pa.float64()),
+            ('price_max', pa.float64()),
+            ('currency', pa.string()),
+            ('in_stock', pa.int8()),
+        ]
+    return pa.schema(fields)
+
+
+def html_schema():
+    """Schema for the raw HTML dataset, joinable on (listing_url, fetched_at)."""
+    return pa.schema([
+        ('listing_url', pa.string()),
+        ('fetched_at', pa.timestamp('s', tz='UTC')),
+        ('html', pa.large_string()),
+    ])
+
+
+def _to_float(value):
+    """12.5 / "12.50" / "$12.50" / "12.50 USD" / "€1.299,00" → float (None when there is no number)."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # Currency signs, codes and separators: the same token rules as --normalize
+    from price_normalize import NUMBER_RE, parse_number_tokens
+
+    match = NUMBER_RE.search(str(value))
+    return float(parse_number_tokens([match.group(0)])[0]) if match else None
+
+
+def _to_int(value):
+    if value is None:
+        return None
+    match = re.search(r'\d+', str(value))
+    return int(match.group(0)) if match else None
+
+
+def _partition_values(record):
+    """Return (market, crawl_date) used to partition a record."""
+    market = record.get('market')
+    if not market:
+        market = urllib.parse.urlparse(record_url(record) or '').netloc or 'unknown'
+    fetched_at = record.get('fetched_at') or 0
+    crawl_date = datetime.datetime.fromtimestamp(int(fetched_at), datetime.timezone.utc).strftime('%Y-%m-%d')
+    return market, crawl_date
+
+
+def flatten_record(record):
+    """Map an archive record onto the listings schema columns."""
+    desc = [(key[len('desc_'):], str(value)) for key, value in record.items()
+            if key.startswith('desc_') and value is not None]
+
+    reviews = [
+        {
+            'text': review.get('text'),
+            'author': review.get('author'),
+            'rating': _to_float(review.get('rating')),
+        }
+        for review in record.get('reviews') or []
+    ]
+
+    price_tiers = [
+        {
+            'quantity': _to_int(tier.get('quantity')),
+            'price': _to_float(tier.get('price')),
+        }
+        for tier in record.get('price_tiers') or []
+    ]
+
+    return {
+        'listing_url': record_url(record),
+        'category_page': record_category_page(record),
+        'fetched_at': int(record.get('fetched_at') or 0),
+        'title': record.get('title'),
+        'price': record.get('price'),
+        'price_numeric': _to_float(record.get('price_numeric')),
+        'stock_raw': record.get('stock_raw'),
+        'stock_status': record.get('stock_status'),
+        'in_stock_count': _to_int(record.get('in_stock_count')),
+        'description': record.get('description'),
+        'desc': desc,
+        'categories': record.get('categories'),
+        'primary_category': record.get('primary_category'),
+        'sku': record.get('sku'),
+        'rating_percent': _to_float(record.get('rating_percent')),
+        'rating_stars': _to_float(record.get('rating_stars')),
+        'review_count': _to_int(record.get('review_count')),
+        'reviews': reviews or None,
+        'variations': record.get('variations'),
+        'price_tiers': price_tiers or None,
+        'images': record.get('images'),
+        'main_image': record.get('main_image'),
+    }
+
+
+class PartitionedParquetWriter:
+    """Buffers rows per partition and appends them as Parquet row groups."""
+
+    def __init__(self, root, schema, batch_size=DEFAULT_BATCH_SIZE):
+        self.root = root
+        self.schema = schema
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.writers = {}
+        self.rows_written = 0
+
+    def add(self, partition, row):
+        rows = self.buffers.setdefault(partition, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self._flush(partition)
+
+    def _flush(self, partition):
+        rows = self.buffers.get(partition)
+        if not rows:
+            return
+        writer = self.writers.get(partition)
+        if writer is None:
+            market, crawl_date = partition
+            part_dir = os.path.join(self.root, f"market={market}", f"crawl_date={crawl_date}")
+            os.makedirs(part_dir, exist_ok=True)
+            writer = pq.ParquetWriter(os.path.join(part_dir, "part-00000.parquet"), self.schema,
+                                      compression='zstd')
+            self.writers[partition] = writer
+        writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+        self.rows_written += len(rows)
+        self.buffers[partition] = []
+
+    def close(self):
+        for partition in list(self.buffers):
+            self._flush(partition)
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+
+def _apply_normalization(batch):
+    """Fill the normalized price/stock columns for a batch of (record, row) pairs."""
+    from price_normalize import normalize_records
+
+    columns = normalize_records([record for record, _ in batch])
+    for i, (_, row) in enumerate(batch):
+        row['price_min'] = None if math.isnan(columns['price_min'][i]) else float(columns['price_min'][i])
+        row['price_max'] = None if math.isnan(columns['price_max'][i]) else float(columns['price_max'][i])
+        row['currency'] = columns['currency'][i] or None
+        row['in_stock'] = int(columns['in_stock'][i])
+        if columns['in_stock_count'][i] >= 0:
+            row['in_stock_count'] = int(columns['in_stock_count'][i])
+
+
+def export_archive(input_path, output_dir, batch_size=DEFAULT_BATCH_SIZE, include_html=True, extract=False,
+                   normalize=False):
+    """Stream an archive into partitioned listings (and optionally html) datasets."""
+    extract_details = None
+    if extract:
+        # Imported lazily: scrape_old pulls in selenium at import time
+        from bs4 import BeautifulSoup
+        from scrape_old import extract_product_details
+        extract_details = lambda html, url: extract_product_details(BeautifulSoup(html, 'html.parser'), url, html)
+
+    listings = PartitionedParquetWriter(os.path.join(output_dir, 'listings'), listings_schema(normalize), batch_size)
+    html_out = PartitionedParquetWriter(os.path.join(output_dir, 'html'), html_schema(), batch_size) if include_html else None
+
+    # Normalization works column-wise, so rows are staged in batches first
+    pending = []
+
+    def flush_pending():
+        if normalize:
+            _apply_normalization(pending)
+        for record, row in pending:
+            listings.add(_partition_values(record), row)
+        pending.clear()
+
+    count = 0
+    try:
+        for record in iter_json_array(input_path):
+            if not isinstance(record, dict):
+                continue
+            html = record.get('html')
+            # scrape_simple records carry only raw HTML; extract on the fly if asked
+            if extract_details and html and 'title' not in record:
+                record = {**extract_details(html, record_url(record)), **record}
+
+            row = flatten_record(record)
+            pending.append(({key: value for key, value in record.items() if key != 'html'}, row))
+            if len(pending) >= batch_size:
+                flush_pending()
+            if html_out is not None and html:
+                html_out.add(_partition_values(record), {
+                    'listing_url': row['listing_url'],
+                    'fetched_at': row['fetched_at'],
+                    'html': html,
+                })
+
+            count += 1
+            if count % 10000 == 0:
+                print(colored(f"  ... {count} records exported", "blue"))
+        flush_pending()
+    finally:
+        listings.close()
+        if html_out is not None:
+            html_out.close()
+
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export archived product data to partitioned Parquet')
+    parser.add_argument('--input', type=str, default=PRODUCTS_HTML_FILE,
+                       help=f'Archive to export (default: {PRODUCTS_HTML_FILE})')
+    parser.add_argument('--output-dir', type=str, default=PARQUET_OUTPUT_DIR,
+                       help=f'Output dataset root (default: {PARQUET_OUTPUT_DIR})')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                       help=f'Rows per row group per partition (default: {DEFAULT_BATCH_SIZE})')
+    parser.add_argument('--no-html', action='store_true',
+                       help='Skip writing the separate raw HTML dataset')
+    parser.add_argument('--normalize', action='store_true',
+                       help='Add price_min/price_max/currency/in_stock columns (requires numpy)')
+    parser.add_argument('--extract', action='store_true',
+                       help='Run extract_product_details on records without parsed fields (scrape_simple output)')
+
+    args = parser.parse_args()
+
+    if pa is None:
+        print(colored("pyarrow not installed. Install with: pip install pyarrow", "red"))
+        return
+
+    if not os.path.exists(args.input):
+        print(colored(f"❌ {args.input} not found!", "red"))
+        return
+
+    if os.path.exists(args.output_dir) and os.listdir(args.output_dir):
+        print(colored(f"❌ {args.output_dir} already exists and is not empty", "red"))
+        return
+
+    print(colored(f"📦 Exporting {args.input} → {args.output_dir}", "cyan"))
+    count = export_archive(args.input, args.output_dir, args.batch_size,
+                           include_html=not args.no_html, extract=args.extract,
+                           normalize=args.normalize)
+
+    print(colored(f"✅ Exported {count} records", "green"))
+    print(colored(f"   Listings: {os.path.join(args.output_dir, 'listings')}", "green"))
+    if not args.no_html:
+        print(colored(f"   HTML:     {os.path.join(args.output_dir, 'html')}", "green"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Per-market extraction profiles
+
+The extractors try long generic selector chains ("h1.product_title", then
+"h1.entry-title", ... then "h1") on every page. A market uses the same theme
+on all of its pages, so after a few pages we know which selector of each chain
+actually matches there. A profile records, per market (netloc) and chain, how
+often each selector won. Selectors that have matched keep their place in
+the chain (most specific first); those that never matched on that market
+are moved to the end and, once the chain has matched on enough pages, are
+no longer probed. A chain that has never matched is always tried in full:
+a market's first pages may all be of another kind (detail pages for the
+listing chains).
+
+Profiles live in extraction_profiles.json and can be edited by hand:
+
+    {
+      "markets": {
+        "drugj7....onion": {
+          "overrides": {
+            "detail.title": {"pin": "h1.product_title"},
+            "detail.price": {"order": [".summary .price ins", ".summary .price"]}
+          },
+          "chains": { ...learned statistics... }
+        }
+      }
+    }
+
+"pin" uses only that selector; "order" tries the listed selectors first (they
+may be selectors the scraper does not know) and then the default chain.
+
+    python3 extraction_profiles.py                          # show profiles
+    python3 extraction_profiles.py --pin MARKET detail.title "h1.product_title"
+    python3 extraction_profiles.py --reset MARKET
+"""
+
+import argparse
+import json
+import os
+import threading
+from termcolor import colored
+
+
+PROFILES_FILE = "extraction_profiles.json"
+
+LEARN_AFTER = 3       # pages seen before a chain is reordered
+SKIP_AFTER = 10       # pages a selector must miss (while its chain matched) before it is skipped
+REPROBE_EVERY = 50    # ... but every Nth page the full chain is tried again
+
+
+class ProfileStore:
+    """Selector statistics and overrides per market, persisted as JSON."""
+
+    def __init__(self, path=PROFILES_FILE, learn=True, frozen=False):
+        self.path = path
+        self.learn = learn
+        # frozen: apply the loaded statistics but queue new observations in self.pending
+        # (for parse processes, whose observations are replayed into the main process's store)
+        self.frozen = frozen
+        self.pending = []
+        self.markets = {}
+        self.probes = 0
+        self.default_probes = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.markets = json.load(f).get('markets', {})
+            except Exception as e:
+                print(colored(f"⚠️  Could not load {path} ({e}); starting with empty profiles", "yellow"))
+
+    def _chain(self, market, chain):
+        profile = self.markets.setdefault(market, {})
+        return profile.setdefault('chains', {}).setdefault(chain, {'calls': 0, 'hits': {}})
+
+    def _override(self, market, chain):
+        return self.markets.get(market, {}).get('overrides', {}).get(chain)
+
+    def ordered(self, market, chain, selectors):
+        """Selectors of a chain in the order to try them on this market."""
+        if not market:
+            return list(selectors)
+        override = self._override(market, chain)
+        if override:
+            if override.get('pin'):
+                return [override['pin']]
+            if override.get('order'):
+                return list(dict.fromkeys(list(override['order']) + list(selectors)))
+        if not self.learn:
+            return list(selectors)
+        stats = self.markets.get(market, {}).get('chains', {}).get(chain)
+        if not stats or stats['calls'] < LEARN_AFTER or stats['calls'] % REPROBE_EVERY == 0:
+            # Re-probes run the chain in its own order, so a specific selector that was
+            # moved behind a generic one gets another chance to match
+            return list(selectors)
+        hits = stats['hits']
+        # Stable sort: the chain order stays among the selectors that matched
+        return sorted(selectors, key=lambda selector: 0 if hits.get(selector) else 1)
+
+    def _record(self, market, chain, matched):
+        if not market or not self.learn:
+            return
+        if self.frozen:
+            with self._lock:
+                self.pending.append((market, chain, list(matched)))
+            return
+        with self._lock:
+            stats = self._chain(market, chain)
+            stats['calls'] += 1
+            for selector in matched:
+                stats['hits'][selector] = stats['hits'].get(selector, 0) + 1
+
+    def _settled(self, market, chain):
+        """
+        True when a chain has matched and been seen often enough to skip its
+        selectors that never matched. A chain without any hit is never settled.
+        """
+        if not market or not self.learn:
+            return False
+        stats = self.markets.get(market, {}).get('chains', {}).get(chain)
+        return (bool(stats) and bool(stats['hits']) and stats['calls'] >= SKIP_AFTER
+                and stats['calls'] % REPROBE_EVERY != 0)
+
+    def first(self, market, chain, selectors, probe):
+        """
+        Try selectors until probe(selector) returns something truthy.
+        Returns (selector, result), or (None, None) when nothing matched.
+        Selectors that never matched on this market are skipped between re-probes.
+        """
+        candidates = self.ordered(market, chain, selectors)
+        if self._settled(market, chain) and not self._override(market, chain):
+            hits = self.markets[market]['chains'][chain]['hits']
+            candidates = [selector for selector in candidates if hits.get(selector)]
+
+        tried = 0
+        for selector in candidates:
+            tried += 1
+            result = probe(selector)
+            if result:
+                self._count(tried, selectors.index(selector) + 1 if selector in selectors else len(selectors))
+                self._record(market, chain, [selector])
+                return selector, result
+        self._count(tried, len(selectors))
+        self._record(market, chain, [])
+        return None, None
+
+    def collect(self, market, chain, selectors, probe):
+        """
+        Run every selector of a collect-all chain (in chain order) and return
+        the (selector, result) pairs that matched. Selectors that have never
+        matched on this market are skipped, except on periodic re-probes.
+        """
+        override = self._override(market, chain) if market else None
+        if override and override.get('pin'):
+            candidates = [override['pin']]
+        else:
+            candidates = list(selectors)
+            if self._settled(market, chain):
+                hits = self.markets[market]['chains'][chain]['hits']
+                candidates = [selector for selector in candidates if hits.get(selector)]
+
+        matched = []
+        for selector in candidates:
+            result = probe(selector)
+            if result:
+                matched.append((selector, result))
+        self._count(len(candidates), len(selectors))
+        self._record(market, chain, [selector for selector, _ in matched])
+        return matched
+
+    def take_pending(self):
+        """The observations queued by a frozen store since the last call."""
+        with self._lock:
+            pending, self.pending = self.pending, []
+        return pending
+
+    def replay(self, observations):
+        """Record observations taken from a frozen store (see take_pending())."""
+        for market, chain, matched in observations:
+            self._record(market, chain, matched)
+
+    def _count(self, probes, default_probes):
+        with self._lock:
+            self.probes += probes
+            self.default_probes += default_probes
+
+    def save(self, path=None):
+        """Write the profiles (atomic replace)."""
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            data = json.dumps({'markets': self.markets}, ensure_ascii=False, indent=2, sort_keys=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def print_stats(self):
+        """Print the profile section of the run summary."""
+        if not self.default_probes:
+            return
+        print(colored(f"🧭 Extraction profiles: {self.probes} selector probes instead of {self.default_probes} "
+                      f"with the default chains ({len(self.markets)} markets)", "white"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show or edit per-market extraction profiles')
+    parser.add_argument('--profiles', type=str, default=PROFILES_FILE,
+                       help=f'Profiles file (default: {PROFILES_FILE})')
+    parser.add_argument('--pin', nargs=3, metavar=('MARKET', 'CHAIN', 'SELECTOR'),
+                       help='Always use SELECTOR for CHAIN on MARKET')
+    parser.add_argument('--unpin', nargs=2, metavar=('MARKET', 'CHAIN'),
+                       help='Remove the override of CHAIN on MARKET')
+    parser.add_argument('--reset', metavar='MARKET', help='Forget everything learned for MARKET')
+
+    args = parser.parse_args()
+
+    store = ProfileStore(args.profiles)
+    changed = False
+    if args.pin:
+        market, chain, selector = args.pin
+        store.markets.setdefault(market, {}).setdefault('overrides', {})[chain] = {'pin': selector}
+        changed = True
+    if args.unpin:
+        market, chain = args.unpin
+        store.markets.get(market, {}).get('overrides', {}).pop(chain, None)
+        changed = True
+    if args.reset:
+        store.markets.get(args.reset, {}).pop('chains', None)
+        changed = True
+    if changed:
+        store.save()
+
+    for market, profile in sorted(store.markets.items()):
+        print(colored(market, "cyan", attrs=['bold']))
+        for chain, override in sorted(profile.get('overrides', {}).items()):
+            print(colored(f"  {chain:<22} override {override}", "yellow"))
+        for chain, stats in sorted(profile.get('chains', {}).items()):
+            hits = sorted(stats['hits'].items(), key=lambda item: -item[1])
+            summary = ', '.join(f"{selector} ×{count}" for selector, count in hits[:3]) or 'no match'
+            print(f"  {chain:<22} {stats['calls']:>6} pages  {summary}")
+
+
+if __name__ == "__main__":
+    main()
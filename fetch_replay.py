@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Record/replay layer under http_fetch.fetch() (--record / --replay)
+
+With --record DIR every fetch of a real crawl is written to a replay bundle:
+
+    DIR/exchanges.jsonl   one line per fetch: URL, status, headers, latency,
+                          error (timeouts, aborts...), body offset/length
+    DIR/bodies.dat        response bodies, back to back
+
+With --replay DIR the same scraper runs against the bundle instead of Tor:
+scrape_page(), fetch_page_html() and the keyword crawl get the recorded
+responses (or raise the recorded errors) in the order they were recorded
+for each URL. The browser session, politeness delays and retry backoff are
+skipped, so the crawl loop, dedupe and persistence run as fast as they can;
+--replay-latency sleeps each recorded network latency, to see the crawl
+loop under realistic fetch times. The run summary shows the throughput, so a
+crawl-loop change can be measured (and regressions bisected) offline:
+
+    python3 scrape_simple.py --record bundles/market1 --socks --manual --paginate
+    python3 scrape_simple.py --replay bundles/market1 --paginate
+    python3 fetch_replay.py bundles/market1          # what a bundle contains
+
+URLs the bundle has no response for are skipped like an aborted download.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+import requests
+from requests.structures import CaseInsensitiveDict
+from termcolor import colored
+
+import http_fetch
+import mirrors
+from http_fetch import FetchAborted
+
+
+EXCHANGES_FILE = "exchanges.jsonl"
+BODIES_FILE = "bodies.dat"
+
+REPLAY_STATS = {
+    'served': 0,
+    'errors': 0,
+    'not_recorded': 0,
+    'recorded_latency': 0.0,
+    'started': None,
+}
+_stats_lock = threading.Lock()
+
+# The active Recorder or Replayer (None: fetches go to the network)
+active = None
+
+
+class NotRecorded(FetchAborted):
+    """The replay bundle has no response for this URL."""
+
+    def __init__(self, url):
+        super().__init__("not in replay bundle", url)
+
+
+def _record(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            REPLAY_STATS[key] = REPLAY_STATS.get(key, 0) + value
+
+
+class Recorder:
+    """Writes every fetch made through http_fetch.fetch() into a replay bundle."""
+
+    replaying = False
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._exchanges = open(os.path.join(directory, EXCHANGES_FILE), 'a', encoding='utf-8')
+        self._bodies = open(os.path.join(directory, BODIES_FILE), 'ab')
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def fetch(self, session, url, live_fetch, **kwargs):
+        started = time.monotonic()
+        try:
+            response = live_fetch(session, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            self._write(url, time.monotonic() - started, error=e)
+            raise
+        self._write(url, time.monotonic() - started, response=response)
+        return response
+
+    def _write(self, url, latency, response=None, error=None):
+        # Keyed by canonical URL so a crawl routed to mirrors replays without --mirrors
+        exchange = {'url': mirrors.canonical(url), 'at': time.time(), 'latency': round(latency, 4)}
+        if exchange['url'] != url:
+            exchange['fetched_url'] = url
+        body = b''
+        if response is not None:
+            body = response.content or b''
+            exchange.update(status=response.status_code, reason=response.reason,
+                            headers=dict(response.headers), final_url=response.url)
+        else:
+            exchange.update(error=type(error).__name__, message=str(error),
+                            reason=getattr(error, 'reason', None),
+                            bytes_saved=getattr(error, 'bytes_saved', 0))
+        with self._lock:
+            exchange['offset'] = self._bodies.tell()
+            exchange['length'] = len(body)
+            if body:
+                self._bodies.write(body)
+                self._bodies.flush()
+            self._exchanges.write(json.dumps(exchange, ensure_ascii=False) + '\n')
+            self._exchanges.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._exchanges.close()
+            self._bodies.close()
+
+
+def load_exchanges(directory):
+    """Recorded exchanges of a bundle, in recording order."""
+    exchanges = []
+    with open(os.path.join(directory, EXCHANGES_FILE), 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                exchanges.append(json.loads(line))
+            except ValueError:
+                break  # last line of a recording that was killed
+    return exchanges
+
+
+class Replayer:
+    """Serves fetches from a replay bundle, at recorded latency or as fast as possible."""
+
+    replaying = True
+
+    def __init__(self, directory, latency=False):
+        self.directory = directory
+        self.latency = latency
+        self._queues = {}
+        for exchange in load_exchanges(directory):
+            self._queues.setdefault(exchange['url'], deque()).append(exchange)
+        self._bodies = open(os.path.join(directory, BODIES_FILE), 'rb')
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _next(self, url):
+        """Next recorded exchange for a URL; the last one repeats once the recording runs out."""
+        with self._lock:
+            queue = self._queues.get(url)
+            if not queue:
+                return None, b''
+            exchange = queue.popleft() if len(queue) > 1 else queue[0]
+            self._bodies.seek(exchange['offset'])
+            return exchange, self._bodies.read(exchange['length'])
+
+    def fetch(self, session, url, live_fetch, **kwargs):
+        exchange, body = self._next(url)
+        if exchange is None:
+            _record(not_recorded=1)
+            raise NotRecorded(url)
+        _record(recorded_latency=exchange['latency'])
+        if self.latency:
+            time.sleep(exchange['latency'])
+
+        if exchange.get('error'):
+            _record(errors=1)
+            if exchange['error'] in ('FetchAborted', 'NotRecorded'):
+                raise FetchAborted(exchange.get('reason') or exchange['message'], url, exchange.get('bytes_saved', 0))
+            error_class = getattr(requests.exceptions, exchange['error'], requests.exceptions.RequestException)
+            raise error_class(exchange['message'])
+
+        _record(served=1)
+        http_fetch._record(requests=1, bytes_downloaded=len(body))
+        response = requests.Response()
+        response.status_code = exchange['status']
+        response.reason = exchange.get('reason')
+        response.headers = CaseInsensitiveDict(exchange.get('headers') or {})
+        response.url = exchange.get('final_url') or url
+        response._content = body
+        response._content_consumed = True
+        return response
+
+    def close(self):
+        with self._lock:
+            self._bodies.close()
+
+
+def start(record=None, replay=None, latency=False):
+    """Install a Recorder or Replayer under http_fetch.fetch() (called from the scrapers' main())."""
+    global active
+    if replay:
+        active = Replayer(replay, latency=latency)
+        print(colored(f"▶️  Replaying {len(active)} recorded fetches from {replay}"
+                      f"{' at recorded latency' if latency else ''}", "cyan"))
+    elif record:
+        active = Recorder(record)
+        print(colored(f"⏺️  Recording fetches to {record}", "cyan"))
+    else:
+        return None
+    REPLAY_STATS['started'] = time.monotonic()
+    http_fetch.transport = active
+    return active
+
+
+def replaying():
+    """True with --replay: every fetch is answered from the bundle, so the scrapers start no browser or Tor."""
+    return active is not None and active.replaying
+
+
+def pause(seconds):
+    """Politeness delay / retry backoff: a real sleep, skipped when replaying a bundle."""
+    if not replaying():
+        time.sleep(seconds)
+
+
+def stop():
+    """Uninstall the layer and print the record/replay section of the run summary."""
+    global active
+    if active is None:
+        return
+    layer, active = active, None
+    http_fetch.transport = None
+    layer.close()
+    elapsed = time.monotonic() - (REPLAY_STATS['started'] or time.monotonic())
+    if isinstance(layer, Recorder):
+        print(colored(f"⏺️  Recorded {layer.count} fetches to {layer.directory}", "white"))
+        return
+    with _stats_lock:
+        stats = dict(REPLAY_STATS)
+    fetches = stats['served'] + stats['errors']
+    rate = fetches / elapsed if elapsed > 0 else 0.0
+    print(colored(f"▶️  Replay: {stats['served']} responses and {stats['errors']} recorded errors in {elapsed:.2f}s "
+                  f"({rate:.1f} fetches/s; recorded network time {stats['recorded_latency']:.1f}s), "
+                  f"{stats['not_recorded']} URLs not in the bundle", "white"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize a replay bundle recorded with --record')
+    parser.add_argument('bundle', help='Bundle directory')
+    parser.add_argument('--urls', action='store_true', help='List every recorded fetch')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.bundle, EXCHANGES_FILE)):
+        print(colored(f"❌ {args.bundle} is not a replay bundle", "red"))
+        return
+
+    exchanges = load_exchanges(args.bundle)
+    outcomes = Counter(exchange.get('error') or exchange.get('status') for exchange in exchanges)
+    latency = sum(exchange['latency'] for exchange in exchanges)
+    body_bytes = sum(exchange['length'] for exchange in exchanges)
+    print(colored(f"{len(exchanges)} fetches of {len({e['url'] for e in exchanges})} URLs, "
+                  f"{body_bytes / 1024 / 1024:.1f} MB of bodies, {latency:.1f}s of network time", "cyan"))
+    for outcome, count in outcomes.most_common():
+        print(f"  {outcome}: {count}")
+    if args.urls:
+        for exchange in exchanges:
+            outcome = exchange.get('error') or exchange.get('status')
+            print(f"{exchange['latency']:>8.3f}s  {outcome}  {exchange['url']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Bounded page fetching shared by the scrapers
+
+fetch() wraps session.get() with a streamed download that:
+1. Checks Content-Type and Content-Length before reading the body and aborts
+   anything that is not HTML (images, archives, PDFs...)
+2. Enforces a per-page byte cap while streaming
+3. Enforces a total wall-clock limit per page (requests' timeout only covers
+   idle time between bytes, so a slow drip over Tor never times out)
+
+The returned object is the usual requests.Response with its body already
+loaded, so callers keep using .status_code / .content. Aborts raise
+FetchAborted, a RequestException, and the bytes they avoided downloading
+are tallied in FETCH_STATS for the run summary.
+
+The body stays bytes until page_text() decodes it, once per response: the
+encoding comes from the Content-Type charset, else a BOM or <meta charset>
+in the first SNIFF_BYTES, else the encoding the host declared last, else
+UTF-8. requests' own .text would fall back to ISO-8859-1 for text/html
+without a charset, or to charset detection over the whole body when the
+Content-Type is missing, and decodes again on every access.
+"""
+
+import codecs
+import re
+import threading
+import time
+import urllib.parse
+import requests
+from termcolor import colored
+
+
+# Defaults (overridable from the command line of each scraper)
+MAX_PAGE_BYTES = 5 * 1024 * 1024
+TOTAL_TIMEOUT = 90
+CHUNK_SIZE = 64 * 1024
+
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain')
+
+SNIFF_BYTES = 4096
+DEFAULT_ENCODING = 'utf-8'
+
+_META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w:.-]+)', re.I)
+
+# Magic numbers of common binary payloads, used when Content-Type is missing
+BINARY_SIGNATURES = (
+    b'\x89PNG', b'\xff\xd8\xff', b'GIF8', b'RIFF', b'%PDF', b'PK\x03\x04',
+    b'\x1f\x8b', b'7z\xbc\xaf', b'Rar!', b'BZh', b'\x00\x00\x00',
+)
+
+# Record/replay layer installed by fetch_replay.start(); None = straight to the network
+transport = None
+
+# Callables observer(url, seconds, error) told about every fetch (error None on success)
+observers = []
+
+# mirrors.MirrorRouter installed by mirrors.start(); None = fetch the URL as given
+mirror_router = None
+
+# adaptive_timeouts.TimeoutPolicy installed by adaptive_timeouts.start(); None = the callers' fixed timeouts
+timeout_policy = None
+
+# challenge_guard.ChallengeGuard installed by challenge_guard.start(); None = pages are not checked
+challenge_guard = None
+
+FETCH_STATS = {
+    'requests': 0,
+    'bytes_downloaded': 0,
+    'aborted_content_type': 0,
+    'aborted_size': 0,
+    'aborted_time': 0,
+    'bytes_saved': 0,
+    'decoded_pages': 0,
+    'decode_seconds': 0.0,
+    'encoding_header': 0,
+    'encoding_meta': 0,
+    'encoding_cached': 0,
+    'encoding_default': 0,
+}
+_stats_lock = threading.Lock()
+
+# Last encoding each host declared (netloc → codec name), for its pages that declare none
+_host_encodings = {}
+
+
+class FetchAborted(requests.exceptions.RequestException):
+    """The download was stopped early (wrong content type, too big, too slow)."""
+
+    def __init__(self, reason, url, bytes_saved=0):
+        super().__init__(f"{reason}: {url}")
+        self.reason = reason
+        self.url = url
+        self.bytes_saved = bytes_saved
+
+
+def _record(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            FETCH_STATS[key] = FETCH_STATS.get(key, 0) + value
+
+
+def _is_allowed_type(content_type, allowed_types):
+    if not content_type:
+        return True
+    media_type = content_type.split(';', 1)[0].strip().lower()
+    return media_type in allowed_types
+
+
+def _abort(response, reason, url, stat, bytes_saved):
+    response.close()
+    _record(**{stat: 1, 'bytes_saved': bytes_saved})
+    raise FetchAborted(reason, url, bytes_saved)
+
+
+def _iter_body(response):
+    """
+    Yield body chunks as soon as they arrive. iter_content() blocks until a
+    full chunk is buffered, which would hide a slow drip from the time check.
+    """
+    read1 = getattr(response.raw, 'read1', None)
+    if read1 is None:
+        yield from response.iter_content(CHUNK_SIZE)
+        return
+    while True:
+        chunk = read1(CHUNK_SIZE, decode_content=True)
+        if not chunk:
+            return
+        yield chunk
+
+
+def fetch(session, url, timeout=30, max_bytes=None, total_timeout=None, allowed_types=HTML_CONTENT_TYPES,
+          page_type=None, **kwargs):
+    """
+    GET a page with content-type, size and total-time guards; returns the Response.
+    page_type ('category', 'product', ...) selects the latency histogram with --adaptive-timeouts.
+    """
+    router = mirror_router
+    if router is not None and not getattr(transport, 'replaying', False):
+        # Replay bundles are keyed by canonical URL, so only live fetches go to a mirror
+        url = router.route(url)
+    policy = timeout_policy
+    if policy is not None:
+        timeout = policy.timeout(url, page_type, timeout)
+    kwargs.update(timeout=timeout, max_bytes=max_bytes, total_timeout=total_timeout, allowed_types=allowed_types,
+                  page_type=page_type)
+
+    def send():
+        if transport is not None:
+            return transport.fetch(session, url, _fetch_network, **kwargs)
+        return _fetch_network(session, url, **kwargs)
+
+    if policy is not None and not getattr(transport, 'replaying', False):
+        # Hedging would use up the recorded responses of a replay bundle twice as fast
+        call = lambda: policy.run(url, page_type, send)
+    else:
+        call = send
+    guard = challenge_guard
+    if guard is not None and page_type in guard.page_types:
+        unchecked = call
+
+        def call():
+            # Fetches to a host whose cookies are being refreshed wait here; others carry on
+            guard.wait(url)
+            return guard.check(session, url, page_type, unchecked(), unchecked)
+    if not observers:
+        return call()
+
+    started = time.monotonic()
+    try:
+        response = call()
+    except requests.exceptions.RequestException as e:
+        _notify(url, time.monotonic() - started, e)
+        raise
+    _notify(url, time.monotonic() - started, None)
+    return response
+
+
+def _notify(url, seconds, error):
+    for observer in list(observers):
+        try:
+            observer(url, seconds, error)
+        except Exception as e:
+            print(colored(f"Fetch observer failed: {e}", "red"))
+
+
+def _fetch_network(session, url, timeout=30, max_bytes=None, total_timeout=None, allowed_types=HTML_CONTENT_TYPES,
+                   page_type=None, **kwargs):
+    max_bytes = MAX_PAGE_BYTES if max_bytes is None else max_bytes
+    total_timeout = TOTAL_TIMEOUT if total_timeout is None else total_timeout
+    started = time.monotonic()
+
+    policy = timeout_policy
+    try:
+        response = session.get(url, timeout=timeout, stream=True, **kwargs)
+    except requests.exceptions.Timeout:
+        if policy is not None:
+            policy.observe(url, page_type, time.monotonic() - started, timed_out=True)
+        raise
+    if policy is not None:
+        policy.observe(url, page_type, time.monotonic() - started)
+    _record(requests=1)
+
+    content_length = response.headers.get('Content-Length')
+    try:
+        content_length = int(content_length) if content_length is not None else None
+    except ValueError:
+        content_length = None
+
+    if response.status_code == 200 and not _is_allowed_type(response.headers.get('Content-Type'), allowed_types):
+        _abort(response, f"Content-Type {response.headers.get('Content-Type')}", url,
+               'aborted_content_type', content_length or 0)
+
+    if content_length is not None and content_length > max_bytes:
+        _abort(response, f"Content-Length {content_length} exceeds {max_bytes} bytes", url,
+               'aborted_size', content_length)
+
+    body = bytearray()
+    try:
+        for chunk in _iter_body(response):
+            if (not body and not response.headers.get('Content-Type') and 'text/html' in allowed_types
+                    and chunk.startswith(BINARY_SIGNATURES)):
+                _abort(response, "binary payload without Content-Type", url, 'aborted_content_type',
+                       max((content_length or 0) - len(chunk), 0))
+            body.extend(chunk)
+            if len(body) > max_bytes:
+                _abort(response, f"body exceeds {max_bytes} bytes", url, 'aborted_size',
+                       max((content_length or 0) - len(body), 0))
+            if time.monotonic() - started > total_timeout:
+                _abort(response, f"download exceeded {total_timeout}s", url, 'aborted_time',
+                       max((content_length or 0) - len(body), 0))
+    finally:
+        _record(bytes_downloaded=len(body))
+        response.close()
+
+    # Hand the bounded body back to requests so .content / .text work as usual
+    response._content = bytes(body)
+    response._content_consumed = True
+    return response
+
+
+def _codec(name):
+    """Normalized codec name, or None for a missing or unknown charset."""
+    if not name:
+        return None
+    try:
+        return codecs.lookup(name.strip(' "\'')).name
+    except LookupError:
+        return None
+
+
+def _header_charset(content_type):
+    for param in (content_type or '').split(';')[1:]:
+        key, _, value = param.partition('=')
+        if key.strip().lower() == 'charset':
+            return _codec(value)
+    return None
+
+
+def page_encoding(response):
+    """(codec, source) for a response body; source is 'header', 'meta', 'cached' or 'default'."""
+    host = urllib.parse.urlparse(response.url or '').netloc
+    encoding, source = _header_charset(response.headers.get('Content-Type')), 'header'
+    if encoding is None:
+        head = (response.content or b'')[:SNIFF_BYTES]
+        if head.startswith(codecs.BOM_UTF8):
+            encoding, source = 'utf-8-sig', 'meta'
+        else:
+            match = _META_CHARSET.search(head)
+            encoding, source = _codec(match.group(1).decode('ascii', 'ignore')) if match else None, 'meta'
+    if encoding is not None:
+        _host_encodings[host] = encoding
+        return encoding, source
+    encoding = _host_encodings.get(host)
+    if encoding is not None:
+        return encoding, 'cached'
+    return DEFAULT_ENCODING, 'default'
+
+
+def page_text(response):
+    """The response body as text, decoded once (later calls on the same response return the same str)."""
+    text = getattr(response, '_page_text', None)
+    if text is not None:
+        return text
+    started = time.perf_counter()
+    encoding, source = page_encoding(response)
+    text = (response.content or b'').decode(encoding, errors='replace')
+    # A stray .text then uses the same codec instead of guessing
+    response.encoding = encoding
+    response._page_text = text
+    _record(decoded_pages=1, decode_seconds=time.perf_counter() - started, **{f"encoding_{source}": 1})
+    return text
+
+
+def configure(max_bytes=None, total_timeout=None):
+    """Override the module defaults (called from the scrapers' main())."""
+    global MAX_PAGE_BYTES, TOTAL_TIMEOUT
+    if max_bytes is not None:
+        MAX_PAGE_BYTES = max_bytes
+    if total_timeout is not None:
+        TOTAL_TIMEOUT = total_timeout
+
+
+def print_fetch_stats():
+    """Print the fetch section of the run summary."""
+    with _stats_lock:
+        stats = dict(FETCH_STATS)
+    aborted = stats['aborted_content_type'] + stats['aborted_size'] + stats['aborted_time']
+    print(colored(f"📶 Fetch stats: {stats['requests']} requests, "
+                  f"{stats['bytes_downloaded'] / 1024 / 1024:.1f} MB downloaded", "white"))
+    if aborted:
+        print(colored(f"   Early aborts: {aborted} "
+                      f"(content-type: {stats['aborted_content_type']}, size: {stats['aborted_size']}, "
+                      f"time: {stats['aborted_time']}), "
+                      f"{stats['bytes_saved'] / 1024 / 1024:.1f} MB not downloaded", "white"))
+    if stats['decoded_pages']:
+        print(colored(f"   Decoding: {stats['decoded_pages']} pages in {stats['decode_seconds']:.2f}s "
+                      f"(charset from header: {stats['encoding_header']}, <meta>: {stats['encoding_meta']}, "
+                      f"host cache: {stats['encoding_cached']}, default UTF-8: {stats['encoding_default']})",
+                      "white"))
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Content-addressed store of product images (--images)
+
+extract_product_details() collects each listing's image URLs ('images',
+'main_image'). ImagePipeline downloads them through the scraper's session
+(so through the same Tor/Privoxy proxy) on a small thread pool of its own,
+separate from the page workers, so a slow gallery never holds up HTML
+fetches:
+
+    product_images/ab/ab12...ef.jpg          original, named by SHA-256 of its bytes
+    product_images/thumbs/ab/ab12...ef.jpg   JPEG thumbnail (longest side 256 px)
+    product_images/images.db                 image URL → hash; per hash: size, type, perceptual hash
+
+The same vendor photo used on a hundred listings is stored once, and image
+URLs already in images.db are not downloaded again. Each image also gets a
+64-bit difference hash (dHash) that stays nearly the same across re-encodes
+and resizes, for finding listings that reuse a photo:
+
+    python3 image_store.py --similar product_images/ab/ab12...ef.jpg
+    python3 image_store.py --listing http://market.onion/shop/item/
+
+Thumbnails and perceptual hashes need Pillow; without it only the originals
+are stored.
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from termcolor import colored
+
+import crawl_log
+from crawl_scheduler import DedupeIndex
+from http_fetch import FetchAborted
+from retry_policy import fetch_with_retry
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+log = crawl_log.get_logger('images')
+
+IMAGES_DIR = "product_images"
+IMAGES_DB = "images.db"
+THUMBNAIL_SIZE = 256
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+DEFAULT_WORKERS = 2
+SIMILAR_DISTANCE = 6  # dHash bits that may differ for "same photo"
+
+IMAGE_CONTENT_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp')
+
+# File extension by magic number (Content-Type headers on onion shops are unreliable)
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG', 'png'),
+    (b'GIF8', 'gif'),
+    (b'BM', 'bmp'),
+)
+
+IMAGE_STATS = {
+    'downloaded': 0,
+    'bytes_downloaded': 0,
+    'stored': 0,
+    'duplicate_content': 0,
+    'known_urls': 0,
+    'failed': 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _record(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            IMAGE_STATS[key] = IMAGE_STATS.get(key, 0) + value
+
+
+def image_extension(data):
+    for signature, extension in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def difference_hash(image):
+    """64-bit dHash of a PIL image as 16 hex digits: brightness gradients of a 9x8 grayscale copy."""
+    small = image.convert('L').resize((9, 8), Image.LANCZOS)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def hash_distance(hash_a, hash_b):
+    """Number of differing bits between two hex dHashes."""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+
+def open_db(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS images (
+            sha256 TEXT PRIMARY KEY,
+            extension TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            dhash TEXT,
+            first_seen INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS image_urls (
+            url TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            fetched_at INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS listing_images (
+            listing_url TEXT NOT NULL,
+            image_url TEXT NOT NULL,
+            PRIMARY KEY (listing_url, image_url)
+        );
+        CREATE INDEX IF NOT EXISTS images_dhash ON images(dhash);
+    """)
+    return conn
+
+
+class ImagePipeline:
+    """Background downloader writing images into the content-addressed store."""
+
+    def __init__(self, session, directory=IMAGES_DIR, workers=DEFAULT_WORKERS, max_bytes=MAX_IMAGE_BYTES):
+        self.session = session
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.conn = open_db(os.path.join(directory, IMAGES_DB))
+        self._lock = threading.Lock()
+        self._claims = DedupeIndex(row[0] for row in self.conn.execute("SELECT url FROM image_urls"))
+        self._hashes = DedupeIndex(row[0] for row in self.conn.execute("SELECT sha256 FROM images"))
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='images')
+        if Image is None:
+            print(colored("Pillow not installed. Install with: pip install pillow "
+                          "(storing originals without thumbnails or perceptual hashes)", "red"))
+
+    def path_for(self, sha256, extension, thumbnail=False):
+        parts = [self.directory] + (['thumbs'] if thumbnail else []) + [sha256[:2]]
+        return os.path.join(*parts, f"{sha256}.{'jpg' if thumbnail else extension}")
+
+    def submit(self, listing_url, image_urls):
+        """Queue a listing's images; URLs already stored or queued are only linked to the listing."""
+        urls = []
+        for image_url in image_urls or []:
+            image_url = urllib.parse.urljoin(listing_url, image_url.strip())
+            if urllib.parse.urlparse(image_url).scheme not in ('http', 'https'):
+                continue  # data: URIs and the like
+            urls.append(image_url)
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return
+        with self._lock:
+            self.conn.executemany("INSERT OR IGNORE INTO listing_images (listing_url, image_url) VALUES (?, ?)",
+                                  [(listing_url, image_url) for image_url in urls])
+            self.conn.commit()
+        for image_url in urls:
+            if self._claims.claim(image_url):
+                self._pool.submit(self._download, image_url)
+            else:
+                _record(known_urls=1)
+
+    def _download(self, image_url):
+        try:
+            response = fetch_with_retry(self.session, image_url, timeout=30, max_bytes=self.max_bytes,
+                                        allowed_types=IMAGE_CONTENT_TYPES, page_type='image')
+            if response.status_code != 200:
+                raise requests.exceptions.HTTPError(f"HTTP {response.status_code}")
+            self.store(image_url, response.content)
+        except (requests.exceptions.RequestException, ValueError, OSError) as e:
+            reason = e.reason if isinstance(e, FetchAborted) else e
+            log.warning("Image not stored %s: %s", image_url, reason, extra={'event': 'image_failed', 'url': image_url})
+            self._claims.release(image_url)
+            _record(failed=1)
+        except Exception as e:
+            log.error("Error storing image %s: %s", image_url, e, extra={'event': 'image_error', 'url': image_url})
+            self._claims.release(image_url)
+            _record(failed=1)
+
+    def store(self, image_url, data):
+        """Write image bytes under their hash (once) and record the URL; returns the sha256."""
+        _record(downloaded=1, bytes_downloaded=len(data))
+        extension = image_extension(data)
+        if extension is None:
+            raise ValueError("not an image")
+        sha256 = hashlib.sha256(data).hexdigest()
+
+        if not self._hashes.claim(sha256):
+            _record(duplicate_content=1)
+        else:
+            try:
+                self._write_image(sha256, extension, data)
+            except Exception:
+                self._hashes.release(sha256)
+                raise
+            _record(stored=1)
+
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO image_urls (url, sha256, fetched_at) VALUES (?, ?, ?)",
+                              (image_url, sha256, int(time.time())))
+            self.conn.commit()
+        return sha256
+
+    def _write_image(self, sha256, extension, data):
+        width = height = dhash = None
+        if Image is not None:
+            width, height, dhash = self._thumbnail(sha256, data)
+        path = self.path_for(sha256, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO images (sha256, extension, bytes, width, height, dhash, first_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (sha256, extension, len(data), width, height, dhash, int(time.time())))
+
+    def _thumbnail(self, sha256, data):
+        """Write the thumbnail; returns (width, height, dhash) of the original."""
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+            width, height = image.size
+            dhash = difference_hash(image)
+            thumbnail = image.convert('RGB')
+            thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        path = self.path_for(sha256, None, thumbnail=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        thumbnail.save(path, 'JPEG', quality=80)
+        return width, height, dhash
+
+    def close(self, wait=True):
+        """Finish (or with wait=False, drop) queued downloads and close the database."""
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+def print_image_stats():
+    """Print the image section of the run summary."""
+    with _stats_lock:
+        stats = dict(IMAGE_STATS)
+    if not (stats['downloaded'] or stats['known_urls'] or stats['failed']):
+        return
+    print(colored(f"🖼️  Image stats: {stats['stored']} new images stored, {stats['duplicate_content']} downloads "
+                  f"matched an image already stored, {stats['known_urls']} URLs already known, "
+                  f"{stats['failed']} failed ({stats['bytes_downloaded'] / 1024 / 1024:.1f} MB)", "white"))
+
+
+def similar_images(conn, dhash, max_distance=SIMILAR_DISTANCE):
+    """(distance, sha256) of stored images whose dHash is within max_distance bits, closest first."""
+    matches = []
+    for sha256, other in conn.execute("SELECT sha256, dhash FROM images WHERE dhash IS NOT NULL"):
+        distance = hash_distance(dhash, other)
+        if distance <= max_distance:
+            matches.append((distance, sha256))
+    return sorted(matches)
+
+
+def listings_of(conn, sha256):
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT listing_images.listing_url FROM listing_images "
+        "JOIN image_urls ON image_urls.url = listing_images.image_url WHERE image_urls.sha256 = ?", (sha256,))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the content-addressed product image store')
+    parser.add_argument('--dir', type=str, default=IMAGES_DIR, help=f'Image store directory (default: {IMAGES_DIR})')
+    parser.add_argument('--similar', metavar='IMAGE',
+                       help='List stored images that look like this file, and the listings using them')
+    parser.add_argument('--distance', type=int, default=SIMILAR_DISTANCE,
+                       help=f'With --similar: dHash bits that may differ (default: {SIMILAR_DISTANCE})')
+    parser.add_argument('--listing', metavar='URL', help='Show the stored images of a listing')
+
+    args = parser.parse_args()
+
+    db_path = os.path.join(args.dir, IMAGES_DB)
+    if not os.path.exists(db_path):
+        print(colored(f"❌ {db_path} not found!", "red"))
+        return
+    conn = open_db(db_path)
+
+    if args.similar:
+        if Image is None:
+            print(colored("Pillow not installed. Install with: pip install pillow", "red"))
+            return
+        with Image.open(args.similar) as image:
+            dhash = difference_hash(image)
+        for distance, sha256 in similar_images(conn, dhash, args.distance):
+            print(colored(f"{sha256}  distance {distance}", "green"))
+            for listing_url in listings_of(conn, sha256):
+                print(f"    {listing_url}")
+    elif args.listing:
+        rows = conn.execute(
+            "SELECT listing_images.image_url, images.sha256, images.extension, images.dhash "
+            "FROM listing_images LEFT JOIN image_urls ON image_urls.url = listing_images.image_url "
+            "LEFT JOIN images ON images.sha256 = image_urls.sha256 WHERE listing_images.listing_url = ?",
+            (args.listing,)).fetchall()
+        if not rows:
+            print(colored(f"❌ No images recorded for {args.listing}", "red"))
+        for image_url, sha256, extension, dhash in rows:
+            if sha256:
+                print(colored(f"{sha256[:16]}…  dhash={dhash or '-'}  ", "green") + image_url)
+            else:
+                print(colored("(not downloaded)  ", "yellow") + image_url)
+    else:
+        images, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM images").fetchone()
+        urls = conn.execute("SELECT COUNT(*) FROM image_urls").fetchone()[0]
+        listings = conn.execute("SELECT COUNT(DISTINCT listing_url) FROM listing_images").fetchone()[0]
+        print(colored(f"{images} unique images ({total_bytes / 1024 / 1024:.1f} MB) from {urls} image URLs "
+                      f"on {listings} listings", "cyan"))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Fastest-mirror selection for markets with several onion addresses (--mirrors)
+
+Markets publish several mirrors with very different latency, but the URLs in
+pages_url.json and start_url name one of them. mirrors.json lists the mirror
+set of each market; the first address is the market's canonical identity:
+
+    {"markets": {"drugmarket": ["drugj7...onion", "drugk3...onion", "drugm9...onion"]}}
+
+With --mirrors every fetch of a URL on any of those addresses is sent to the
+market's best healthy mirror (http_fetch.mirror_router), while everything the
+crawl keeps — listing URLs, dedupe sets, checkpoints, the "market" field —
+stays on the canonical address: links found on a page are mapped back with
+canonical(). Mirrors are ranked by success rate and median latency over
+their last WINDOW fetches, fed by the crawl's own fetches and by a probe of
+every mirror's front page each PROBE_INTERVAL seconds; a mirror failing more
+than half of its fetches is skipped until a probe sees it answer again. The
+route only moves when another mirror is SWITCH_MARGIN faster, so it does not
+flap between two similar mirrors.
+
+    python3 mirrors.py --socks        # probe every mirror once and show the ranking
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from termcolor import colored
+
+import http_fetch
+
+
+MIRRORS_FILE = "mirrors.json"
+PROBE_INTERVAL = 300
+PROBE_TIMEOUT = 60
+WINDOW = 20
+MIN_SUCCESS_RATE = 0.5
+SWITCH_MARGIN = 0.8       # a mirror must be this fraction of the current one's latency to take over
+
+MIRROR_STATS = {
+    'routed': 0,
+    'switches': 0,
+    'probes': 0,
+    'probe_failures': 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _record(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            MIRROR_STATS[key] = MIRROR_STATS.get(key, 0) + value
+
+
+def load_mirrors(path=MIRRORS_FILE):
+    """{market name: [canonical netloc, mirror netloc, ...]} from the config file."""
+    with open(path, 'r', encoding='utf-8') as f:
+        markets = json.load(f).get('markets', {})
+    mirror_sets = {}
+    for name, netlocs in markets.items():
+        # Accept full URLs as well as bare addresses
+        netlocs = [urllib.parse.urlparse(n).netloc or n.strip('/') for n in netlocs if n]
+        if netlocs:
+            mirror_sets[name] = list(dict.fromkeys(netlocs))
+    return mirror_sets
+
+
+def _with_netloc(url, netloc):
+    return urllib.parse.urlparse(url)._replace(netloc=netloc).geturl()
+
+
+class MirrorRouter:
+    """Rolling health per mirror; routes fetches to the best mirror of each market."""
+
+    def __init__(self, mirror_sets, session=None):
+        self.mirror_sets = mirror_sets
+        self.session = session
+        self._market_of = {netloc: name for name, netlocs in mirror_sets.items() for netloc in netlocs}
+        self._samples = {netloc: deque(maxlen=WINDOW) for netloc in self._market_of}
+        self._best = {name: netlocs[0] for name, netlocs in mirror_sets.items()}
+        self._cookies_copied = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def market_of(self, url):
+        return self._market_of.get(urllib.parse.urlparse(url).netloc)
+
+    def canonical(self, url):
+        """The URL on its market's canonical address (unchanged for hosts without mirrors)."""
+        market = self.market_of(url)
+        if market is None:
+            return url
+        return _with_netloc(url, self.mirror_sets[market][0])
+
+    def current(self, url):
+        """The address a fetch of url goes to right now (route() without its side effects)."""
+        market = self.market_of(url)
+        if market is None:
+            return urllib.parse.urlparse(url).netloc
+        with self._lock:
+            return self._best[market]
+
+    def route(self, url):
+        """The URL on its market's current best mirror."""
+        market = self.market_of(url)
+        if market is None:
+            return url
+        with self._lock:
+            best = self._best[market]
+        _record(routed=1)
+        if urllib.parse.urlparse(url).netloc == best:
+            return url
+        self._copy_cookies(market, best)
+        return _with_netloc(url, best)
+
+    def _copy_cookies(self, market, netloc):
+        """Give a mirror the session cookies of the canonical address (CAPTCHA/DDoS-guard clearance)."""
+        if self.session is None or netloc in self._cookies_copied:
+            return
+        self._cookies_copied.add(netloc)
+        canonical = self.mirror_sets[market][0]
+        for cookie in list(self.session.cookies):
+            if cookie.domain.lstrip('.') == canonical:
+                self.session.cookies.set(cookie.name, cookie.value, domain=netloc, path=cookie.path)
+
+    def observe(self, url, seconds, error):
+        """http_fetch observer: the crawl's own fetches count toward each mirror's health."""
+        if isinstance(error, http_fetch.FetchAborted) and not error.reason.startswith('download exceeded'):
+            return
+        self._add(urllib.parse.urlparse(url).netloc, seconds, error is None)
+
+    def _add(self, netloc, seconds, ok):
+        samples = self._samples.get(netloc)
+        if samples is None:
+            return
+        with self._lock:
+            samples.append((seconds, ok))
+            self._rerank(self._market_of[netloc])
+
+    def health(self, netloc):
+        """(success rate, median latency of successes, samples); None values when unknown."""
+        samples = list(self._samples.get(netloc, ()))
+        if not samples:
+            return None, None, 0
+        latencies = [seconds for seconds, ok in samples if ok]
+        return (len(latencies) / len(samples), statistics.median(latencies) if latencies else None, len(samples))
+
+    def ranking(self, market):
+        """Mirrors of a market, best first: healthy ones by median latency, then unknown, then failing."""
+        def key(netloc):
+            rate, median, count = self.health(netloc)
+            if count == 0:
+                return (1, 0.0)
+            if rate < MIN_SUCCESS_RATE or median is None:
+                return (2, -rate)
+            return (0, median)
+        return sorted(self.mirror_sets[market], key=key)
+
+    def _rerank(self, market):
+        current = self._best[market]
+        candidate = self.ranking(market)[0]
+        if candidate == current:
+            return
+        current_rate, current_median, current_count = self.health(current)
+        candidate_rate, candidate_median, candidate_count = self.health(candidate)
+        if candidate_count == 0 or candidate_rate < MIN_SUCCESS_RATE or candidate_median is None:
+            return
+        current_healthy = current_count and current_rate >= MIN_SUCCESS_RATE and current_median is not None
+        if current_healthy and candidate_median > current_median * SWITCH_MARGIN:
+            return
+        self._best[market] = candidate
+        _record(switches=1)
+        before = f"{current_median:.1f}s" if current_median is not None else "failing" if current_count else "untested"
+        print(colored(f"🪞 {market}: routing to {candidate} ({candidate_median:.1f}s) instead of {current} ({before})",
+                      "cyan"))
+
+    def probe(self, market=None):
+        """Fetch the front page of every mirror (of one market, or all) once, concurrently."""
+        netlocs = [netloc for name, mirror_set in self.mirror_sets.items() if market in (None, name)
+                   for netloc in mirror_set]
+        session = self.session or requests.Session()
+
+        def probe_one(netloc):
+            started = time.monotonic()
+            ok = False
+            try:
+                # Straight to the network: fetch() would route the probe to the best mirror
+                response = http_fetch._fetch_network(session, f"http://{netloc}/", timeout=PROBE_TIMEOUT)
+                ok = response.status_code < 500
+            except requests.exceptions.RequestException:
+                pass
+            _record(probes=1, probe_failures=0 if ok else 1)
+            self._add(netloc, time.monotonic() - started, ok)
+
+        with ThreadPoolExecutor(max_workers=min(8, max(1, len(netlocs)))) as pool:
+            list(pool.map(probe_one, netlocs))
+
+    def start_probing(self, interval=PROBE_INTERVAL):
+        """Probe all mirrors now and every interval seconds, in the background."""
+        def loop():
+            while not self._stop.is_set():
+                self.probe()
+                self._stop.wait(interval)
+        self._thread = threading.Thread(target=loop, name='mirror-probe', daemon=True)
+        self._thread.start()
+
+    def stop_probing(self):
+        self._stop.set()
+
+    def print_stats(self):
+        """Print the mirror section of the run summary."""
+        with _stats_lock:
+            stats = dict(MIRROR_STATS)
+        print(colored(f"🪞 Mirrors: {stats['routed']} fetches routed, {stats['switches']} route changes, "
+                      f"{stats['probes']} probes ({stats['probe_failures']} failed)", "white"))
+        for market in self.mirror_sets:
+            print(colored(f"   {market}:", "white"))
+            for netloc in self.ranking(market):
+                print(colored(f"     {'→' if netloc == self._best[market] else ' '} {netloc} "
+                              f"{_format_health(self.health(netloc))}", "white"))
+
+
+def _format_health(health):
+    rate, median, count = health
+    if not count:
+        return "(no fetches yet)"
+    latency = f"median {median:.1f}s" if median is not None else "no answers"
+    return f"({latency}, {rate:.0%} ok over {count})"
+
+
+# The active MirrorRouter (set by start())
+router = None
+
+
+def canonical(url):
+    """
+    url on its market's canonical address when --mirrors is on. Absolute links on a
+    mirror's page point at that mirror; stored URLs and dedupe keys must not.
+    """
+    active = router
+    return active.canonical(url) if active is not None and url else url
+
+
+def fetch_host(url):
+    """The address http_fetch.fetch() sends url to: its market's best mirror with --mirrors, else its own."""
+    active = router
+    if active is None or getattr(http_fetch.transport, 'replaying', False):
+        return urllib.parse.urlparse(url).netloc
+    return active.current(url)
+
+
+def start(session, path=MIRRORS_FILE, interval=PROBE_INTERVAL):
+    """Load the mirror sets and route every fetch (called from the scrapers' main())."""
+    global router
+    try:
+        mirror_sets = load_mirrors(path)
+    except (OSError, ValueError) as e:
+        print(colored(f"❌ Could not load mirror sets from {path}: {e}", "red"))
+        return None
+    router = MirrorRouter(mirror_sets, session)
+    http_fetch.mirror_router = router
+    if getattr(http_fetch.transport, 'replaying', False):
+        # Replay: no routing or probing, only links on recorded mirror pages are mapped back
+        print(colored(f"🪞 Mapping mirror links of {len(mirror_sets)} markets to their canonical address", "cyan"))
+        return router
+    http_fetch.observers.append(router.observe)
+    router.start_probing(interval)
+    print(colored(f"🪞 Routing {len(mirror_sets)} markets to their fastest mirror "
+                  f"({sum(len(m) for m in mirror_sets.values())} addresses, probed every {interval:.0f}s)", "cyan"))
+    return router
+
+
+def stop():
+    """Stop routing and print the mirror section of the run summary."""
+    global router
+    if router is None:
+        return
+    active, router = router, None
+    active.stop_probing()
+    http_fetch.mirror_router = None
+    if active.observe in http_fetch.observers:
+        http_fetch.observers.remove(active.observe)
+        active.print_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Probe the mirrors of each market and rank them')
+    parser.add_argument('--mirrors', type=str, default=MIRRORS_FILE, help=f'Mirror sets (default: {MIRRORS_FILE})')
+    parser.add_argument('--market', type=str, default=None, help='Only this market')
+    parser.add_argument('--rounds', type=int, default=1, help='Probe rounds (default: 1)')
+    parser.add_argument('--socks', action='store_true', help='Use Tor SOCKS5 (default uses HTTP proxy on 8118)')
+    parser.add_argument('--socks-port', type=int, default=9050, help='Tor SOCKS port (default: 9050)')
+
+    args = parser.parse_args()
+
+    try:
+        mirror_sets = load_mirrors(args.mirrors)
+    except (OSError, ValueError) as e:
+        print(colored(f"❌ Could not load {args.mirrors}: {e}", "red"))
+        return
+
+    session = requests.Session()
+    proxy = f'socks5h://127.0.0.1:{args.socks_port}' if args.socks else 'http://127.0.0.1:8118'
+    session.proxies = {'http': proxy, 'https': proxy}
+    probe_router = MirrorRouter(mirror_sets, session)
+    for _ in range(args.rounds):
+        probe_router.probe(args.market)
+    for market in mirror_sets:
+        if args.market and market != args.market:
+            continue
+        print(colored(f"{market}", "cyan"))
+        for rank, netloc in enumerate(probe_router.ranking(market), 1):
+            print(f"  {rank}. {netloc} {_format_health(probe_router.health(netloc))}"
+                  f"{'  (canonical)' if netloc == mirror_sets[market][0] else ''}")
+
+
+if __name__ == "__main__":
+    main()
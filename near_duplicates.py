@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate listing detection (MinHash + LSH)
+
+The same vendor listing shows up under several URLs, categories and mirror
+markets. This index keeps a MinHash signature of the word shingles of each
+listing's title/description and buckets the signature bands (LSH), so a new
+record is compared only against the handful of records sharing a bucket
+instead of the whole archive.
+
+Each record gets a cluster ID: the ID of the first record it was found to be
+a near-duplicate of, or a fresh ID derived from its own URL.
+
+Usage:
+    python3 near_duplicates.py --input products_html.json   # cluster an archive
+"""
+
+import argparse
+import hashlib
+import html as html_lib
+import os
+import pickle
+import random
+import re
+import zlib
+from termcolor import colored
+
+from archive_io import iter_json_array, record_url
+
+
+NEAR_DUPLICATES_FILE = "near_duplicates.pkl"
+
+NUM_PERM = 64
+BANDS = 16  # 16 bands x 4 rows → candidate threshold around Jaccard 0.5
+SHINGLE_SIZE = 3
+DEFAULT_THRESHOLD = 0.8
+NEAR_CERTAIN_THRESHOLD = 0.9  # used when a match lets the crawler skip a fetch
+# Fewer shingles than this and a 0.9 match is luck ("Blue Dream $10" is one shingle)
+MIN_SKIP_SHINGLES = 4
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_TITLE_RE = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+_H1_RE = re.compile(r'<h1[^>]*>(.*?)</h1>', re.IGNORECASE | re.DOTALL)
+_META_DESC_RE = re.compile(
+    r'<meta[^>]+(?:name|property)=["\'](?:og:)?description["\'][^>]*content=["\']([^"\']*)',
+    re.IGNORECASE,
+)
+_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Return the set of word n-gram shingles of a text."""
+    words = _WORD_RE.findall((text or '').lower())
+    if len(words) < size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def distinctive(text, minimum=MIN_SKIP_SHINGLES):
+    """True when a text is long enough for a near-certain match on it to stand in for a fetch."""
+    return len(shingles(text)) >= minimum
+
+
+def listing_text(title, description=None):
+    """Text used to fingerprint a listing."""
+    return ' '.join(part for part in (title, description) if part)
+
+
+def listing_text_from_html(page_html):
+    """Cheap title + meta description fingerprint text without building a DOM."""
+    parts = []
+    for pattern in (_H1_RE, _TITLE_RE, _META_DESC_RE):
+        match = pattern.search(page_html or '')
+        if match:
+            parts.append(html_lib.unescape(_TAG_RE.sub(' ', match.group(1))))
+    return ' '.join(parts)
+
+
+class NearDuplicateIndex:
+    """Incremental MinHash/LSH index mapping listing URLs to cluster IDs."""
+
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS, threshold=DEFAULT_THRESHOLD, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+                       for _ in range(num_perm)]
+        self.signatures = {}   # key → signature tuple
+        self.clusters = {}     # key → cluster id
+        self.buckets = [{} for _ in range(bands)]
+
+    def signature(self, text):
+        """MinHash signature of a text's shingles (None when there is nothing to hash)."""
+        hashed = [zlib.crc32(s.encode('utf-8')) for s in shingles(text)]
+        if not hashed:
+            return None
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashed)
+            for a, b in self._perms
+        )
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [signature[i * rows:(i + 1) * rows] for i in range(self.bands)]
+
+    @staticmethod
+    def similarity(sig_a, sig_b):
+        """Estimated Jaccard similarity of two signatures."""
+        return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+    def query(self, text=None, signature=None, threshold=None):
+        """Return (key, similarity) of the best near-duplicate, or (None, 0.0)."""
+        if signature is None:
+            signature = self.signature(text)
+        if signature is None:
+            return None, 0.0
+        threshold = self.threshold if threshold is None else threshold
+
+        candidates = set()
+        for band, band_key in enumerate(self._band_keys(signature)):
+            candidates.update(self.buckets[band].get(band_key, ()))
+
+        best_key, best_sim = None, 0.0
+        for key in candidates:
+            sim = self.similarity(signature, self.signatures[key])
+            if sim > best_sim:
+                best_key, best_sim = key, sim
+        if best_sim < threshold:
+            return None, best_sim
+        return best_key, best_sim
+
+    def add(self, key, text):
+        """Index a record and return its cluster ID (None if the text is empty)."""
+        if key in self.clusters:
+            return self.clusters[key]
+        signature = self.signature(text)
+        if signature is None:
+            return None
+
+        match, _ = self.query(signature=signature)
+        if match is not None:
+            cluster_id = self.clusters[match]
+        else:
+            cluster_id = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+        self.signatures[key] = signature
+        self.clusters[key] = cluster_id
+        for band, band_key in enumerate(self._band_keys(signature)):
+            self.buckets[band].setdefault(band_key, []).append(key)
+        return cluster_id
+
+    def cluster_of(self, key):
+        return self.clusters.get(key)
+
+    def __len__(self):
+        return len(self.signatures)
+
+
+def load_index(path=NEAR_DUPLICATES_FILE, threshold=DEFAULT_THRESHOLD):
+    """Load a pickled index, or start a new one."""
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                index = pickle.load(f)
+            index.threshold = threshold
+            return index
+        except Exception as e:
+            print(colored(f"⚠️  Could not load {path} ({e}); starting a new index", "yellow"))
+    return NearDuplicateIndex(threshold=threshold)
+
+
+def save_index(index, path=NEAR_DUPLICATES_FILE):
+    """Pickle the index next to the archive (atomic replace)."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(index, f)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cluster near-duplicate listings in an archive')
+    parser.add_argument('--input', type=str, default='products_html.json',
+                       help='Archive to cluster (default: products_html.json)')
+    parser.add_argument('--index', type=str, default=NEAR_DUPLICATES_FILE,
+                       help=f'Index file to update (default: {NEAR_DUPLICATES_FILE})')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                       help=f'Minimum estimated Jaccard similarity (default: {DEFAULT_THRESHOLD})')
+
+    args = parser.parse_args()
+
+    index = load_index(args.index, args.threshold)
+    clusters = {}
+    for record in iter_json_array(args.input):
+        url = record_url(record)
+        if not url:
+            continue
+        text = listing_text(record.get('title'), record.get('description'))
+        if not text:
+            text = listing_text_from_html(record.get('html'))
+        cluster_id = index.add(url, text)
+        if cluster_id:
+            clusters.setdefault(cluster_id, []).append(url)
+
+    save_index(index, args.index)
+
+    duplicates = {cid: urls for cid, urls in clusters.items() if len(urls) > 1}
+    print(colored(f"✅ Indexed {len(index)} listings into {len(clusters)} clusters", "green"))
+    print(colored(f"   Clusters with near-duplicates: {len(duplicates)}", "white"))
+    for cluster_id, urls in sorted(duplicates.items(), key=lambda item: -len(item[1]))[:10]:
+        print(colored(f"   {cluster_id} ({len(urls)}): {urls[0]}", "white"))
+
+
+if __name__ == "__main__":
+    main()
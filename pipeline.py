@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Staged fetch → parse → write pipeline
+
+Fetching a listing over Tor takes seconds of waiting, and parsing it with
+BeautifulSoup takes CPU time. Done one after the other in the same thread,
+the network is idle while we parse and the CPU is idle while we wait.
+Pipeline splits the work into stages connected by bounded queues:
+
+    submit() → [fetch queue] → fetch threads → [parse] → process pool → [write queue] → writer thread
+
+- fetch(item) runs on N threads and returns a payload (or None on failure)
+- parse(payload) runs in a process pool (it and its payload must be
+  picklable); with parse_workers=0 it runs in the fetch thread instead
+- write(item, result, error) runs on a single thread, so the output files
+  and indexes have exactly one writer; it is called for every item, with
+  result None when the fetch failed or error set when parse raised
+
+Every queue is bounded, so when the writer or the parsers fall behind,
+submit() blocks and memory stays flat. Queue depths are sampled for the run
+summary (and printed every REPORT_EVERY items) to show which stage is the
+bottleneck.
+"""
+
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from termcolor import colored
+
+import crawl_log
+
+
+log = crawl_log.get_logger('pipeline')
+
+DEFAULT_QUEUE_SIZE = 32
+REPORT_EVERY = 50
+
+_STOP = object()
+
+
+class Pipeline:
+    """Fetch threads, a parse process pool and a single writer thread joined by bounded queues."""
+
+    def __init__(self, fetch, parse, write, fetch_workers=4, parse_workers=2, queue_size=DEFAULT_QUEUE_SIZE,
+                 parse_initializer=None, parse_initargs=(), name='pipeline'):
+        self.fetch = fetch
+        self.parse = parse
+        self.write = write
+        self.name = name
+        self.fetch_queue = queue.Queue(maxsize=queue_size)
+        self.write_queue = queue.Queue(maxsize=queue_size)
+        self.queue_size = queue_size
+        # Parsers use 'spawn': forking a process that is running threads can deadlock the child
+        self._pool = None
+        if parse_workers:
+            self._pool = ProcessPoolExecutor(max_workers=parse_workers,
+                                             mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=parse_initializer, initargs=parse_initargs)
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+        self._closing = False
+        self.stats = {
+            'submitted': 0, 'fetched': 0, 'fetch_failed': 0, 'parsed': 0, 'parse_failed': 0, 'written': 0,
+            'fetch_seconds': 0.0, 'parse_wait_seconds': 0.0, 'write_seconds': 0.0,
+            'max_fetch_queue': 0, 'max_write_queue': 0, 'max_parsing': 0,
+        }
+        self._parsing = 0
+        self._started = time.monotonic()
+        self._fetchers = [threading.Thread(target=self._fetch_loop, name=f"{name}-fetch-{i}", daemon=True)
+                          for i in range(max(1, fetch_workers))]
+        self._writer = threading.Thread(target=self._write_loop, name=f"{name}-writer", daemon=True)
+        for thread in self._fetchers:
+            thread.start()
+        self._writer.start()
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def _sample(self):
+        with self._lock:
+            self.stats['max_fetch_queue'] = max(self.stats['max_fetch_queue'], self.fetch_queue.qsize())
+            self.stats['max_write_queue'] = max(self.stats['max_write_queue'], self.write_queue.qsize())
+            self.stats['max_parsing'] = max(self.stats['max_parsing'], self._parsing)
+
+    def depths(self):
+        """Current number of items waiting in (or held by) each stage."""
+        with self._lock:
+            return {'fetch_queue': self.fetch_queue.qsize(), 'parsing': self._parsing,
+                    'write_queue': self.write_queue.qsize()}
+
+    def submit(self, item):
+        """
+        Queue an item for fetching; blocks while the fetch queue is full (backpressure).
+        Returns False (item not queued) once close() has started.
+        """
+        with self._submit_lock:
+            if self._closing:
+                return False
+            self.fetch_queue.put(item)
+        self._count(submitted=1)
+        self._sample()
+        return True
+
+    def _parse_done(self, _future):
+        with self._lock:
+            self._parsing -= 1
+
+    def _fetch_loop(self):
+        while True:
+            item = self.fetch_queue.get()
+            if item is _STOP:
+                return
+            started = time.monotonic()
+            try:
+                payload = self.fetch(item)
+            except Exception as e:
+                log.error("%s: fetch stage error: %s", self.name, e, extra={'event': 'stage_error', 'stage': 'fetch'})
+                payload = None
+            self._count(fetch_seconds=time.monotonic() - started)
+
+            if payload is None:
+                self._count(fetch_failed=1)
+                self.write_queue.put((item, None, None))
+            elif self._pool is None:
+                self._count(fetched=1)
+                try:
+                    self.write_queue.put((item, self.parse(payload), None))
+                except Exception as e:
+                    self.write_queue.put((item, None, e))
+            else:
+                self._count(fetched=1)
+                with self._lock:
+                    self._parsing += 1
+                future = self._pool.submit(self.parse, payload)
+                future.add_done_callback(self._parse_done)
+                # Blocks when the writer is behind, which in turn stops this fetcher
+                self.write_queue.put((item, future, None))
+            self._sample()
+
+    def _write_loop(self):
+        written = 0
+        while True:
+            entry = self.write_queue.get()
+            if entry is _STOP:
+                return
+            item, result, error = entry
+            if hasattr(result, 'result'):
+                started = time.monotonic()
+                try:
+                    result = result.result()
+                except Exception as e:
+                    result, error = None, e
+                self._count(parse_wait_seconds=time.monotonic() - started)
+            if error is not None:
+                self._count(parse_failed=1)
+            elif result is not None:
+                self._count(parsed=1)
+
+            started = time.monotonic()
+            try:
+                self.write(item, result, error)
+            except Exception as e:
+                log.error("%s: write stage error: %s", self.name, e, extra={'event': 'stage_error', 'stage': 'write'})
+            self._count(write_seconds=time.monotonic() - started, written=1)
+            written += 1
+            if written % REPORT_EVERY == 0:
+                self.print_depths()
+
+    def print_depths(self):
+        depths = self.depths()
+        log.info("⚙️  %s: fetch queue %d/%d, parsing %d, write queue %d/%d, %d written", self.name,
+                 depths['fetch_queue'], self.queue_size, depths['parsing'], depths['write_queue'], self.queue_size,
+                 self.stats['written'], extra={'event': 'queue_depths', 'color': "white", **depths})
+
+    def close(self, wait=True):
+        """Drain every stage (or, with wait=False, drop queued work) and stop the threads and processes."""
+        with self._submit_lock:
+            self._closing = True
+        if not wait:
+            while True:
+                try:
+                    self.fetch_queue.get_nowait()
+                except queue.Empty:
+                    break
+        for _ in self._fetchers:
+            self.fetch_queue.put(_STOP)
+        for thread in self._fetchers:
+            thread.join()
+        self.write_queue.put(_STOP)
+        self._writer.join()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=not wait)
+
+    def print_stats(self):
+        """Print the pipeline section of the run summary."""
+        stats = self.stats
+        if not stats['submitted']:
+            return
+        elapsed = time.monotonic() - self._started
+        print(colored(f"⚙️  {self.name}: {stats['written']} items in {elapsed:.1f}s — fetched {stats['fetched']} "
+                      f"({stats['fetch_failed']} failed), parsed {stats['parsed']} ({stats['parse_failed']} failed)",
+                      "white"))
+        print(colored(f"   Busy time: fetch {stats['fetch_seconds']:.1f}s, writer waiting on parse "
+                      f"{stats['parse_wait_seconds']:.1f}s, write {stats['write_seconds']:.1f}s; "
+                      f"max depth: fetch queue {stats['max_fetch_queue']}/{self.queue_size}, "
+                      f"parsing {stats['max_parsing']}, write queue {stats['max_write_queue']}/{self.queue_size}",
+                      "white"))
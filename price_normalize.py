@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Batch price and stock normalization for archived product records
+
+extract_product_details keeps prices as raw strings (price, price_numeric,
+price_tiers) and stock as in_stock_count / stock_status strings. This module
+turns whole columns of those records into typed NumPy arrays in one pass:
+
+- price_min / price_max (float64, NaN when no price) - ranges like
+  "$50 – $300" give both ends; otherwise the last amount is the price
+  (a sale shows "$100.00 $80.00", old then current) and min == max.
+  Percentages ("20% VAT", "-15%") are not amounts
+- currency (ISO-ish code: USD, EUR, GBP, JPY, BTC, XMR, ETH, LTC, USDT)
+- in_stock_count (int64, -1 when unknown) and in_stock (int8: 1/0/-1)
+- price tiers flattened CSR-style (tier_offsets, tier_quantity, tier_price)
+
+Number parsing handles both "1,299.00" and "1.299,00". Tokens are pulled out
+with one compiled regex per distinct price string (archives repeat the same
+price points and tier prices many times over); separator resolution and
+float conversion run vectorized over the flattened token array.
+
+Usage:
+    python3 price_normalize.py --input products_html.json
+"""
+
+import argparse
+import itertools
+import re
+import time
+import numpy as np
+from termcolor import colored
+
+from archive_io import iter_json_array
+
+
+PRODUCTS_HTML_FILE = "products_html.json"
+
+# np.strings (NumPy >= 2) has true ufuncs; np.char is the 1.x equivalent
+_np_str = getattr(np, 'strings', np.char)
+
+# "1 299,00" style space grouping first, then plain digit/separator runs
+NUMBER_RE = re.compile(r'\d{1,3}(?:[ \u00a0\u202f]\d{3})+(?:[.,]\d+)?|\d[\d.,]*\d|\d')
+
+# Amounts: numbers that are not percentages
+AMOUNT_RE = re.compile(rf'(?:{NUMBER_RE.pattern})(?![\d.,]*\s*%)')
+
+# An explicit range between two amounts: "$50 – $300", "50-300 USD", "10.00 USD – 20.00 USD", "$5 to $9"
+RANGE_RE = re.compile(r'\d\s*(?:[A-Za-z]{3}\s*)?(?:[–—-]|\bto\b)\s*[^\d\s]{0,4}\s*\d')
+
+CURRENCY_RE = re.compile(
+    r'(₿|ɱ|\$|€|£|¥|\b(?:BTC|XBT|XMR|ETH|LTC|USDT|USD|EUR|GBP|JPY)\b)',
+    re.IGNORECASE,
+)
+
+CURRENCY_CODES = {
+    '$': 'USD', 'usd': 'USD',
+    '€': 'EUR', 'eur': 'EUR',
+    '£': 'GBP', 'gbp': 'GBP',
+    '¥': 'JPY', 'jpy': 'JPY',
+    '₿': 'BTC', 'btc': 'BTC', 'xbt': 'BTC',
+    'ɱ': 'XMR', 'xmr': 'XMR',
+    'eth': 'ETH',
+    'ltc': 'LTC',
+    'usdt': 'USDT',
+}
+
+# Crypto amounts are routinely quoted to 3+ decimals ("0.125 BTC")
+CRYPTO_CODES = {'BTC', 'XMR', 'ETH', 'LTC'}
+
+IN_STOCK_STATUSES = {'in stock': 1, 'available': 1, 'out of stock': 0, 'unavailable': 0}
+
+
+def parse_number_tokens(tokens, decimal_hint=None):
+    """
+    Vectorized conversion of numeric tokens ("1,299.00", "1.299,00", "0.125")
+    to float64.
+
+    A separator is the decimal mark when it is the last one of two kinds, or
+    the only one and not followed by exactly three digits. "1,299" and
+    "1.299" are read as thousands; decimal_hint (bool array) forces a lone
+    separator to be decimal, which is what crypto prices need.
+    """
+    tokens = np.asarray(tokens, dtype=str)
+    if tokens.size == 0:
+        return np.empty(0, dtype=np.float64)
+    for space in (' ', '\u00a0', '\u202f'):
+        tokens = _np_str.replace(tokens, space, '')
+
+    length = _np_str.str_len(tokens)
+    last_dot = _np_str.rfind(tokens, '.')
+    last_comma = _np_str.rfind(tokens, ',')
+    n_dot = _np_str.count(tokens, '.')
+    n_comma = _np_str.count(tokens, ',')
+
+    has_dot = n_dot > 0
+    has_comma = n_comma > 0
+
+    # Lone separator kind: decimal if it appears once and isn't a 3-digit group
+    last_sep = np.maximum(last_dot, last_comma)
+    trailing = length - last_sep - 1
+    lone_count = np.where(has_dot, n_dot, n_comma)
+    leading_zero = _np_str.startswith(tokens, '0')
+    lone_decimal = (lone_count == 1) & ((trailing != 3) | leading_zero)
+    if decimal_hint is not None:
+        lone_decimal |= (lone_count == 1) & np.asarray(decimal_hint, dtype=bool)
+
+    both = has_dot & has_comma
+    decimal_is_comma = np.where(both, last_comma > last_dot, has_comma & ~has_dot & lone_decimal)
+    decimal_is_dot = np.where(both, last_dot > last_comma, has_dot & ~has_comma & lone_decimal)
+
+    out = tokens.copy()
+    # Decimal comma: drop dots (thousands), then comma → dot
+    if decimal_is_comma.any():
+        sub = _np_str.replace(out[decimal_is_comma], '.', '')
+        out[decimal_is_comma] = _np_str.replace(sub, ',', '.')
+    # Decimal dot: drop commas (thousands)
+    if decimal_is_dot.any():
+        out[decimal_is_dot] = _np_str.replace(out[decimal_is_dot], ',', '')
+    # No decimal mark: every separator is a thousands separator
+    plain = ~(decimal_is_comma | decimal_is_dot)
+    if plain.any():
+        out[plain] = _np_str.replace(_np_str.replace(out[plain], ',', ''), '.', '')
+
+    return out.astype(np.float64)
+
+
+def _segment_reduce(values, counts, ufunc):
+    """Reduce values per record given per-record token counts; NaN for empty."""
+    result = np.full(len(counts), np.nan)
+    nonempty = counts > 0
+    if values.size:
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        result[nonempty] = ufunc.reduceat(values, starts[nonempty])
+    return result
+
+
+def normalize_price_column(price_texts):
+    """Return (price_min, price_max, currency) arrays for a column of price strings."""
+    # Prices repeat heavily across an archive (price points, tier prices): run the
+    # regexes once per distinct string and scatter the results back by index
+    slots = {}
+    inverse = np.fromiter((slots.setdefault(text, len(slots)) for text in price_texts),
+                          dtype=np.int64, count=len(price_texts))
+    texts = ['' if text is None else str(text) for text in slots]
+
+    token_lists = [tokens if RANGE_RE.search(text) else tokens[-1:]
+                   for text, tokens in zip(texts, map(AMOUNT_RE.findall, texts))]
+    counts = np.fromiter(map(len, token_lists), dtype=np.int64, count=len(texts))
+
+    currency_matches = map(CURRENCY_RE.search, texts)
+    currency = np.array([
+        CURRENCY_CODES.get(m.group(1).lower(), '') if m else ''
+        for m in currency_matches
+    ], dtype=object)
+
+    is_crypto = np.isin(currency, list(CRYPTO_CODES))
+    tokens = list(itertools.chain.from_iterable(token_lists))
+    values = parse_number_tokens(tokens, decimal_hint=np.repeat(is_crypto, counts))
+
+    price_min = _segment_reduce(values, counts, np.minimum)
+    price_max = _segment_reduce(values, counts, np.maximum)
+    return price_min[inverse], price_max[inverse], currency[inverse]
+
+
+def normalize_stock_columns(count_texts, status_texts):
+    """Return (in_stock_count, in_stock) arrays; -1 means unknown."""
+    counts = np.array(['' if c is None else str(c).strip() for c in count_texts], dtype=str)
+    in_stock_count = np.full(len(counts), -1, dtype=np.int64)
+    if counts.size:
+        numeric = _np_str.isdigit(counts)
+        in_stock_count[numeric] = counts[numeric].astype(np.int64)
+
+    statuses = np.array([' '.join(str(s).lower().split()) if s else '' for s in status_texts], dtype=object)
+    in_stock = np.full(len(statuses), -1, dtype=np.int8)
+    for status, flag in IN_STOCK_STATUSES.items():
+        in_stock[statuses == status] = flag
+    # A positive count implies availability even when no status text matched
+    in_stock[(in_stock == -1) & (in_stock_count > 0)] = 1
+    in_stock[(in_stock == -1) & (in_stock_count == 0)] = 0
+    return in_stock_count, in_stock
+
+
+def normalize_tier_column(tier_lists):
+    """Flatten price_tiers into CSR arrays (tier_offsets, tier_quantity, tier_price)."""
+    tier_lists = [tiers or [] for tiers in tier_lists]
+    lengths = np.fromiter(map(len, tier_lists), dtype=np.int64, count=len(tier_lists))
+    tier_offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    flat = list(itertools.chain.from_iterable(tier_lists))
+    quantities = np.array([str(t.get('quantity') or '') for t in flat], dtype=str)
+    tier_quantity = np.full(len(flat), -1, dtype=np.int64)
+    if quantities.size:
+        numeric = _np_str.isdigit(quantities)
+        tier_quantity[numeric] = quantities[numeric].astype(np.int64)
+
+    tier_price, _, _ = normalize_price_column([t.get('price') for t in flat])
+    return tier_offsets, tier_quantity, tier_price
+
+
+def normalize_records(records):
+    """
+    Normalize a batch of archive records.
+    Returns a dict of column name → NumPy array, aligned with the input order
+    (tier_* arrays are indexed through tier_offsets).
+    """
+    # Prefer the full price text; price_numeric has already lost separators
+    price_texts = [r.get('price') or r.get('price_numeric') for r in records]
+    price_min, price_max, currency = normalize_price_column(price_texts)
+    in_stock_count, in_stock = normalize_stock_columns(
+        [r.get('in_stock_count') for r in records],
+        [r.get('stock_status') for r in records],
+    )
+    tier_offsets, tier_quantity, tier_price = normalize_tier_column([r.get('price_tiers') for r in records])
+
+    return {
+        'price_min': price_min,
+        'price_max': price_max,
+        'currency': currency,
+        'in_stock_count': in_stock_count,
+        'in_stock': in_stock,
+        'tier_offsets': tier_offsets,
+        'tier_quantity': tier_quantity,
+        'tier_price': tier_price,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Normalize prices and stock across an archive')
+    parser.add_argument('--input', type=str, default=PRODUCTS_HTML_FILE,
+                       help=f'Archive to normalize (default: {PRODUCTS_HTML_FILE})')
+    parser.add_argument('--batch-size', type=int, default=100000,
+                       help='Records normalized per batch (default: 100000)')
+
+    args = parser.parse_args()
+
+    total = 0
+    priced = 0
+    normalize_seconds = 0.0
+    currencies = {}
+    batch = []
+
+    def run_batch():
+        nonlocal total, priced, normalize_seconds
+        start = time.perf_counter()
+        columns = normalize_records(batch)
+        normalize_seconds += time.perf_counter() - start
+        total += len(batch)
+        priced += int(np.count_nonzero(~np.isnan(columns['price_min'])))
+        for code in columns['currency']:
+            currencies[code or '?'] = currencies.get(code or '?', 0) + 1
+        batch.clear()
+
+    # Only keep the fields we need; the HTML is dropped as soon as it is parsed
+    wanted = ('price', 'price_numeric', 'in_stock_count', 'stock_status', 'price_tiers')
+    for record in iter_json_array(args.input):
+        batch.append({key: record.get(key) for key in wanted})
+        if len(batch) >= args.batch_size:
+            run_batch()
+    if batch:
+        run_batch()
+
+    rate = total / normalize_seconds if normalize_seconds else 0
+    print(colored(f"✅ Normalized {total} records ({priced} with a price)", "green"))
+    print(colored(f"   Currencies: {currencies}", "white"))
+    print(colored(f"   Normalization time: {normalize_seconds:.3f}s ({rate:,.0f} records/s)", "white"))
+
+
+if __name__ == "__main__":
+    main()
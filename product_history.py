@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Price and stock history of listings, delta-encoded (--history)
+
+products_html.json keeps one full record (HTML included) per listing, so a
+recrawl either skips listings it already has or pays for another full copy.
+The history store keeps, per listing, one base snapshot of the tracked
+fields the first time it is seen, and afterwards only the fields whose value
+changed, with the time of the crawl that saw the change:
+
+    product_history.db
+      listings(url, market, first_seen, last_seen, base, current)
+      changes(listing_id, market, at, field, value)     -- value as JSON, null = field gone
+
+A listing's state at any time is its base plus the changes up to then.
+Both common questions are a single indexed query:
+
+    python3 product_history.py http://market.onion/shop/item/ --field price
+    python3 product_history.py --market drugj7....onion --since 2026-10-01
+    python3 product_history.py --build products_html.json     # import archived crawls (oldest first)
+"""
+
+import argparse
+import calendar
+import json
+import sqlite3
+import threading
+import time
+from termcolor import colored
+
+from archive_io import iter_json_array, record_url
+from crawl_scheduler import DedupeIndex
+
+
+HISTORY_FILE = "product_history.db"
+COMMIT_EVERY = 200
+
+# Fields of extract_product_details() whose changes are kept
+TRACKED_FIELDS = (
+    'price', 'price_numeric', 'price_tiers',
+    'stock_raw', 'in_stock_count', 'stock_status',
+    'review_count', 'rating_stars', 'rating_percent',
+)
+
+
+def parse_time(value):
+    """Unix time from an int/float, a numeric string or YYYY-MM-DD[THH:MM[:SS]] (UTC)."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    for fmt in ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return calendar.timegm(time.strptime(value, fmt))
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognized time: {value}")
+
+
+def _format_time(at):
+    return time.strftime('%Y-%m-%d %H:%M', time.gmtime(at))
+
+
+def tracked_values(details, fields=TRACKED_FIELDS):
+    """The tracked fields of a record that are present (None values dropped)."""
+    return {field: details[field] for field in fields if details.get(field) is not None}
+
+
+class HistoryStore:
+    """Base snapshot plus changed fields per listing, in SQLite."""
+
+    def __init__(self, path=HISTORY_FILE, fields=TRACKED_FIELDS):
+        self.path = path
+        self.fields = fields
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS listings (
+                id INTEGER PRIMARY KEY,
+                url TEXT UNIQUE NOT NULL,
+                market TEXT,
+                title TEXT,
+                first_seen INTEGER NOT NULL,
+                last_seen INTEGER NOT NULL,
+                base TEXT NOT NULL,
+                current TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS changes (
+                listing_id INTEGER NOT NULL,
+                market TEXT,
+                at INTEGER NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT
+            );
+            CREATE INDEX IF NOT EXISTS changes_listing ON changes(listing_id, at);
+            CREATE INDEX IF NOT EXISTS changes_market ON changes(market, at);
+            CREATE INDEX IF NOT EXISTS listings_market ON listings(market, first_seen);
+        """)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._refreshed = DedupeIndex()
+        self.stats = {'new': 0, 'changed': 0, 'unchanged': 0, 'out_of_order': 0, 'undated': 0, 'field_changes': 0}
+
+    def claim(self, url):
+        """True the first time a listing is claimed in this run (one history fetch per listing and run)."""
+        return self._refreshed.claim(url)
+
+    def record(self, url, market, details, at=None):
+        """
+        Add a snapshot of a listing. Returns the list of tracked fields that
+        changed, ['*'] for a listing seen for the first time, or None when the
+        snapshot is older than the newest one stored (it is then ignored).
+        """
+        at = parse_time(at) if at is not None else int(time.time())
+        values = tracked_values(details, self.fields)
+        encoded = json.dumps(values, ensure_ascii=False, sort_keys=True)
+        with self._lock:
+            row = self.conn.execute("SELECT id, last_seen, current FROM listings WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                self.conn.execute(
+                    "INSERT INTO listings (url, market, title, first_seen, last_seen, base, current) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", (url, market, details.get('title'), at, at, encoded, encoded))
+                self.stats['new'] += 1
+                changed = ['*']
+            else:
+                listing_id, last_seen, current = row
+                if at < last_seen:
+                    self.stats['out_of_order'] += 1
+                    return None
+                current = json.loads(current)
+                changed = [field for field in self.fields if current.get(field) != values.get(field)]
+                self.conn.executemany(
+                    "INSERT INTO changes (listing_id, market, at, field, value) VALUES (?, ?, ?, ?, ?)",
+                    [(listing_id, market, at, field,
+                      json.dumps(values[field], ensure_ascii=False) if field in values else None)
+                     for field in changed])
+                self.conn.execute("UPDATE listings SET last_seen = ?, current = ? WHERE id = ?",
+                                  (at, encoded, listing_id))
+                self.stats['changed' if changed else 'unchanged'] += 1
+                self.stats['field_changes'] += len(changed)
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY:
+                self._commit()
+        return changed
+
+    def _commit(self):
+        self.conn.commit()
+        self._pending = 0
+
+    def commit(self):
+        with self._lock:
+            self._commit()
+
+    def history(self, url, field=None):
+        """[(at, field, value)] of a listing: the base snapshot, then each change (value None = field gone)."""
+        with self._lock:
+            row = self.conn.execute("SELECT id, first_seen, base FROM listings WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return []
+            listing_id, first_seen, base = row
+            query = "SELECT at, field, value FROM changes WHERE listing_id = ?"
+            params = [listing_id]
+            if field:
+                query += " AND field = ?"
+                params.append(field)
+            changes = self.conn.execute(query + " ORDER BY at, rowid", params).fetchall()
+        entries = [(first_seen, name, value) for name, value in sorted(json.loads(base).items())
+                   if field is None or name == field]
+        entries += [(at, name, json.loads(value) if value is not None else None) for at, name, value in changes]
+        return entries
+
+    def state_at(self, url, at):
+        """Tracked fields of a listing as of time at (None if it was not seen yet)."""
+        at = parse_time(at)
+        state = None
+        for when, field, value in self.history(url):
+            if when > at:
+                break
+            if state is None:
+                state = {}
+            if value is None:
+                state.pop(field, None)
+            else:
+                state[field] = value
+        return state
+
+    def changes_since(self, market, since, fields=None):
+        """
+        [(url, at, field, value)] of every change in a market since a time, oldest first.
+        Listings first seen in that window are included with the fields of their base snapshot.
+        """
+        since = parse_time(since)
+        query = ("SELECT listings.url, changes.at, changes.field, changes.value FROM changes "
+                 "JOIN listings ON listings.id = changes.listing_id WHERE changes.market = ? AND changes.at >= ?")
+        params = [market, since]
+        if fields:
+            query += f" AND changes.field IN ({','.join('?' * len(fields))})"
+            params += list(fields)
+        with self._lock:
+            rows = self.conn.execute(query + " ORDER BY changes.at, changes.rowid", params).fetchall()
+            new = self.conn.execute("SELECT url, first_seen, base FROM listings WHERE market = ? AND first_seen >= ? "
+                                    "ORDER BY first_seen, id", (market, since)).fetchall()
+        entries = [(url, at, field, value) for url, at, base in new for field, value in sorted(json.loads(base).items())
+                   if not fields or field in fields]
+        entries += [(url, at, field, json.loads(value) if value is not None else None) for url, at, field, value in rows]
+        # Stable: a new listing's base comes before any change recorded at the same time
+        entries.sort(key=lambda entry: entry[1])
+        return entries
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM listings").fetchone()[0]
+
+    def print_stats(self):
+        """Print the history section of the run summary."""
+        stats = self.stats
+        if not (stats['new'] or stats['changed'] or stats['unchanged']):
+            return
+        print(colored(f"📈 History: {stats['new']} new listings, {stats['changed']} changed "
+                      f"({stats['field_changes']} field changes), {stats['unchanged']} unchanged", "white"))
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self.conn.close()
+
+
+def import_archive(store, path, extract=False):
+    """
+    Record every snapshot of a products_html.json archive; returns the number of records read.
+    With extract, records that carry only raw HTML (scrape_simple's) are run through extract_product_details.
+    Records without fetched_at are skipped (counted in store.stats['undated']): there is no time to file them under.
+    """
+    extract_details = None
+    if extract:
+        from bs4 import BeautifulSoup
+        from scrape_old import extract_product_details
+        extract_details = lambda html, url: extract_product_details(BeautifulSoup(html, 'html.parser'), url, html)
+
+    count = 0
+    for record in iter_json_array(path):
+        if not isinstance(record, dict) or not record_url(record):
+            continue
+        if not record.get('fetched_at'):
+            store.stats['undated'] += 1
+            continue
+        if extract_details and record.get('html') and 'title' not in record:
+            record = {**extract_details(record['html'], record_url(record)), **record}
+        store.record(record_url(record), record.get('market'), record, record['fetched_at'])
+        count += 1
+    store.commit()
+    return count
+
+
+def _format_value(value):
+    return json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else str(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query or build the listing price/stock history')
+    parser.add_argument('url', nargs='?', help='Listing URL whose history to show')
+    parser.add_argument('--history', type=str, default=HISTORY_FILE, help=f'History database (default: {HISTORY_FILE})')
+    parser.add_argument('--field', type=str, default=None, help='Only this field (e.g. price, in_stock_count)')
+    parser.add_argument('--market', type=str, default=None, help='Show what changed in this market (netloc)')
+    parser.add_argument('--since', type=str, default=None,
+                       help='With --market: changes at or after this time (YYYY-MM-DD[THH:MM] or Unix time)')
+    parser.add_argument('--build', nargs='+', metavar='ARCHIVE',
+                       help='Import archives (products_html.json files, oldest first)')
+    parser.add_argument('--extract', action='store_true',
+                       help='With --build: run extract_product_details on records without parsed fields')
+
+    args = parser.parse_args()
+
+    store = HistoryStore(args.history)
+    try:
+        for path in args.build or []:
+            count = import_archive(store, path, extract=args.extract)
+            print(colored(f"✅ Imported {count} records from {path} ({len(store)} listings)", "green"))
+        if args.build:
+            store.print_stats()
+            if store.stats['out_of_order']:
+                print(colored(f"⚠️  {store.stats['out_of_order']} snapshots older than the stored history were ignored "
+                              f"(import archives oldest first)", "yellow"))
+            if store.stats['undated']:
+                print(colored(f"⚠️  {store.stats['undated']} records without fetched_at were skipped", "yellow"))
+
+        if args.url:
+            entries = store.history(args.url, args.field)
+            if not entries:
+                print(colored(f"❌ No history for {args.url}", "red"))
+            for at, field, value in entries:
+                print(colored(f"{_format_time(at)}  ", "white") + colored(f"{field:<16}", "cyan") +
+                      ("(gone)" if value is None else _format_value(value)))
+
+        if args.market:
+            since = args.since or 0
+            fields = [args.field] if args.field else None
+            rows = store.changes_since(args.market, since, fields)
+            for url, at, field, value in rows:
+                print(colored(f"{_format_time(at)}  ", "white") + colored(f"{field:<16}", "cyan") +
+                      f"{'(gone)' if value is None else _format_value(value):<24} {url}")
+            print(colored(f"\n{len(rows)} changes in {args.market} (new listings shown with their first values)", "blue"))
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
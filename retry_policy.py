@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Retry policy and per-host circuit breakers shared by the scrapers
+
+fetch_with_retry() is the single place that decides whether a fetch is
+worth repeating:
+
+- Connection errors, timeouts and retryable statuses (408, 425, 429, 5xx)
+  are retried; other statuses (403, 404...) are returned at once, and
+  FetchAborted (non-HTML, too big) is never retried
+- Waits use capped exponential backoff with jitter, or the server's
+  Retry-After header when it sends one
+- Each host has a circuit breaker: after N consecutive failures the host is
+  "open" and requests fail fast with CircuitOpen for a cooldown period, then
+  a single probe request decides whether it closes again
+
+Retry and breaker counters are kept in RETRY_STATS for the run summary.
+"""
+
+import email.utils
+import random
+import threading
+import time
+import urllib.parse
+import requests
+from termcolor import colored
+
+import crawl_log
+import http_fetch
+import mirrors
+from fetch_replay import pause
+from http_fetch import FetchAborted
+
+
+# Defaults (overridable from the command line of each scraper)
+MAX_ATTEMPTS = 3
+BASE_DELAY = 2.0
+MAX_DELAY = 60.0
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 120.0
+
+log = crawl_log.get_logger('retry')
+
+RETRYABLE_STATUS = frozenset([408, 425, 429, 500, 502, 503, 504, 520, 521, 522, 523, 524])
+
+RETRY_STATS = {
+    'attempts': 0,
+    'retries': 0,
+    'retry_after_waits': 0,
+    'gave_up': 0,
+    'breaker_opened': 0,
+    'breaker_rejected': 0,
+}
+_stats_lock = threading.Lock()
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    """The host's circuit breaker is open; the request was not sent."""
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"circuit open for {host} (retry in {retry_in:.0f}s)")
+        self.host = host
+        self.retry_in = retry_in
+
+
+def _record(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            RETRY_STATS[key] = RETRY_STATS.get(key, 0) + value
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker for one host (closed → open → half-open)."""
+
+    def __init__(self, host, threshold, cooldown):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """Raise CircuitOpen unless a request to this host may go out now."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining > 0 or self.probing:
+                _record(breaker_rejected=1)
+                raise CircuitOpen(self.host, max(remaining, 0))
+            # Half-open: let exactly one probe through
+            self.probing = True
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                log.info("🔌 Circuit closed for %s", self.host, extra={'event': 'breaker_closed', 'host': self.host,
+                                                                      'color': "green"})
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def abandon_probe(self):
+        """The half-open probe ended without an answer either way (not a network error): allow another."""
+        with self._lock:
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    _record(breaker_opened=1)
+                self.opened_at = time.monotonic()
+                self.probing = False
+                log.error("🔌 Circuit open for %s after %d failures; pausing %.0fs", self.host, self.failures,
+                          self.cooldown, extra={'event': 'breaker_open', 'host': self.host})
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(url):
+    # Per address actually fetched: with --mirrors one dead mirror must not pause the whole market
+    host = mirrors.fetch_host(url)
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host, BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+        return breaker
+
+
+def backoff_delay(attempt, base_delay=None, max_delay=None):
+    """Capped exponential backoff with full jitter for the given retry number (0-based)."""
+    base_delay = BASE_DELAY if base_delay is None else base_delay
+    max_delay = MAX_DELAY if max_delay is None else max_delay
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(when.timestamp() - time.time(), 0.0)
+
+
+def fetch_with_retry(session, url, max_attempts=None, fetch=None, **kwargs):
+    """
+    Fetch url through http_fetch.fetch() under the shared retry policy.
+    Returns the final Response (200 or a non-retryable status) or raises the
+    last RequestException (including FetchAborted and CircuitOpen).
+    """
+    # At least one attempt: with none there would be no response to return
+    max_attempts = max(1, MAX_ATTEMPTS if max_attempts is None else max_attempts)
+    fetch = fetch or http_fetch.fetch
+
+    for attempt in range(max_attempts):
+        # Looked up per attempt: the mirror route can change between retries
+        breaker = breaker_for(url)
+        breaker.before_request()
+        _record(attempts=1)
+        retry_after = None
+        try:
+            response = fetch(session, url, **kwargs)
+        except FetchAborted:
+            # The host answered; the payload just wasn't wanted
+            breaker.record_success()
+            raise
+        except requests.exceptions.RequestException as e:
+            breaker.record_failure()
+            if attempt == max_attempts - 1:
+                _record(gave_up=1)
+                raise
+            log.warning("⚠️  Error fetching %s (attempt %d/%d): %s", url, attempt + 1, max_attempts, e,
+                        extra={'event': 'retry', 'url': url, 'attempt': attempt + 1})
+        except BaseException:
+            # Not the host's fault (a refresher, the recorder, Ctrl-C); a half-open breaker must not stay stuck
+            breaker.abandon_probe()
+            raise
+        else:
+            if response.status_code not in RETRYABLE_STATUS:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            if attempt == max_attempts - 1:
+                _record(gave_up=1)
+                return response
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            log.warning("⚠️  HTTP %s for %s (attempt %d/%d)", response.status_code, url, attempt + 1, max_attempts,
+                        extra={'event': 'retry', 'url': url, 'attempt': attempt + 1, 'status': response.status_code})
+
+        if retry_after is not None:
+            _record(retry_after_waits=1)
+            delay = min(retry_after, MAX_DELAY)
+        else:
+            delay = backoff_delay(attempt)
+        _record(retries=1)
+        pause(delay)
+
+
+def configure(max_attempts=None, breaker_threshold=None, breaker_cooldown=None):
+    """Override the module defaults (called from the scrapers' main())."""
+    global MAX_ATTEMPTS, BREAKER_THRESHOLD, BREAKER_COOLDOWN
+    if max_attempts is not None:
+        MAX_ATTEMPTS = max(1, max_attempts)
+    if breaker_threshold is not None:
+        BREAKER_THRESHOLD = breaker_threshold
+    if breaker_cooldown is not None:
+        BREAKER_COOLDOWN = breaker_cooldown
+
+
+def print_retry_stats():
+    """Print the retry/breaker section of the run summary."""
+    with _stats_lock:
+        stats = dict(RETRY_STATS)
+    print(colored(f"🔁 Retry stats: {stats['attempts']} attempts, {stats['retries']} retries "
+                  f"({stats['retry_after_waits']} honoring Retry-After), {stats['gave_up']} gave up", "white"))
+    if stats['breaker_opened'] or stats['breaker_rejected']:
+        print(colored(f"   Circuit breakers: opened {stats['breaker_opened']} times, "
+                      f"{stats['breaker_rejected']} requests skipped while open", "white"))
@@ -28,9 +28,12 @@ Use Beautiful Soup to parse HTML
 
 
 import random
+import sys
 import time
 import pickle
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
 from selenium.webdriver.firefox.options import Options
 from selenium.common.exceptions import TimeoutException
@@ -39,6 +42,29 @@ from bs4 import BeautifulSoup
 from termcolor import colored
 import urllib.parse
 import re
+from extraction_profiles import PROFILES_FILE, ProfileStore
+from near_duplicates import (NEAR_CERTAIN_THRESHOLD, distinctive, listing_text,
+                             load_index as load_near_duplicate_index, save_index as save_near_duplicate_index)
+import adaptive_timeouts
+import challenge_guard
+import crawl_log
+import fetch_replay
+import http_fetch
+import mirrors
+import store_api
+import structured_data
+from http_fetch import FetchAborted, print_fetch_stats
+import retry_policy
+import tor_control
+from retry_policy import fetch_with_retry, print_retry_stats
+from archive_index import ArchiveIndex
+from archive_io import JsonArrayWriter
+from crawl_scheduler import Budget, DedupeIndex, FairScheduler
+from pipeline import DEFAULT_QUEUE_SIZE, Pipeline
+from image_store import IMAGES_DIR, ImagePipeline, print_image_stats
+from product_history import HISTORY_FILE, HistoryStore
+from warc_archive import MAX_WARC_BYTES, WarcWriter
+from search_index import index_page, open_index as open_search_index, search as search_local_index
 
 # Proxy setup defaults
 proxy_host = "127.0.0.1"
@@ -47,16 +73,48 @@ tor_socks_port = 9050
 
 # JSON file to store scraped products
 products_output_file = "products.json"
-# JSON file to store full pages (HTML + metadata)
-pages_output_file = "scraped_pages.json"
+# WARC archive of full pages (HTML + headers), written with --save-pages
+pages_warc_dir = "scraped_pages_warc"
 
 # JSON file to store keyword-specific URLs
 keyword_urls_file = "pages_url.json"
-# JSON file to store raw HTML for product listings
+# JSON file to store raw HTML for product listings (appended one record at a time)
 products_html_output_file = "products_html.json"
+product_html_writer = None
 
-# Global flag set in main()
-save_pages = False
+# WARC writer set in main() with --save-pages
+page_archive = None
+
+# Near-duplicate indexes (set in main() with --near-duplicates)
+near_duplicates_file = "near_duplicates.pkl"
+near_duplicate_cards_file = "near_duplicate_cards.pkl"
+near_duplicate_index = None   # title + description of fetched listings → cluster IDs
+near_duplicate_cards = None   # title + price of listing cards whose detail page was fetched
+skip_near_duplicates = False
+
+# Local full-text index fed by the crawl (set in main() with --search-index)
+search_index_conn = None
+
+# Per-market selector ordering (learning and persisted unless --no-profiles)
+extraction_profiles = ProfileStore(None, learn=False)
+
+# Price/stock history of listings (set in main() with --history)
+product_history = None
+
+# Background image downloader (set in main() with --images)
+image_pipeline = None
+
+# Staged fetch → parse → write pipeline for listing detail pages (set in main() with --pipeline)
+detail_pipeline = None
+
+# Per-page and per-listing messages (queued, rate-limited and optionally JSON; see crawl_log)
+log = crawl_log.get_logger()
+
+# Shared state of the concurrent crawl (pages are scraped by --workers threads)
+store_lock = threading.RLock()    # products.json, near-duplicate indexes, search index writes
+fallback_lock = threading.Lock()  # the single Selenium fallback driver
+listing_claims = None             # listing URLs whose HTML is stored or being fetched (set with the writer)
+product_budget = Budget()         # --max-products detail pages, shared by all workers
 
 # Helper functions to manage JSON storage
 import json
@@ -104,54 +162,36 @@ def save_keyword_urls_atomic(urls):
                 pass
 
 
-def load_saved_product_html():
-    if not os.path.exists(products_html_output_file):
-        return []
-    try:
-        with open(products_html_output_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return []
-
-
-def save_product_html_atomic(entries):
-    dirpath = os.path.dirname(os.path.abspath(products_html_output_file)) or '.'
-    fd, tmp_path = tempfile.mkstemp(dir=dirpath, prefix='tmp_product_html_', suffix='.json')
-    try:
-        with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
-            json.dump(entries, tmp_file, ensure_ascii=False, indent=2)
-        os.replace(tmp_path, products_html_output_file)
-    finally:
-        if os.path.exists(tmp_path):
-            try:
-                os.remove(tmp_path)
-            except Exception:
-                pass
+def open_product_html_writer():
+    """Open products_html.json for appending; each record's offset goes into archive_index.db."""
+    global product_html_writer, listing_claims
+    with store_lock:
+        if product_html_writer is None:
+            product_html_writer = JsonArrayWriter(products_html_output_file, resume=True, index=ArchiveIndex())
+            listing_claims = DedupeIndex(product_html_writer.seen_urls)
+    return product_html_writer
 
 
-def load_saved_pages():
-    if not os.path.exists(pages_output_file):
-        return []
-    try:
-        with open(pages_output_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return []
+def close_product_html_writer():
+    global product_html_writer, listing_claims
+    if product_html_writer is not None:
+        product_html_writer.close()
+        product_html_writer.index.close()
+        product_html_writer = None
+        listing_claims = None
 
 
-def save_pages_atomic(pages):
-    dirpath = os.path.dirname(os.path.abspath(pages_output_file)) or '.'
-    fd, tmp_path = tempfile.mkstemp(dir=dirpath, prefix='tmp_pages_', suffix='.json')
+def archive_page(url, response=None, html=None):
+    """Append a fetched page to the WARC archive (--save-pages); cost is independent of archive size."""
+    if page_archive is None:
+        return
     try:
-        with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
-            json.dump(pages, tmp_file, ensure_ascii=False, indent=2)
-        os.replace(tmp_path, pages_output_file)
-    finally:
-        if os.path.exists(tmp_path):
-            try:
-                os.remove(tmp_path)
-            except Exception:
-                pass
+        if response is not None:
+            page_archive.write_response(url, response)
+        else:
+            page_archive.write_resource(url, html)
+    except Exception as e:
+        log.error("Failed archiving page %s: %s", url, e, extra={'event': 'archive_error', 'url': url})
 
 # File to track last URL scraped
 checkpoint_file = "scraping_checkpoint.pkl"
@@ -174,6 +214,11 @@ def save_checkpoint(url_queue):
     with open(checkpoint_file, 'wb') as f:
         pickle.dump(url_queue, f)
 
+def category_of(url):
+    """Group a paginated URL with its first page (/page/N/, ?page=N) for fair scheduling."""
+    url = re.sub(r'/page/\d+/?$', '/', url)
+    return re.sub(r'([?&])(paged|page)=\d+&?', r'\1', url).rstrip('?&')
+
 # Function to clean text by removing unwanted characters
 def clean_text(text):
     text = re.sub(r'[\n\r]+', ' ', text)
@@ -219,43 +264,40 @@ def setup_requests_session(cookies):
     return session
 
 # Scrape post content
-def scrape_post_content(session, post_url, retries=3):
-    attempt = 0
-    while attempt < retries:
-        try:
-            response = session.get(post_url, timeout=30)
-            if response.status_code == 200:
-                # Optionally save the raw HTML of the fetched page
-                if save_pages:
-                    try:
-                        pages = load_saved_pages()
-                        pages.append({
-                            'url': post_url,
-                            'timestamp': int(time.time()),
-                            'html': response.text
-                        })
-                        save_pages_atomic(pages)
-                    except Exception as e:
-                        print(colored(f"Failed saving fetched page to pages JSON: {e}", "red"))
+def scrape_post_content(session, post_url, retries=None):
+    try:
+        response = fetch_with_retry(session, post_url, max_attempts=retries, timeout=30, page_type='post')
+    except FetchAborted as e:
+        log.warning("Skipped %s: %s", post_url, e.reason, extra={'event': 'skipped', 'url': post_url})
+        return ""
+    except requests.exceptions.RequestException as e:
+        log.error("Giving up on %s: %s", post_url, e, extra={'event': 'fetch_error', 'url': post_url})
+        return ""
 
-                soup = BeautifulSoup(response.content, 'html.parser')
-                content = soup.find('div', class_='postContent').get_text(separator="\n")
-                return clean_text(content)
-            else:
-                print(colored(f"Warning: Failed to retrieve content from {post_url}", "yellow"))
-        except requests.exceptions.RequestException as e:
-            attempt += 1
-            print(colored(f"Connection error on {post_url}, retry {attempt}/{retries}: {e}", "red"))
-            time.sleep(5)  # Wait before retrying
-    return ""
+    if response.status_code != 200:
+        log.warning("Warning: Failed to retrieve content from %s (status %s)", post_url, response.status_code,
+                    extra={'event': 'http_status', 'url': post_url, 'status': response.status_code})
+        return ""
+
+    # Optionally archive the fetched page
+    archive_page(post_url, response=response)
+
+    soup = BeautifulSoup(http_fetch.page_text(response), 'html.parser')
+    content = soup.find('div', class_='postContent').get_text(separator="\n")
+    return clean_text(content)
 
 
-def extract_product_details(soup, url):
+def extract_product_details(soup, url, html=None):
     """
     Flexible product detail extraction using multiple strategies.
     Returns a dictionary with all available product information.
+    The page's JSON-LD / microdata is read first (from html when given);
+    the selector chains only look for the fields it did not supply, and
+    'field_sources' records where each field came from.
     """
-    details = {}
+    details, structured_source = structured_data.product_fields(soup, html)
+    sources = dict.fromkeys(details, structured_source)
+    market = urllib.parse.urlparse(url).netloc if url else None
     
     # --- TITLE EXTRACTION ---
     title_selectors = [
@@ -268,11 +310,11 @@ def extract_product_details(soup, url):
         'h1'
     ]
     
-    for selector in title_selectors:
-        title_elem = soup.select_one(selector)
-        if title_elem:
-            details['title'] = clean_text(title_elem.get_text())
-            break
+    title_elem = None
+    if 'title' not in details:
+        _, title_elem = extraction_profiles.first(market, 'detail.title', title_selectors, soup.select_one)
+    if title_elem:
+        details['title'] = clean_text(title_elem.get_text())
     
     # --- PRICE EXTRACTION ---
     price_selectors = [
@@ -284,16 +326,16 @@ def extract_product_details(soup, url):
         '[itemprop="price"]'
     ]
     
-    for selector in price_selectors:
-        price_elem = soup.select_one(selector)
-        if price_elem:
-            price_text = clean_text(price_elem.get_text())
-            # Extract numeric price using regex
-            price_match = re.search(r'[\$€£¥]?\s*(\d+[.,]?\d*)', price_text)
-            if price_match:
-                details['price'] = price_text
-                details['price_numeric'] = price_match.group(1).replace(',', '')
-            break
+    price_elem = None
+    if 'price' not in details:
+        _, price_elem = extraction_profiles.first(market, 'detail.price', price_selectors, soup.select_one)
+    if price_elem:
+        price_text = clean_text(price_elem.get_text())
+        # Extract numeric price using regex
+        price_match = re.search(r'[\$€£¥]?\s*(\d+[.,]?\d*)', price_text)
+        if price_match:
+            details['price'] = price_text
+            details['price_numeric'] = price_match.group(1).replace(',', '')
     
     # --- STOCK/AVAILABILITY EXTRACTION ---
     stock_patterns = [
@@ -317,19 +359,20 @@ def extract_product_details(soup, url):
         '.out-of-stock'
     ]
     
-    for selector in stock_selectors:
-        stock_elem = soup.select_one(selector)
-        if stock_elem:
-            stock_text = clean_text(stock_elem.get_text())
-            details['stock_raw'] = stock_text
-            
-            # Try to extract specific stock information
-            for pattern, key in stock_patterns:
-                match = re.search(pattern, stock_text, re.IGNORECASE)
-                if match:
-                    details[key] = match.group(1)
-                    break
-            break
+    # Structured data rarely has the count, so the stock text is still read for it
+    stock_elem = None
+    if 'in_stock_count' not in details:
+        _, stock_elem = extraction_profiles.first(market, 'detail.stock', stock_selectors, soup.select_one)
+    if stock_elem:
+        stock_text = clean_text(stock_elem.get_text())
+        details['stock_raw'] = stock_text
+        
+        # Try to extract specific stock information
+        for pattern, key in stock_patterns:
+            match = re.search(pattern, stock_text, re.IGNORECASE)
+            if match:
+                details.setdefault(key, match.group(1))
+                break
     
     # --- DESCRIPTION EXTRACTION ---
     description_selectors = [
@@ -342,22 +385,20 @@ def extract_product_details(soup, url):
         '[itemprop="description"]'
     ]
     
-    for selector in description_selectors:
-        desc_elem = soup.select_one(selector)
-        if desc_elem:
-            # Get text but preserve some structure
-            desc_text = desc_elem.get_text(separator='\n', strip=True)
-            details['description'] = clean_text(desc_text)
-            
-            # Also extract key-value pairs (manufacturer, substance, package, etc.)
-            desc_lines = [line.strip() for line in desc_text.split('\n') if line.strip()]
-            for line in desc_lines:
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    key = key.strip().lower().replace(' ', '_')
-                    value = value.strip()
-                    details[f'desc_{key}'] = value
-            break
+    _, desc_elem = extraction_profiles.first(market, 'detail.description', description_selectors, soup.select_one)
+    if desc_elem:
+        # Get text but preserve some structure
+        desc_text = desc_elem.get_text(separator='\n', strip=True)
+        details['description'] = clean_text(desc_text)
+        
+        # Also extract key-value pairs (manufacturer, substance, package, etc.)
+        desc_lines = [line.strip() for line in desc_text.split('\n') if line.strip()]
+        for line in desc_lines:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                key = key.strip().lower().replace(' ', '_')
+                value = value.strip()
+                details[f'desc_{key}'] = value
     
     # --- CATEGORY EXTRACTION ---
     category_selectors = [
@@ -369,8 +410,7 @@ def extract_product_details(soup, url):
     ]
     
     categories = []
-    for selector in category_selectors:
-        cat_elems = soup.select(selector)
+    for _, cat_elems in extraction_profiles.collect(market, 'detail.category', category_selectors, soup.select):
         for elem in cat_elems:
             cat_text = clean_text(elem.get_text())
             if cat_text and cat_text.lower() not in ['home', 'shop']:
@@ -387,15 +427,15 @@ def extract_product_details(soup, url):
         '[itemprop="sku"]'
     ]
     
-    for selector in sku_selectors:
-        sku_elem = soup.select_one(selector)
-        if sku_elem:
-            details['sku'] = clean_text(sku_elem.get_text())
-            break
+    sku_elem = None
+    if 'sku' not in details:
+        _, sku_elem = extraction_profiles.first(market, 'detail.sku', sku_selectors, soup.select_one)
+    if sku_elem:
+        details['sku'] = clean_text(sku_elem.get_text())
     
     # --- REVIEWS/RATING EXTRACTION ---
     # Star rating
-    rating_elem = soup.select_one('.star-rating, [class*="rating"]')
+    rating_elem = soup.select_one('.star-rating, [class*="rating"]') if 'rating_stars' not in details else None
     if rating_elem:
         # Try to extract rating from style width
         style = rating_elem.get('style', '')
@@ -411,7 +451,9 @@ def extract_product_details(soup, url):
             details['rating_stars'] = float(rating_match.group(1))
     
     # Review count
-    review_count_elem = soup.select_one('.woocommerce-review-link, [class*="review"][class*="count"]')
+    review_count_elem = None
+    if 'review_count' not in details:
+        review_count_elem = soup.select_one('.woocommerce-review-link, [class*="review"][class*="count"]')
     if review_count_elem:
         review_text = review_count_elem.get_text()
         count_match = re.search(r'(\d+)', review_text)
@@ -501,8 +543,7 @@ def extract_product_details(soup, url):
     ]
     
     images = []
-    for selector in image_selectors:
-        img_elems = soup.select(selector)
+    for _, img_elems in extraction_profiles.collect(market, 'detail.images', image_selectors, soup.select):
         for img in img_elems:
             img_url = img.get('src') or img.get('data-src') or img.get('data-lazy-src')
             if img_url and 'placeholder' not in img_url:
@@ -512,79 +553,232 @@ def extract_product_details(soup, url):
         details['images'] = list(dict.fromkeys(images))  # Remove duplicates
         details['main_image'] = images[0] if images else None
     
+    details['field_sources'] = {field: sources.get(field, structured_data.SELECTOR) for field in details}
     return details
 
 
-def parse_and_save_products(html, base_url, scraped_products, session=None):
-    """Parse provided HTML, persist product metadata, and archive listing HTML."""
-    soup = BeautifulSoup(html, 'html.parser')
-
-    products_cache = getattr(parse_and_save_products, 'products_cache', load_saved_products())
-    saved_product_urls = getattr(parse_and_save_products, 'saved_urls', {p.get('listing url') for p in products_cache if p.get('listing url')})
-
-    product_html_cache = getattr(parse_and_save_products, 'products_html_cache', load_saved_product_html())
-    saved_html_urls = getattr(parse_and_save_products, 'saved_html_urls', {p.get('listing url') for p in product_html_cache if p.get('listing url')})
-
-    def save_product_record(record):
-        listing_url = record.get('listing url')
+def fetch_listing_html(session, listing_url):
+    """HTML of a listing detail page, or None when it could not be fetched."""
+    try:
+        detail_resp = fetch_with_retry(session, listing_url, timeout=25, page_type='product')
+        if detail_resp.status_code == 200:
+            return http_fetch.page_text(detail_resp)
+        log.warning("Failed to fetch listing HTML (%s): %s", detail_resp.status_code, listing_url,
+                    extra={'event': 'http_status', 'url': listing_url, 'status': detail_resp.status_code})
+    except requests.exceptions.RequestException as exc:
+        log.error("Error fetching listing HTML %s: %s", listing_url, exc,
+                  extra={'event': 'fetch_error', 'url': listing_url})
+    return None
+
+
+def parse_listing_html(page):
+    """extract_product_details() of an (html, url) pair; runs in the --pipeline parse processes."""
+    html_text, listing_url = page
+    return extract_product_details(BeautifulSoup(html_text, 'html.parser'), listing_url, html_text)
+
+
+def release_listing(listing_url, history_only=False):
+    """Give back the claim and budget of a listing whose detail page was not stored."""
+    if not history_only and listing_claims is not None:
+        listing_claims.release(listing_url)
+    product_budget.release()
+    crawl_log.item_done(ok=False)
+
+
+def save_listing(listing_url, market_name, category_page, html_text, product_details, history_only=False,
+                 card_text=None):
+    """Persist a fetched listing: history, products_html.json, near-duplicate and search indexes, images."""
+    fetched_at = int(time.time())
+
+    if product_history is not None:
+        changed = product_history.record(listing_url, market_name, product_details, fetched_at)
+        if history_only:
+            # Only the changed fields are kept; no second full copy of the page
+            if changed:
+                log.info("Changed since last crawl (%s): %s", ', '.join(changed), listing_url,
+                         extra={'event': 'changed', 'url': listing_url})
+            else:
+                log.info("Unchanged since last crawl: %s", listing_url, extra={'event': 'unchanged', 'url': listing_url})
+            crawl_log.item_done()
+            return
+
+    html_record = {
+        "market": market_name,
+        "category page": category_page,
+        "listing url": listing_url,
+        "fetched_at": fetched_at,
+        "html": html_text,
+        **product_details  # Include all extracted details
+    }
+
+    with store_lock:
+        if near_duplicate_index is not None:
+            cluster_id = near_duplicate_index.add(
+                listing_url, listing_text(product_details.get('title'), product_details.get('description')))
+            if cluster_id:
+                html_record['cluster_id'] = cluster_id
+
+        if search_index_conn is not None:
+            try:
+                index_page(search_index_conn, listing_url, html=html_text, title=product_details.get('title'),
+                           description=product_details.get('description'), market=market_name, kind='listing')
+            except Exception as e:
+                log.error("Failed indexing listing text: %s", e, extra={'event': 'index_error', 'url': listing_url})
+
+        open_product_html_writer().write(html_record)
+
+        if card_text and near_duplicate_cards is not None:
+            near_duplicate_cards.add(listing_url, card_text)
+
+    if image_pipeline is not None and product_details.get('images'):
+        image_pipeline.submit(listing_url, product_details['images'])
+    structured_data.tally(product_details)
+    crawl_log.item_done()
+    log.info("Stored %s for: %s", "HTML" if html_text is not None else "Store API fields", listing_url,
+             extra={'event': 'stored', 'url': listing_url})
+
+    # Extracted fields, for debugging
+    if product_details:
+        log.debug("  Extracted: %s", ', '.join(product_details.keys()),
+                  extra={'event': 'extracted', 'url': listing_url})
+
+
+def _init_parse_process(profiles_path):
+    """Parse processes use the learned selector ordering read-only (learning stays in the main process)."""
+    global extraction_profiles
+    if profiles_path:
+        extraction_profiles = ProfileStore(profiles_path, frozen=True)
+
+
+def _pipeline_parse(page):
+    """parse_listing_html() plus the selector hits it observed, for the writer to learn from."""
+    return parse_listing_html(page), extraction_profiles.take_pending()
+
+
+def _pipeline_fetch(job):
+    html_text = fetch_listing_html(job['session'], job['listing url'])
+    if html_text is None:
+        return None
+    job['html'] = html_text  # kept for the writer; the parse process gets a copy
+    fetch_replay.pause(random.uniform(1, 2.5))
+    return html_text, job['listing url']
+
+
+def _pipeline_write(job, parsed, error):
+    listing_url = job['listing url']
+    product_details = None
+    if parsed is not None:
+        product_details, observations = parsed
+        extraction_profiles.replay(observations)
+    if product_details is None:
+        if error is not None:
+            log.error("Error extracting listing %s: %s", listing_url, error,
+                      extra={'event': 'parse_error', 'url': listing_url})
+        release_listing(listing_url, job['history_only'])
+        return
+    try:
+        save_listing(listing_url, job['market'], job['category page'], job['html'], product_details,
+                     job['history_only'], job['card_text'])
+    except Exception:
+        # Not stored: free the claim and budget slot so the listing can be fetched again
+        release_listing(listing_url, job['history_only'])
+        raise
+
+
+def save_product_record(record):
+    """Add a listing card record to products.json; False when its listing URL is already there."""
+    listing_url = record.get('listing url')
+    with store_lock:
+        if not hasattr(save_product_record, 'products_cache'):
+            products_cache = load_saved_products()
+            save_product_record.products_cache = products_cache
+            save_product_record.saved_urls = {p.get('listing url') for p in products_cache if p.get('listing url')}
+        products_cache = save_product_record.products_cache
+        saved_product_urls = save_product_record.saved_urls
         if listing_url in saved_product_urls:
             return False
         products_cache.append(record)
         save_products_atomic(products_cache)
         saved_product_urls.add(listing_url)
-        parse_and_save_products.products_cache = products_cache
-        parse_and_save_products.saved_urls = saved_product_urls
         return True
 
-    def ensure_product_html(listing_url, market_name, category_page, fallback_html=None):
-        if listing_url in saved_html_urls:
+
+def ensure_product_html(session, listing_url, market_name, category_page, fallback_html=None, card_text=None,
+                        details=None):
+    """
+    Claim a listing and store it from fallback_html, from ready-made details (--store-api) or by fetching
+    its detail page; True when it was stored (or queued in the pipeline) as a new listing.
+    """
+    history_only = False
+    # Another worker may be fetching the same listing from another category page
+    if not listing_claims.claim(listing_url):
+        # Stored by an earlier crawl: with --history, fetch it once per run and keep only what changed
+        if (product_history is None or listing_url not in open_product_html_writer().seen_urls
+                or not product_history.claim(listing_url)):
             return False
+        history_only = True
+    elif product_history is not None:
+        product_history.claim(listing_url)
+    if not product_budget.acquire():
+        if not history_only:
+            listing_claims.release(listing_url)
+        return False
+    crawl_log.add_total(1)
+
+    pipeline = detail_pipeline
+    if pipeline is not None and not fallback_html and details is None and session:
+        # Fetch, parse and store happen in the pipeline stages; this page moves on to the next card
+        if pipeline.submit({'session': session, 'listing url': listing_url, 'market': market_name,
+                            'category page': category_page, 'history_only': history_only,
+                            'card_text': card_text}):
+            return True
+        # The run is ending and the pipeline no longer takes work
+        release_listing(listing_url, history_only)
+        return False
+
+    stored = False
+    try:
+        stored = store_product_html(session, listing_url, market_name, category_page, fallback_html, history_only,
+                                    card_text, details)
+    finally:
+        if not stored:
+            release_listing(listing_url, history_only)
+    return stored and not history_only
 
-        html_text = fallback_html
-        fetched_remotely = False
 
-        if not html_text and session:
-            try:
-                detail_resp = session.get(listing_url, timeout=25)
-                if detail_resp.status_code == 200:
-                    html_text = detail_resp.text
-                    fetched_remotely = True
-                else:
-                    print(colored(f"Failed to fetch listing HTML ({detail_resp.status_code}): {listing_url}", "yellow"))
-            except requests.exceptions.RequestException as exc:
-                print(colored(f"Error fetching listing HTML {listing_url}: {exc}", "red"))
+def store_product_html(session, listing_url, market_name, category_page, fallback_html=None, history_only=False,
+                       card_text=None, details=None):
+    if details is not None:
+        # The Store API already gave the fields; there is no page to keep
+        save_listing(listing_url, market_name, category_page, None, details, history_only, card_text)
+        return True
 
-        if not html_text:
-            return False
+    html_text = fallback_html
+    fetched_remotely = False
 
-        # Extract detailed product information from the HTML
-        detail_soup = BeautifulSoup(html_text, 'html.parser')
-        product_details = extract_product_details(detail_soup, listing_url)
-
-        html_record = {
-            "market": market_name,
-            "category page": category_page,
-            "listing url": listing_url,
-            "fetched_at": int(time.time()),
-            "html": html_text,
-            **product_details  # Include all extracted details
-        }
-
-        product_html_cache.append(html_record)
-        save_product_html_atomic(product_html_cache)
-        saved_html_urls.add(listing_url)
-        parse_and_save_products.products_html_cache = product_html_cache
-        parse_and_save_products.saved_html_urls = saved_html_urls
-        print(colored(f"Stored HTML for: {listing_url}", "blue"))
-        
-        # Print extracted details for debugging
-        if product_details:
-            print(colored(f"  Extracted: {', '.join(product_details.keys())}", "cyan"))
+    if not html_text and session:
+        html_text = fetch_listing_html(session, listing_url)
+        fetched_remotely = html_text is not None
 
-        if fetched_remotely:
-            time.sleep(random.uniform(1, 2.5))
+    if not html_text:
+        return False
 
-        return True
+    # Extract detailed product information from the HTML
+    product_details = parse_listing_html((html_text, listing_url))
+    save_listing(listing_url, market_name, category_page, html_text, product_details, history_only, card_text)
+
+    if fetched_remotely:
+        fetch_replay.pause(random.uniform(1, 2.5))
+
+    return True
+
+
+def parse_and_save_products(html, base_url, scraped_products, session=None):
+    """Parse provided HTML, persist product metadata, and archive listing HTML."""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    html_writer = open_product_html_writer()
+    saved_html_urls = html_writer.seen_urls
 
     market_name = base_url.split('/')[2]
 
@@ -599,12 +793,11 @@ def parse_and_save_products(html, base_url, scraped_products, session=None):
         '.listing-item'
     ]
     
-    products = []
-    for selector in product_selectors:
-        products = soup.select(selector)
-        if products:
-            print(colored(f"Found {len(products)} products using selector: {selector}", "cyan"))
-            break
+    selector, products = extraction_profiles.first(market_name, 'listing.cards', product_selectors, soup.select)
+    products = products or []
+    if products:
+        log.info("Found %d products using selector: %s", len(products), selector,
+                 extra={'event': 'found', 'url': base_url, 'count': len(products)})
 
     for product in products:
         try:
@@ -616,11 +809,7 @@ def parse_and_save_products(html, base_url, scraped_products, session=None):
                 'h3',
                 '[class*="title"]'
             ]
-            title_element = None
-            for sel in title_selectors:
-                title_element = product.select_one(sel)
-                if title_element:
-                    break
+            _, title_element = extraction_profiles.first(market_name, 'card.title', title_selectors, product.select_one)
             
             # Extract price with flexible selectors
             price_selectors = [
@@ -629,11 +818,7 @@ def parse_and_save_products(html, base_url, scraped_products, session=None):
                 '.product-price',
                 '.cost'
             ]
-            price_element = None
-            for sel in price_selectors:
-                price_element = product.select_one(sel)
-                if price_element:
-                    break
+            _, price_element = extraction_profiles.first(market_name, 'card.price', price_selectors, product.select_one)
             
             # Extract link with flexible selectors
             link_element = product.select_one('a[href]')
@@ -643,7 +828,7 @@ def parse_and_save_products(html, base_url, scraped_products, session=None):
 
             title = title_element.get_text(strip=True)
             price = price_element.get_text(strip=True) if price_element else 'N/A'
-            listing_url = urllib.parse.urljoin(base_url, link_element['href'])
+            listing_url = mirrors.canonical(urllib.parse.urljoin(base_url, link_element['href']))
 
             product_document = {
                 "market": market_name,
@@ -653,21 +838,41 @@ def parse_and_save_products(html, base_url, scraped_products, session=None):
                 "price": price
             }
 
+            # Same title and price as a card we already fetched (e.g. on a mirror)?
+            duplicate_of = None
+            card_text = listing_text(title, price)
+            if near_duplicate_cards is not None and listing_url not in saved_html_urls:
+                with store_lock:
+                    duplicate_of, _ = near_duplicate_cards.query(card_text, threshold=NEAR_CERTAIN_THRESHOLD)
+                    if duplicate_of:
+                        product_document["near_duplicate_of"] = duplicate_of
+                        cluster_id = near_duplicate_index.cluster_of(duplicate_of)
+                        if cluster_id:
+                            product_document["cluster_id"] = cluster_id
+
             if save_product_record(product_document):
-                print(colored(f"Product saved: {title}", "green"))
+                log.info("Product saved: %s", title, extra={'event': 'saved', 'url': listing_url})
             else:
-                print(colored(f"Skipping duplicate product: {title}", "yellow"))
+                log.info("Skipping duplicate product: %s", title, extra={'event': 'duplicate', 'url': listing_url})
+
+            if duplicate_of and skip_near_duplicates:
+                if distinctive(card_text):
+                    log.info("Skipping detail fetch, near-duplicate of: %s", duplicate_of,
+                             extra={'event': 'near_duplicate', 'url': listing_url, 'matched': duplicate_of})
+                    continue
+                log.debug("Card too short to trust its near-duplicate match with %s; fetching", duplicate_of,
+                          extra={'event': 'near_duplicate_short', 'url': listing_url, 'matched': duplicate_of})
 
-            ensure_product_html(listing_url, market_name, base_url)
+            ensure_product_html(session, listing_url, market_name, base_url, card_text=card_text)
 
         except Exception as e:
-            print(colored(f"Error parsing product: {e}", "red"))
+            log.error("Error parsing product: %s", e, extra={'event': 'parse_error', 'url': base_url})
 
     # Handle single product detail pages if no listing items were found
     if not products:
         try:
             # Use the new flexible extraction function
-            product_details = extract_product_details(soup, base_url)
+            product_details = extract_product_details(soup, base_url, html)
             
             if product_details.get('title'):
                 product_document = {
@@ -678,28 +883,25 @@ def parse_and_save_products(html, base_url, scraped_products, session=None):
                 }
 
                 if save_product_record(product_document):
-                    print(colored(f"Product saved: {product_details.get('title')}", "green"))
+                    log.info("Product saved: %s", product_details.get('title'), extra={'event': 'saved', 'url': base_url})
                 else:
-                    print(colored(f"Product already stored for URL: {base_url}", "yellow"))
+                    log.info("Product already stored for URL: %s", base_url, extra={'event': 'duplicate', 'url': base_url})
 
-                ensure_product_html(base_url, market_name, base_url, fallback_html=html)
+                ensure_product_html(session, base_url, market_name, base_url, fallback_html=html)
         except Exception as e:
-            print(colored(f"Error parsing standalone product detail: {e}", "red"))
+            log.error("Error parsing standalone product detail: %s", e, extra={'event': 'parse_error', 'url': base_url})
 
     # --- Pagination Logic (remains the same) ---
     pagination_selectors = [
         'div.pagination a', 'ul.pagination a', 'a[rel="next"]', 'a.next',
         'li.next a', 'nav a', 'a[aria-label="Next"]'
     ]
-    next_pages = []
-    for sel in pagination_selectors:
-        links = soup.select(sel)
-        for link in links:
-            href = link.get('href')
-            if href:
-                next_pages.append(urllib.parse.urljoin(base_url, href))
-        if next_pages:
-            break
+    def pagination_hrefs(sel):
+        return [urllib.parse.urljoin(base_url, link.get('href')) for link in soup.select(sel) if link.get('href')]
+
+    _, next_pages = extraction_profiles.first(market_name, 'listing.pagination', pagination_selectors,
+                                              pagination_hrefs)
+    next_pages = next_pages or []
 
     if not next_pages:
         for a in soup.find_all('a', href=True):
@@ -707,10 +909,67 @@ def parse_and_save_products(html, base_url, scraped_products, session=None):
             if re.search(r'(/page/|\?page=|page=\d+)', href):
                 next_pages.append(urllib.parse.urljoin(base_url, href))
 
-    next_pages = list(dict.fromkeys(next_pages))
-    print(colored(f"Found pagination links: {next_pages}", "blue"))
+    next_pages = list(dict.fromkeys(mirrors.canonical(page) for page in next_pages))
+    log.info("Found pagination links: %s", next_pages, extra={'event': 'pagination', 'url': base_url})
     return next_pages
 
+def crawl_store_api(session, base_url, category_urls=None, workers=1):
+    """
+    --store-api: store the market's listings from its WooCommerce Store API (fields as JSON, no pages at all)
+    or its product sitemap (detail pages only, no category pages). Returns the category URLs that still need
+    the HTML crawl (an empty list once the whole market was listed), or None when the market offers neither
+    or the backend listed nothing.
+    """
+    source = store_api.discover(session, base_url)
+    if source is None:
+        return None
+    if category_urls:
+        unlisted = source.unlisted(session, category_urls)
+        if len(unlisted) == len(category_urls):
+            print(colored("   No listed category matches the backend; crawling the category pages", "yellow"))
+            return None
+        category_urls = [url for url in category_urls if url not in unlisted]
+    else:
+        unlisted = []
+
+    open_product_html_writer()
+    market_name = urllib.parse.urlparse(base_url).netloc
+    sitemap_urls = []
+    served = set()
+    try:
+        for category_page, listing_url, details in source.listings(session, category_urls):
+            if product_budget.exhausted:
+                break
+            served.add(category_page)
+            listing_url = mirrors.canonical(listing_url)
+            if details is None:
+                sitemap_urls.append((listing_url, category_page))
+                continue
+            details['source'] = 'store_api'
+            title, price = details.get('title'), details.get('price', 'N/A')
+            if save_product_record({"market": market_name, "category page": category_page,
+                                    "listing url": listing_url, "title": title, "price": price}):
+                log.info("Product saved: %s", title, extra={'event': 'saved', 'url': listing_url})
+            ensure_product_html(session, listing_url, market_name, category_page, card_text=listing_text(title, price),
+                                details=details)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        # What was stored stays claimed, so the HTML crawl only adds what the backend did not list
+        print(colored(f"Store backend failed for {market_name} ({e}); crawling the category pages", "yellow"))
+        return None
+
+    if not served and not product_budget.exhausted:
+        print(colored(f"   The store backend of {market_name} listed no products; crawling the category pages",
+                      "yellow"))
+        return None
+    # Categories the backend had no products for are crawled as well
+    unlisted += [url for url in category_urls or [] if url not in served]
+
+    if sitemap_urls:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            list(pool.map(lambda job: ensure_product_html(session, job[0], market_name, job[1]), sitemap_urls))
+    return unlisted
+
+
 def scrape_product_page(html):
     """
     Scrapes the content of a single product page.
@@ -729,45 +988,49 @@ def scrape_product_page(html):
         return ""
 
 # Scrape a page and retrieve product data
-def scrape_page(session, url, scraped_pages, allowed_paths=None, retries=3, selenium_driver=None):
-    attempt = 0
-    while attempt < retries:
-        try:
-            response = session.get(url, timeout=20)
-            if response.status_code == 200:
-                if save_pages:
-                    try:
-                        pages = load_saved_pages()
-                        pages.append({'url': url, 'timestamp': int(time.time()), 'html': response.text})
-                        save_pages_atomic(pages)
-                    except Exception as e:
-                        print(colored(f"Failed saving fetched page to pages JSON: {e}", "red"))
+def scrape_page(session, url, scraped_pages, allowed_paths=None, retries=None, selenium_driver=None):
+    try:
+        response = fetch_with_retry(session, url, max_attempts=retries, timeout=20, page_type='category')
+        if response.status_code == 200:
+            archive_page(url, response=response)
+            html = http_fetch.page_text(response)
 
-                next_pages = parse_and_save_products(response.text, url, scraped_pages, session=session)
-                if allowed_paths:
-                    next_pages = [link for link in next_pages if canonicalize_path(link) in allowed_paths]
-                scraped_pages[url] = True
-                return next_pages
-            else:
-                print(colored(f"Failed to scrape {url}, status code: {response.status_code}", "red"))
-        except requests.exceptions.RequestException as e:
-            attempt += 1
-            print(colored(f"Connection error on {url}, retry {attempt}/{retries}: {e}", "red"))
-            time.sleep(5)
+            if search_index_conn is not None:
+                try:
+                    with store_lock:
+                        index_page(search_index_conn, url, html=html, kind='category')
+                except Exception as e:
+                    log.error("Failed indexing page text: %s", e, extra={'event': 'index_error', 'url': url})
+
+            next_pages = parse_and_save_products(html, url, scraped_pages, session=session)
+            if allowed_paths:
+                next_pages = [link for link in next_pages if canonicalize_path(link) in allowed_paths]
+            scraped_pages[url] = True
+            return next_pages
+        log.error("Failed to scrape %s, status code: %s", url, response.status_code,
+                  extra={'event': 'http_status', 'url': url, 'status': response.status_code})
+    except FetchAborted as e:
+        log.warning("Skipped %s: %s", url, e.reason, extra={'event': 'skipped', 'url': url})
+        return []
+    except requests.exceptions.RequestException as e:
+        log.error("Giving up on %s: %s", url, e, extra={'event': 'fetch_error', 'url': url})
 
     if selenium_driver:
         try:
-            print(colored(f"Requests failed for {url}; attempting Selenium fallback...", "yellow"))
-            selenium_driver.get(url)
-            time.sleep(2)
-            html = selenium_driver.page_source
-            if save_pages:
+            log.warning("Requests failed for %s; attempting Selenium fallback...", url,
+                        extra={'event': 'selenium_fallback', 'url': url})
+            with fallback_lock:
+                selenium_driver.get(url)
+                time.sleep(2)
+                html = selenium_driver.page_source
+            archive_page(url, html=html)
+
+            if search_index_conn is not None:
                 try:
-                    pages = load_saved_pages()
-                    pages.append({'url': url, 'timestamp': int(time.time()), 'html': html})
-                    save_pages_atomic(pages)
+                    with store_lock:
+                        index_page(search_index_conn, url, html=html, kind='category')
                 except Exception as e:
-                    print(colored(f"Failed saving selenium-fetched page to pages JSON: {e}", "red"))
+                    log.error("Failed indexing page text: %s", e, extra={'event': 'index_error', 'url': url})
 
             next_pages = parse_and_save_products(html, url, scraped_pages, session=session)
             if allowed_paths:
@@ -775,58 +1038,17 @@ def scrape_page(session, url, scraped_pages, allowed_paths=None, retries=3, sele
             scraped_pages[url] = True
             return next_pages
         except Exception as se:
-            print(colored(f"Selenium fallback also failed for {url}: {se}", "red"))
+            log.error("Selenium fallback also failed for %s: %s", url, se, extra={'event': 'fetch_error', 'url': url})
 
     return []
 
-# Main function
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--manual', action='store_true', help='Open browser and wait for manual CAPTCHA solving before continuing')
-    parser.add_argument('--socks', action='store_true', help='Use Tor SOCKS5 (default uses HTTP proxy on 8118)')
-    parser.add_argument('--socks-port', type=int, default=tor_socks_port, help='Tor SOCKS port (default 9050)')
-    parser.add_argument('--page-timeout', type=int, default=300, help='Selenium page load timeout in seconds')
-    parser.add_argument('--tor-binary', type=str, default=None, help='Path to Tor Browser firefox binary (e.g. /Applications/Tor Browser.app/Contents/MacOS/firefox)')
-    parser.add_argument('--tor-profile', type=str, default=None, help='Path to Tor Browser profile directory to reuse')
-    parser.add_argument('--disable-js', action='store_true', help='Disable JavaScript in the browser (use page HTML only)')
-    parser.add_argument('--save-pages', action='store_true', help='Save full page HTML and metadata to a JSON file')
-    parser.add_argument('--selenium-fallback', action='store_true', help='When requests fail, fetch pages with Selenium as a fallback')
-    parser.add_argument('--search-keywords', nargs='+', help='Crawl the site to find pages containing these keywords and save their URLs to pages_url.json.')
-    parser.add_argument('--category-endpoints', nargs='+', help='Restrict scraping to these exact endpoints (e.g. /sex-aids /buy-steroids).')
-    args = parser.parse_args()
-
-    # Track scraped pages to avoid reprocessing
-    scraped_pages = {}
-    global save_pages
-    save_pages = args.save_pages
-
-    using_endpoints = bool(args.category_endpoints)
-    base_parts = urllib.parse.urlparse(start_url)
-    base_url = f"{base_parts.scheme}://{base_parts.netloc}"
-    allowed_paths = set()
-    target_urls = []
-    if using_endpoints:
-        for endpoint in args.category_endpoints:
-            canonical = canonicalize_path(endpoint)
-            if canonical in allowed_paths:
-                continue
-            allowed_paths.add(canonical)
-            full_url = urllib.parse.urljoin(base_url.rstrip('/') + '/', canonical.lstrip('/'))
-            if endpoint and endpoint.endswith('/') and not full_url.endswith('/'):
-                full_url = full_url.rstrip('/') + '/'
-            target_urls.append(full_url)
-        if not target_urls:
-            print(colored("No valid category endpoints resolved; defaulting to checkpoint-driven crawl.", "yellow"))
-            using_endpoints = False
-            allowed_paths.clear()
-
-    initial_browser_url = target_urls[0] if target_urls else start_url
-    if using_endpoints:
-        print(colored(f"Restricting crawl to endpoints: {', '.join(sorted(allowed_paths))}", "cyan"))
-        print(colored(f"Target category URLs: {', '.join(target_urls)}", "cyan"))
-        if target_urls:
-            save_keyword_urls_atomic(list(dict.fromkeys(target_urls)))
-
+def start_browser_session(args, initial_browser_url):
+    """
+    Open the first page in Firefox through the proxy (solving CAPTCHAs with
+    --manual) and build the requests session from its cookies.
+    Returns (driver, session, initial_page_html); session is None if it could not be set up.
+    """
+    driver = None
     try:
         # Initialize Firefox Options and proxy settings
         options = Options()
@@ -920,19 +1142,10 @@ def main():
                 except Exception as e:
                     print(colored(f"Failed to write page dump to file: {e}", "red"))
 
-                # Optionally save full page HTML+metadata to pages JSON
-                if save_pages:
-                    try:
-                        pages = load_saved_pages()
-                        pages.append({
-                            'url': initial_browser_url,
-                            'timestamp': int(time.time()),
-                            'html': page_html
-                        })
-                        save_pages_atomic(pages)
-                        print(colored(f"Saved full page HTML to {pages_output_file}", "green"))
-                    except Exception as e:
-                        print(colored(f"Failed saving page to pages JSON: {e}", "red"))
+                # Optionally archive the full page HTML
+                if page_archive is not None:
+                    archive_page(initial_browser_url, html=page_html)
+                    print(colored(f"Archived full page HTML in {pages_warc_dir}/", "green"))
 
         # Extract cookies but don't quit the browser yet (we will close in finally)
         cookies = extract_cookies(driver, do_quit=False)
@@ -943,7 +1156,7 @@ def main():
                 import socks
             except Exception:
                 print(colored("pysocks not installed. Install with: pip install pysocks requests[socks]", "red"))
-                return
+                return driver, None, None
             session = requests.Session()
             session.proxies = {
                 'http': f'socks5h://{proxy_host}:{args.socks_port}',
@@ -952,10 +1165,156 @@ def main():
             session.cookies.update(cookies)
         else:
             session = setup_requests_session(cookies)
+        return driver, session, initial_page_html
+    except Exception:
+        if driver:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        raise
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--manual', action='store_true', help='Open browser and wait for manual CAPTCHA solving before continuing')
+    parser.add_argument('--socks', action='store_true', help='Use Tor SOCKS5 (default uses HTTP proxy on 8118)')
+    parser.add_argument('--socks-port', type=int, default=tor_socks_port, help='Tor SOCKS port (default 9050)')
+    parser.add_argument('--page-timeout', type=int, default=300, help='Selenium page load timeout in seconds')
+    parser.add_argument('--tor-binary', type=str, default=None, help='Path to Tor Browser firefox binary (e.g. /Applications/Tor Browser.app/Contents/MacOS/firefox)')
+    parser.add_argument('--tor-profile', type=str, default=None, help='Path to Tor Browser profile directory to reuse')
+    parser.add_argument('--disable-js', action='store_true', help='Disable JavaScript in the browser (use page HTML only)')
+    parser.add_argument('--save-pages', action='store_true', help=f'Archive full pages (headers + HTML) as WARC files with a CDX index in {pages_warc_dir}/')
+    parser.add_argument('--warc-max-size', type=int, default=MAX_WARC_BYTES // (1024 * 1024), help='With --save-pages: start a new WARC file after this many MB')
+    parser.add_argument('--selenium-fallback', action='store_true', help='When requests fail, fetch pages with Selenium as a fallback')
+    parser.add_argument('--workers', type=int, default=3, help='Pages scraped concurrently; categories take turns so a large one cannot starve the others')
+    parser.add_argument('--max-products', type=int, default=None, help='Stop after fetching this many listing detail pages in total (default: unlimited)')
+    parser.add_argument('--pipeline', action='store_true', help='Fetch, parse and store listing detail pages in separate stages (fetch threads, parse processes, one writer) instead of one after the other in the page worker')
+    parser.add_argument('--fetch-workers', type=int, default=4, help='With --pipeline: concurrent listing detail fetches')
+    parser.add_argument('--parse-processes', type=int, default=2, help='With --pipeline: processes running extract_product_details (0 = parse in the fetch threads)')
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE, help='With --pipeline: bound of each stage queue; page workers wait when it is full')
+    parser.add_argument('--history', action='store_true', help=f'Refetch listings stored by earlier crawls and keep their price/stock changes in {HISTORY_FILE} (new listings are stored in full as usual)')
+    parser.add_argument('--images', action='store_true', help=f'Download listing images into the content-addressed store in {IMAGES_DIR}/ (thumbnails and perceptual hashes need Pillow)')
+    parser.add_argument('--image-workers', type=int, default=2, help='With --images: concurrent image downloads, separate from --workers')
+    parser.add_argument('--record', type=str, default=None, metavar='DIR', help='Record every fetch (status, headers, body, latency) into a replay bundle')
+    parser.add_argument('--replay', type=str, default=None, metavar='DIR', help='Crawl from a replay bundle instead of the network (no browser, no politeness delays)')
+    parser.add_argument('--replay-latency', action='store_true', help='With --replay: wait the recorded latency of each fetch instead of answering at once')
+    parser.add_argument('--adaptive-timeouts', action='store_true', help=f'Set each host\'s timeouts from its observed latency per page type (kept in {adaptive_timeouts.TIMEOUTS_FILE})')
+    parser.add_argument('--hedge', action='store_true', help='With --adaptive-timeouts: send a duplicate request when a fetch is slower than 95%% of its host\'s, use the first answer')
+    parser.add_argument('--mirrors', type=str, nargs='?', const=mirrors.MIRRORS_FILE, default=None, metavar='FILE', help=f'Send each market\'s fetches to its fastest healthy mirror from the mirror sets in FILE (default: {mirrors.MIRRORS_FILE}); records keep the canonical address')
+    parser.add_argument('--probe-interval', type=float, default=mirrors.PROBE_INTERVAL, help='With --mirrors: seconds between mirror probes')
+    parser.add_argument('--tor-control', action='store_true', help='Send NEWNYM through the Tor control port when a market\'s circuit turns slow or fails, then re-warm the session')
+    parser.add_argument('--tor-control-port', type=int, default=tor_control.CONTROL_PORT, help='Tor control port (default 9051)')
+    parser.add_argument('--tor-password', type=str, default=None, help='Control port password (default: $TOR_CONTROL_PASSWORD, else cookie or no authentication)')
+    parser.add_argument('--tor-cookie', type=str, default=None, help='Control port auth cookie file (CookieAuthentication 1)')
+    parser.add_argument('--renew-latency', type=float, default=tor_control.LATENCY_THRESHOLD, help='With --tor-control: renew when a market\'s median fetch time exceeds this many seconds')
+    parser.add_argument('--renew-error-rate', type=float, default=tor_control.MAX_ERROR_RATE, help='With --tor-control: renew when more than this share of a market\'s recent fetches fail')
+    parser.add_argument('--no-challenge-check', action='store_true', help='Do not check fetched pages for CAPTCHA, DDoS-guard and login pages (by default the host is paused and its cookies refreshed in the browser)')
+    parser.add_argument('--challenge-config', type=str, default=challenge_guard.CHALLENGES_FILE, help=f'Extra challenge signatures and product markers, global or per host (default: {challenge_guard.CHALLENGES_FILE})')
+    parser.add_argument('--store-api', action='store_true', help=f'List products through the market\'s WooCommerce Store API (JSON, no HTML pages) or product sitemap (detail pages only) when it offers one; otherwise crawl the HTML pages as usual (probe results kept in {store_api.STORE_API_FILE})')
+    parser.add_argument('--log-level', type=str, default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='Lowest level of per-page and per-listing messages to show (default: INFO)')
+    parser.add_argument('--log-file', type=str, default=None, metavar='FILE', help='Also write every log record as a JSON line to FILE')
+    parser.add_argument('--progress', action='store_true', help='Show a live progress line (pages/s, error rate, listings, ETA) instead of lines per page and listing; warnings and errors are still printed')
+    parser.add_argument('--search-keywords', nargs='+', help='Crawl the site to find pages containing these keywords and save their URLs to pages_url.json.')
+    parser.add_argument('--category-endpoints', nargs='+', help='Restrict scraping to these exact endpoints (e.g. /sex-aids /buy-steroids).')
+    parser.add_argument('--max-page-bytes', type=int, default=http_fetch.MAX_PAGE_BYTES, help='Abort pages larger than this many bytes')
+    parser.add_argument('--total-timeout', type=int, default=http_fetch.TOTAL_TIMEOUT, help='Abort page downloads taking longer than this many seconds in total')
+    parser.add_argument('--max-retries', type=int, default=retry_policy.MAX_ATTEMPTS, help='Attempts per page for connection errors, timeouts, 429 and 5xx responses (at least 1)')
+    parser.add_argument('--breaker-threshold', type=int, default=retry_policy.BREAKER_THRESHOLD, help='Consecutive failures before a host is paused (circuit breaker)')
+    parser.add_argument('--breaker-cooldown', type=float, default=retry_policy.BREAKER_COOLDOWN, help='Seconds a paused host is skipped before a probe request')
+    parser.add_argument('--search-index', action='store_true', help='Feed fetched pages into the local full-text index (search_index.db)')
+    parser.add_argument('--no-profiles', action='store_true', help=f'Use the default selector chains on every market instead of the learned per-market profiles ({PROFILES_FILE})')
+    parser.add_argument('--near-duplicates', action='store_true', help='Tag stored listings with a near-duplicate cluster_id (MinHash/LSH index)')
+    parser.add_argument('--skip-near-duplicates', action='store_true', help='Skip the detail fetch for listing cards that are near-certain duplicates of one already fetched (implies --near-duplicates)')
+    args = parser.parse_args()
+
+    # Track scraped pages to avoid reprocessing
+    scraped_pages = {}
+    global page_archive, near_duplicate_index, near_duplicate_cards, skip_near_duplicates, search_index_conn
+    global extraction_profiles, product_budget, image_pipeline, product_history, detail_pipeline
+    product_budget = Budget(args.max_products)
+    if args.history:
+        product_history = HistoryStore(HISTORY_FILE)
+    if not args.no_profiles:
+        extraction_profiles = ProfileStore(PROFILES_FILE)
+    if args.save_pages:
+        page_archive = WarcWriter(pages_warc_dir, max_bytes=args.warc_max_size * 1024 * 1024)
+    crawl_log.setup(args.log_level, args.log_file, show_progress=args.progress, limit=args.max_products)
+    http_fetch.configure(max_bytes=args.max_page_bytes, total_timeout=args.total_timeout)
+    retry_policy.configure(max_attempts=args.max_retries, breaker_threshold=args.breaker_threshold,
+                           breaker_cooldown=args.breaker_cooldown)
+    fetch_replay.start(record=args.record, replay=args.replay, latency=args.replay_latency)
+    if args.adaptive_timeouts or args.hedge:
+        adaptive_timeouts.start(hedge=args.hedge)
+    if args.search_index:
+        search_index_conn = open_search_index()
+    skip_near_duplicates = args.skip_near_duplicates
+    if args.near_duplicates or args.skip_near_duplicates:
+        near_duplicate_index = load_near_duplicate_index(near_duplicates_file)
+        near_duplicate_cards = load_near_duplicate_index(near_duplicate_cards_file)
+        print(colored(f"Near-duplicate index loaded ({len(near_duplicate_index)} listings)", "cyan"))
+
+    using_endpoints = bool(args.category_endpoints)
+    base_parts = urllib.parse.urlparse(start_url)
+    base_url = f"{base_parts.scheme}://{base_parts.netloc}"
+    allowed_paths = set()
+    target_urls = []
+    if using_endpoints:
+        for endpoint in args.category_endpoints:
+            canonical = canonicalize_path(endpoint)
+            if canonical in allowed_paths:
+                continue
+            allowed_paths.add(canonical)
+            full_url = urllib.parse.urljoin(base_url.rstrip('/') + '/', canonical.lstrip('/'))
+            if endpoint and endpoint.endswith('/') and not full_url.endswith('/'):
+                full_url = full_url.rstrip('/') + '/'
+            target_urls.append(full_url)
+        if not target_urls:
+            print(colored("No valid category endpoints resolved; defaulting to checkpoint-driven crawl.", "yellow"))
+            using_endpoints = False
+            allowed_paths.clear()
+
+    initial_browser_url = target_urls[0] if target_urls else start_url
+    if using_endpoints:
+        print(colored(f"Restricting crawl to endpoints: {', '.join(sorted(allowed_paths))}", "cyan"))
+        print(colored(f"Target category URLs: {', '.join(target_urls)}", "cyan"))
+        if target_urls:
+            save_keyword_urls_atomic(list(dict.fromkeys(target_urls)))
+
+    try:
+        if fetch_replay.replaying():
+            driver, initial_page_html = None, None
+            session = setup_requests_session({})
+            if not args.no_challenge_check:
+                challenge_guard.start(config_path=args.challenge_config)
+        else:
+            driver, session, initial_page_html = start_browser_session(args, initial_browser_url)
+            if session is None:
+                return
+            if not args.no_challenge_check:
+                # The session's browser stays open until the run ends and renews its cookies
+                challenge_guard.start(challenge_guard.browser_refresher(driver, manual=args.manual),
+                                      args.challenge_config)
+            if args.tor_control:
+                tor_control.start(session, port=args.tor_control_port, password=args.tor_password,
+                                  cookie_file=args.tor_cookie, latency_threshold=args.renew_latency,
+                                  max_error_rate=args.renew_error_rate)
+
+        if args.mirrors:
+            mirrors.start(session, args.mirrors, interval=args.probe_interval)
+        if args.images:
+            image_pipeline = ImagePipeline(session, IMAGES_DIR, workers=args.image_workers)
+        if args.pipeline:
+            open_product_html_writer()
+            detail_pipeline = Pipeline(_pipeline_fetch, _pipeline_parse, _pipeline_write,
+                                       fetch_workers=args.fetch_workers, parse_workers=args.parse_processes,
+                                       queue_size=args.queue_size, parse_initializer=_init_parse_process,
+                                       parse_initargs=(None if args.no_profiles else PROFILES_FILE,),
+                                       name='Detail pipeline')
 
         # Optionally create a Selenium fallback driver to render pages that requests cannot fetch
         fallback_driver = None
-        if args.selenium_fallback:
+        if args.selenium_fallback and not fetch_replay.replaying():
             try:
                 # reuse options used earlier for main driver settings
                 fb_options = Options()
@@ -993,39 +1352,114 @@ def main():
                         print(colored(f"Enqueued {len(initial_next_pages)} pages discovered during manual setup.", "green"))
                 except Exception as exc:
                     print(colored(f"Failed to parse initial manual page: {exc}", "red"))
-        scraped = set()
+        if args.store_api:
+            unlisted = crawl_store_api(session, base_url, target_urls if using_endpoints else None,
+                                       workers=args.workers)
+            if unlisted is not None:
+                # The checkpoint is kept for runs without the backend
+                to_scrape = unlisted
         # Load already saved products and initialize saved_urls set to prevent duplicates
         existing_products = load_saved_products()
         saved_urls = {p.get('listing url') for p in existing_products if p.get('listing url')}
         scrape_page.saved_urls = saved_urls
 
-        while to_scrape:
-            url = to_scrape.pop(0)
-            if url not in scraped:
-                print(colored(f"Scraping page: {url}", "magenta"))
-                allowed = allowed_paths if using_endpoints else None
-                new_links = scrape_page(session, url, scraped_pages, allowed_paths=allowed, selenium_driver=fallback_driver)
-
-                # Avoid duplicates in to_scrape
-                to_scrape.extend(link for link in new_links if link not in scraped and link not in to_scrape)
-                scraped.add(url)
-
-                if using_endpoints and new_links:
-                    added = 0
-                    for link in new_links:
-                        if link not in target_urls:
-                            target_urls.append(link)
-                            added += 1
-                    if added:
-                        save_keyword_urls_atomic(list(dict.fromkeys(target_urls)))
-
-                if not using_endpoints:
-                    save_checkpoint(to_scrape)
-                time.sleep(random.uniform(5, 15))
+        # Every category (start URL and the pages found from it) gets its own queue;
+        # the workers take the next page from each category in turn
+        allowed = allowed_paths if using_endpoints else None
+        pool = ThreadPoolExecutor(max_workers=args.workers)
+        scheduler = FairScheduler(pool, args.workers)
+        seen_pages = DedupeIndex()
+
+        def crawl_page(url):
+            log.info("Scraping page: %s", url, extra={'event': 'page', 'url': url})
+            try:
+                return scrape_page(session, url, scraped_pages, allowed_paths=allowed, selenium_driver=fallback_driver)
+            finally:
+                fetch_replay.pause(random.uniform(5, 15))
+
+        def push_page(category, url):
+            if seen_pages.claim(url):
+                scheduler.push(category, url, crawl_page, url)
+
+        for url in dict.fromkeys(to_scrape):
+            push_page(category_of(url), url)
+
+        stopping = False
+
+        for category, url, new_links, error in scheduler.run():
+            if error is not None:
+                log.error("Error scraping %s: %s", url, error, extra={'event': 'page_error', 'url': url})
+                new_links = []
+            new_links = new_links or []
+
+            if not stopping:
+                for link in new_links:
+                    push_page(category, link)
+
+            if using_endpoints and new_links:
+                added = 0
+                for link in new_links:
+                    if link not in target_urls:
+                        target_urls.append(link)
+                        added += 1
+                if added:
+                    save_keyword_urls_atomic(list(dict.fromkeys(target_urls)))
+
+            if not using_endpoints and not stopping:
+                save_checkpoint([page for _, page in scheduler.queued()])
+
+            if not stopping and product_budget.exhausted:
+                # The checkpoint keeps the remaining pages for the next run
+                print(colored(f"Reached max products limit ({args.max_products}); finishing pages in progress.", "yellow"))
+                stopping = True
+                scheduler.clear()
 
     except Exception as e:
         print(colored(f"Error in main scraping function: {e}", "red"))
     finally:
+        if 'pool' in locals() and pool:
+            # Pages still being parsed may queue listings; they must be in before the pipeline closes
+            pool.shutdown(wait=True, cancel_futures=True)
+        pipeline = None
+        if detail_pipeline is not None:
+            pipeline, detail_pipeline = detail_pipeline, None
+            print(colored("Waiting for queued listing pages...", "cyan"))
+            pipeline.close(wait=sys.exc_info()[0] is None)
+        # Queued log records and the final progress line come before the run summary
+        crawl_log.stop()
+        if pipeline is not None:
+            pipeline.print_stats()
+        if near_duplicate_index is not None:
+            try:
+                save_near_duplicate_index(near_duplicate_index, near_duplicates_file)
+                save_near_duplicate_index(near_duplicate_cards, near_duplicate_cards_file)
+            except Exception as e:
+                print(colored(f"Failed saving near-duplicate index: {e}", "red"))
+        if image_pipeline is not None:
+            print(colored("Waiting for queued image downloads...", "cyan"))
+            image_pipeline.close()
+        close_product_html_writer()
+        if product_history is not None:
+            product_history.print_stats()
+            product_history.close()
+        try:
+            extraction_profiles.save()
+        except Exception as e:
+            print(colored(f"Failed saving extraction profiles: {e}", "red"))
+        extraction_profiles.print_stats()
+        if page_archive is not None:
+            page_archive.close()
+            print(colored(f"Archived {page_archive.records} pages in {pages_warc_dir}/", "cyan"))
+        print_fetch_stats()
+        print_retry_stats()
+        print_image_stats()
+        store_api.print_store_api_stats()
+        structured_data.print_structured_data_stats()
+        challenge_guard.stop()
+        tor_control.stop()
+        mirrors.stop()
+        adaptive_timeouts.stop()
+        fetch_replay.stop()
         # ensure both drivers are quit if they were started
         try:
             if 'driver' in locals() and driver:
@@ -1044,27 +1478,49 @@ def main():
         except Exception:
             pass
 
+def offline_keyword_search(args):
+    """Answer a keyword search from the local full-text index (no network)."""
+    conn = open_search_index()
+    results = search_local_index(conn, args.search_keywords, market=args.market, limit=args.limit)
+    found_urls = list(dict.fromkeys(result['url'] for result in results))
+    for result in results:
+        print(colored(f"Found keyword on: {result['url']}", "green"))
+        print(f"    {result['snippet']}")
+    if found_urls:
+        save_keyword_urls_atomic(found_urls)
+    print(colored(f"Offline keyword search finished. Found {len(found_urls)} matching URLs.", "blue"))
+
+
 def keyword_search_mode(args, options):
     """Crawl the site to find pages matching keywords."""
+    if args.offline:
+        offline_keyword_search(args)
+        return
+
     print(colored(f"Starting keyword search for: {args.search_keywords}", "cyan"))
     
     driver = None
+    crawl_log.setup(args.log_level, args.log_file, show_progress=args.progress)
+    fetch_replay.start(record=args.record, replay=args.replay, latency=args.replay_latency)
     try:
-        driver = webdriver.Firefox(options=options)
-        driver.set_page_load_timeout(args.page_timeout)
-        print(colored(f"Opening start URL to establish session: {start_url}", "blue"))
-        try:
-            driver.get(start_url)
-        except TimeoutException:
-            driver.execute_script("window.stop();")
-            print(colored("Page load timed out, stopping load to proceed.", "yellow"))
+        if fetch_replay.replaying():
+            cookies = {}
+        else:
+            driver = webdriver.Firefox(options=options)
+            driver.set_page_load_timeout(args.page_timeout)
+            print(colored(f"Opening start URL to establish session: {start_url}", "blue"))
+            try:
+                driver.get(start_url)
+            except TimeoutException:
+                driver.execute_script("window.stop();")
+                print(colored("Page load timed out, stopping load to proceed.", "yellow"))
 
-        if args.manual:
-            print(colored("Manual mode: please solve any CAPTCHA. Press Enter here to continue.", "yellow"))
-            input()
+            if args.manual:
+                print(colored("Manual mode: please solve any CAPTCHA. Press Enter here to continue.", "yellow"))
+                input()
 
-        cookies = extract_cookies(driver, do_quit=True)
-        driver = None # Driver's job is done
+            cookies = extract_cookies(driver, do_quit=True)
+            driver = None # Driver's job is done
 
         session = requests.Session()
         if args.socks:
@@ -1073,6 +1529,12 @@ def keyword_search_mode(args, options):
             session.proxies = {'http': f'http://{proxy_host}:{proxy_port}', 'https': f'http://{proxy_host}:{proxy_port}'}
         session.cookies.update(cookies)
         session.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; rv:102.0) Gecko/20100101 Firefox/102.0'})
+        if args.tor_control and not fetch_replay.replaying():
+            tor_control.start(session, port=args.tor_control_port, password=args.tor_password,
+                              cookie_file=args.tor_cookie, latency_threshold=args.renew_latency,
+                              max_error_rate=args.renew_error_rate)
+
+        conn = open_search_index() if args.search_index else None
 
         to_visit = [start_url]
         visited = set()
@@ -1085,19 +1547,25 @@ def keyword_search_mode(args, options):
                 continue
             
             visited.add(url)
-            print(colored(f"Searching: {url}", "magenta"))
+            log.info("Searching: %s", url, extra={'event': 'page', 'url': url})
 
             try:
-                response = session.get(url, timeout=20)
+                response = fetch_with_retry(session, url, timeout=20)
                 if response.status_code != 200:
                     continue
 
-                html = response.text
+                html = http_fetch.page_text(response)
                 html_lower = html.lower()
+
+                if conn is not None:
+                    try:
+                        index_page(conn, url, html=html)
+                    except Exception as e:
+                        log.error("Failed indexing page text: %s", e, extra={'event': 'index_error', 'url': url})
                 
                 # Check for keywords
                 if any(keyword in html_lower for keyword in keywords_lower):
-                    print(colored(f"Found keyword on: {url}", "green"))
+                    log.info("Found keyword on: %s", url, extra={'event': 'found', 'url': url})
                     if url not in found_urls:
                         found_urls.append(url)
                         save_keyword_urls_atomic(found_urls)
@@ -1105,19 +1573,25 @@ def keyword_search_mode(args, options):
                 # Find and enqueue new links
                 soup = BeautifulSoup(html, 'html.parser')
                 for link in soup.find_all('a', href=True):
-                    new_url = urllib.parse.urljoin(url, link['href'])
+                    new_url = mirrors.canonical(urllib.parse.urljoin(url, link['href']))
                     # Basic filter to stay on the same site and avoid noise
                     if new_url.startswith(start_url.split('/')[0] + '//' + start_url.split('/')[2]) and new_url not in visited:
                         to_visit.append(new_url)
                 
-                time.sleep(random.uniform(1, 3))
+                fetch_replay.pause(random.uniform(1, 3))
 
             except requests.RequestException as e:
-                print(colored(f"Error visiting {url}: {e}", "red"))
+                log.error("Error visiting %s: %s", url, e, extra={'event': 'fetch_error', 'url': url})
         
+        crawl_log.stop()
         print(colored(f"Keyword search finished. Found {len(found_urls)} matching URLs.", "blue"))
+        print_fetch_stats()
+        print_retry_stats()
 
     finally:
+        crawl_log.stop()
+        tor_control.stop()
+        fetch_replay.stop()
         if driver:
             try:
                 driver.quit()
@@ -1140,6 +1614,22 @@ if __name__ == "__main__":
             parser.add_argument('--manual', action='store_true')
             parser.add_argument('--search-keywords', nargs='+')
             parser.add_argument('--category-endpoints', nargs='+')
+            parser.add_argument('--search-index', action='store_true')
+            parser.add_argument('--offline', action='store_true', help='Answer from the local search index instead of crawling')
+            parser.add_argument('--market', type=str, default=None, help='With --offline, only match pages from this market (netloc)')
+            parser.add_argument('--limit', type=int, default=500)
+            parser.add_argument('--record', type=str, default=None)
+            parser.add_argument('--replay', type=str, default=None)
+            parser.add_argument('--replay-latency', action='store_true')
+            parser.add_argument('--tor-control', action='store_true')
+            parser.add_argument('--tor-control-port', type=int, default=tor_control.CONTROL_PORT)
+            parser.add_argument('--tor-password', type=str, default=None)
+            parser.add_argument('--tor-cookie', type=str, default=None)
+            parser.add_argument('--renew-latency', type=float, default=tor_control.LATENCY_THRESHOLD)
+            parser.add_argument('--renew-error-rate', type=float, default=tor_control.MAX_ERROR_RATE)
+            parser.add_argument('--log-level', type=str, default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+            parser.add_argument('--log-file', type=str, default=None)
+            parser.add_argument('--progress', action='store_true')
             args, _ = parser.parse_known_args()
 
             options = Options()
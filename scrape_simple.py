@@ -6,11 +6,13 @@ This scraper:
 1. Reads category URLs from pages_url.json
 2. Extracts all product listing URLs from each category page
 3. Fetches the raw HTML for each product page
-4. Saves everything to products_html.json (overwrites each time)
+4. Streams each product to products_html.json as soon as it is fetched
+   (overwrites each time, or continues the file with --resume)
 
 General-purpose: Works with any marketplace HTML structure.
 """
 
+import html as html_lib
 import json
 import os
 import random
@@ -18,6 +20,7 @@ import time
 import re
 import urllib.parse
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from selenium import webdriver
 from selenium.webdriver.firefox.options import Options
@@ -25,6 +28,27 @@ from selenium.common.exceptions import TimeoutException
 from bs4 import BeautifulSoup
 from termcolor import colored
 
+import adaptive_timeouts
+from archive_index import ArchiveIndex
+from archive_io import JsonArrayWriter
+import challenge_guard
+import crawl_log
+from crawl_scheduler import Budget, DedupeIndex, FairScheduler, HostLimiter
+import fetch_replay
+import http_fetch
+import mirrors
+import store_api
+from http_fetch import FetchAborted, print_fetch_stats
+import retry_policy
+import tor_control
+from retry_policy import fetch_with_retry, print_retry_stats
+from extraction_profiles import PROFILES_FILE, ProfileStore
+from near_duplicates import load_index as load_near_duplicate_index, save_index as save_near_duplicate_index
+from near_duplicates import listing_text_from_html
+from search_index import index_page, open_index as open_search_index
+
+
+log = crawl_log.get_logger()
 
 # Configuration
 PROXY_HOST = "127.0.0.1"
@@ -34,6 +58,17 @@ TOR_SOCKS_PORT = 9050
 # Input/Output files
 PAGES_URL_FILE = "pages_url.json"
 PRODUCTS_HTML_FILE = "products_html.json"
+NEAR_DUPLICATES_FILE = "near_duplicates.pkl"
+
+# Per-market selector ordering (learning and persisted unless --no-profiles)
+extraction_profiles = ProfileStore(None, learn=False)
+
+# Returned by a product task that started after the --max-products budget ran out
+OVER_BUDGET = object()
+
+# Pagination URL patterns: /page/N/ (WordPress) and ?paged=N / ?page=N
+PAGE_PATH_RE = re.compile(r'/page/(\d+)/?$')
+PAGE_QUERY_KEYS = ('paged', 'page')
 
 
 def load_pages_urls():
@@ -54,16 +89,12 @@ def load_pages_urls():
         return []
 
 
-def save_products_html(products, overwrite=True):
-    """Save product HTML data to products_html.json"""
-    mode = 'w' if overwrite else 'a'
-    
-    try:
-        with open(PRODUCTS_HTML_FILE, mode, encoding='utf-8') as f:
-            json.dump(products, f, ensure_ascii=False, indent=2)
-        print(colored(f"✅ Saved {len(products)} products to {PRODUCTS_HTML_FILE}", "green"))
-    except Exception as e:
-        print(colored(f"❌ Error saving to {PRODUCTS_HTML_FILE}: {e}", "red"))
+def open_products_output(resume=False, index=None):
+    """Open products_html.json for streaming output, optionally continuing an earlier run"""
+    writer = JsonArrayWriter(PRODUCTS_HTML_FILE, resume=resume, index=index)
+    if resume and writer.count:
+        print(colored(f"✅ Resuming {PRODUCTS_HTML_FILE}: {writer.count} products already saved", "green"))
+    return writer
 
 
 def extract_cookies(driver, do_quit=False):
@@ -101,125 +132,432 @@ def setup_requests_session(cookies, use_socks=False, socks_port=9050):
     return session
 
 
-def extract_product_links(html, base_url):
+# WooCommerce selectors for product cards (most common on dark web markets)
+WOOCOMMERCE_SELECTORS = [
+    'li.product a.woocommerce-LoopProduct-link',
+    'li.product h2 a',
+    'li.product a[href]',
+    '.products li.product a',
+    'ul.products li a'
+]
+
+PAGINATION_SELECTORS = [
+    'a[rel="next"]', 'a.next', 'li.next a',
+    '.pagination a', 'ul.pagination a',
+    'nav a', 'a[aria-label="Next"]'
+]
+
+# Generic product link detection: one compiled pattern each instead of
+# lowercasing the URL once per indicator and once per excluded pattern
+PRODUCT_INDICATOR_RE = re.compile(r'/shop/|/item/|/listing/|/p/', re.IGNORECASE)
+EXCLUDED_LINK_RE = re.compile(
+    r'cart|checkout|account|login|/product-category/|/category/|/tag/|page/|/page-|author|search|filter',
+    re.IGNORECASE
+)
+CATEGORY_LINK_RE = re.compile(r'/product-category/|/category/')
+
+# Tokenizer for the fast path: skips comments, declarations and raw-text
+# elements, and yields start/end tags with their attribute string
+_TAG_TOKEN_RE = re.compile(
+    r'<!--.*?-->|<![^>]*>|<\?[^>]*>'
+    r'|<(script|style)\b(?:"[^"]*"|\'[^\']*\'|[^\'">])*>.*?</\1\s*>'
+    r'|<(/?)([a-zA-Z][^\s/>]*)((?:"[^"]*"|\'[^\']*\'|[^\'">])*)>',
+    re.DOTALL | re.IGNORECASE
+)
+_ATTR_RE = re.compile(r'([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+
+# Elements html.parser (and so BeautifulSoup) closes immediately
+_VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+    'meta', 'param', 'source', 'track', 'wbr', 'spacer', 'basefont', 'bgsound', 'command',
+    'frame', 'image', 'isindex', 'nextid',
+])
+
+
+def _parse_attrs(attr_text):
+    attrs = {}
+    for name, dq, sq, bare in _ATTR_RE.findall(attr_text):
+        value = dq or sq or bare
+        attrs[name.lower()] = html_lib.unescape(value) if '&' in value else value
+    return attrs
+
+
+def _scan_anchors(html):
     """
-    Extract product links from category page HTML.
-    Only extracts actual product pages, NOT category/navigation links.
+    Stream the page's tags without building a DOM and return the anchors as
+    (href, classes, rel, aria_label, context) in document order. context holds
+    the ancestor markers the selectors above care about.
+
+    Returns None when the li/ul nesting is irregular (implicitly closed,
+    unclosed or stray list tags): BeautifulSoup repairs such markup in ways
+    this scanner does not reproduce, so the caller falls back to the DOM.
     """
+    anchors = []
+    stack = []  # (tag, cumulative context)
+    context = frozenset()
+
+    for match in _TAG_TOKEN_RE.finditer(html):
+        is_end, tag = match.group(2), match.group(3)
+        if tag is None:
+            continue
+        tag = tag.lower()
+
+        if is_end:
+            for i in range(len(stack) - 1, -1, -1):
+                if stack[i][0] == tag:
+                    if any(t in ('li', 'ul') for t, _ in stack[i + 1:]):
+                        return None
+                    del stack[i:]
+                    break
+            else:
+                if tag in ('li', 'ul'):
+                    return None
+            context = stack[-1][1] if stack else frozenset()
+            continue
+
+        attrs = _parse_attrs(match.group(4)) if match.group(4) else {}
+        classes = attrs.get('class', '').split()
+
+        if tag == 'a':
+            anchors.append((attrs.get('href'), classes, ' '.join(attrs.get('rel', '').split()),
+                            attrs.get('aria-label'), context))
+
+        if tag in _VOID_ELEMENTS or match.group(4).rstrip().endswith('/'):
+            continue
+
+        markers = set()
+        if tag == 'li':
+            if 'product' in classes:
+                markers.add('li.product')
+            if 'ul.products' in context:
+                markers.add('ul.products li')
+            if 'next' in classes:
+                markers.add('li.next')
+        elif tag == 'ul' and 'products' in classes:
+            markers.add('ul.products')
+        elif tag == 'nav':
+            markers.add('nav')
+        if 'pagination' in classes:
+            markers.add('.pagination')
+
+        context = context | markers if markers else context
+        stack.append((tag, context))
+
+    if any(t in ('li', 'ul') for t, _ in stack):
+        return None
+    return anchors
+
+
+def _match_pagination_selector(selector, anchor):
+    _, classes, rel, aria_label, context = anchor
+    if selector == 'a[rel="next"]':
+        return rel == 'next'
+    if selector == 'a.next':
+        return 'next' in classes
+    if selector == 'li.next a':
+        return 'li.next' in context
+    if selector in ('.pagination a', 'ul.pagination a'):
+        # ul.pagination is a subset of .pagination, which is tried first
+        return '.pagination' in context
+    if selector == 'nav a':
+        return 'nav' in context
+    return aria_label == 'Next'
+
+
+def _extract_category_links_fast(anchors, base_url):
+    product_links = set()
+    for href, _, _, _, context in anchors:
+        if href and ('li.product' in context or 'ul.products li' in context):
+            full_url = urllib.parse.urljoin(base_url, href)
+            # Only add if it's NOT a category page
+            if not CATEGORY_LINK_RE.search(full_url):
+                product_links.add(full_url)
+
+    if not product_links:
+        # Strategy 2: generic product link detection (fallback)
+        for href, _, _, _, _ in anchors:
+            if href is None:
+                continue
+            full_url = urllib.parse.urljoin(base_url, href)
+            if PRODUCT_INDICATOR_RE.search(full_url) and not EXCLUDED_LINK_RE.search(full_url):
+                product_links.add(full_url)
+
+    def pagination_hrefs(selector):
+        return [urllib.parse.urljoin(base_url, anchor[0]) for anchor in anchors
+                if anchor[0] and _match_pagination_selector(selector, anchor)]
+
+    _, pagination_links = extraction_profiles.first(urllib.parse.urlparse(base_url).netloc, 'listing.pagination',
+                                                    PAGINATION_SELECTORS, pagination_hrefs)
+    return list(product_links), pagination_links or []
+
+
+def _extract_category_links_dom(html, base_url):
+    """BeautifulSoup path, used when the page structure needs a real DOM."""
     soup = BeautifulSoup(html, 'html.parser')
+    market = urllib.parse.urlparse(base_url).netloc
     product_links = set()
     
-    # Strategy 1: WooCommerce specific selectors (most common on dark web markets)
-    woocommerce_selectors = [
-        'li.product a.woocommerce-LoopProduct-link',
-        'li.product h2 a',
-        'li.product a[href]',
-        '.products li.product a',
-        'ul.products li a'
-    ]
-    
-    for selector in woocommerce_selectors:
-        links = soup.select(selector)
+    for _, links in extraction_profiles.collect(market, 'listing.product_links', WOOCOMMERCE_SELECTORS, soup.select):
         for link in links:
             href = link.get('href')
             if href:
                 full_url = urllib.parse.urljoin(base_url, href)
                 # Only add if it's NOT a category page
-                if '/product-category/' not in full_url and '/category/' not in full_url:
+                if not CATEGORY_LINK_RE.search(full_url):
                     product_links.add(full_url)
     
-    # If we found products via WooCommerce selectors, return them
-    if product_links:
-        return list(product_links)
-    
     # Strategy 2: Generic product link detection (fallback)
     # Look for links that have product-like patterns but exclude categories
-    all_links = soup.find_all('a', href=True)
-    for link in all_links:
-        href = link['href']
-        full_url = urllib.parse.urljoin(base_url, href)
-        
-        # Must match product indicators
-        product_indicators = ['/shop/', '/item/', '/listing/', '/p/']
-        
-        # Must NOT match excluded patterns  
-        excluded_patterns = [
-            'cart', 'checkout', 'account', 'login',
-            '/product-category/', '/category/', '/tag/',
-            'page/', '/page-', 'author', 'search', 'filter'
-        ]
-        
-        has_product_indicator = any(indicator in full_url.lower() for indicator in product_indicators)
-        has_excluded = any(pattern in full_url.lower() for pattern in excluded_patterns)
-        
-        if has_product_indicator and not has_excluded:
-            product_links.add(full_url)
-    
-    return list(product_links)
+    if not product_links:
+        for link in soup.find_all('a', href=True):
+            full_url = urllib.parse.urljoin(base_url, link['href'])
+            if PRODUCT_INDICATOR_RE.search(full_url) and not EXCLUDED_LINK_RE.search(full_url):
+                product_links.add(full_url)
     
-    return list(product_links)
+    def pagination_hrefs(selector):
+        return [urllib.parse.urljoin(base_url, link.get('href')) for link in soup.select(selector) if link.get('href')]
 
+    _, pagination_links = extraction_profiles.first(market, 'listing.pagination', PAGINATION_SELECTORS, pagination_hrefs)
+    return list(product_links), pagination_links or []
 
-def fetch_page_html(session, url, retries=3):
-    """Fetch HTML from a URL with retries"""
-    for attempt in range(retries):
-        try:
-            response = session.get(url, timeout=30)
-            if response.status_code == 200:
-                return response.text
-            else:
-                print(colored(f"⚠️  HTTP {response.status_code} for {url}", "yellow"))
-        except requests.exceptions.RequestException as e:
-            print(colored(f"❌ Error fetching {url} (attempt {attempt+1}/{retries}): {e}", "red"))
-            if attempt < retries - 1:
-                time.sleep(5)
-    
+
+def extract_category_links(html, base_url):
+    """
+    Extract (product_links, pagination_links) from category page HTML.
+    Only extracts actual product pages, NOT category/navigation links.
+    Uses a streaming tag scan and only builds a DOM for irregular markup.
+    """
+    anchors = _scan_anchors(html)
+    if anchors is None:
+        product_links, pagination_links = _extract_category_links_dom(html, base_url)
+    else:
+        product_links, pagination_links = _extract_category_links_fast(anchors, base_url)
+    return ([mirrors.canonical(url) for url in product_links],
+            list(dict.fromkeys(mirrors.canonical(url) for url in pagination_links)))
+
+
+def extract_product_links(html, base_url):
+    """
+    Extract product links from category page HTML.
+    Only extracts actual product pages, NOT category/navigation links.
+    """
+    return extract_category_links(html, base_url)[0]
+
+
+def fetch_page_html(session, url, retries=None, page_type=None):
+    """Fetch HTML from a URL under the shared retry policy"""
+    try:
+        response = fetch_with_retry(session, url, max_attempts=retries, timeout=30, page_type=page_type)
+    except FetchAborted as e:
+        log.warning("⏭️  Skipped %s: %s", url, e.reason, extra={'event': 'skipped', 'url': url})
+        return None
+    except requests.exceptions.RequestException as e:
+        log.error("❌ Error fetching %s: %s", url, e, extra={'event': 'fetch_error', 'url': url})
+        return None
+
+    if response.status_code == 200:
+        return http_fetch.page_text(response)
+    log.warning("⚠️  HTTP %s for %s", response.status_code, url,
+                extra={'event': 'http_status', 'url': url, 'status': response.status_code})
     return None
 
 
 def scrape_category_page(session, category_url):
     """Scrape a category page and return all product links"""
-    print(colored(f"\n📄 Scraping category: {category_url}", "cyan"))
+    log.info("📄 Scraping category: %s", category_url, extra={'event': 'category', 'url': category_url})
     
-    html = fetch_page_html(session, category_url)
+    html = fetch_page_html(session, category_url, page_type='category')
     if not html:
-        print(colored(f"❌ Failed to fetch category page", "red"))
-        return []
-    
-    product_links = extract_product_links(html, category_url)
-    print(colored(f"✅ Found {len(product_links)} product links", "green"))
-    
-    # Also check for pagination
-    soup = BeautifulSoup(html, 'html.parser')
-    pagination_links = []
+        log.error("❌ Failed to fetch category page %s", category_url,
+                  extra={'event': 'category_failed', 'url': category_url})
+        return [], []
     
-    pagination_selectors = [
-        'a[rel="next"]', 'a.next', 'li.next a',
-        '.pagination a', 'ul.pagination a',
-        'nav a', 'a[aria-label="Next"]'
-    ]
-    
-    for selector in pagination_selectors:
-        links = soup.select(selector)
-        for link in links:
-            href = link.get('href')
-            if href:
-                full_url = urllib.parse.urljoin(category_url, href)
-                pagination_links.append(full_url)
-        if pagination_links:
-            break
+    # Product and pagination links come from a single pass over the page
+    product_links, pagination_links = extract_category_links(html, category_url)
+    log.info("✅ Found %d product links", len(product_links),
+             extra={'event': 'found', 'url': category_url, 'count': len(product_links)})
     
     if pagination_links:
-        print(colored(f"📑 Found {len(pagination_links)} pagination links", "blue"))
+        log.info("📑 Found %d pagination links", len(pagination_links),
+                 extra={'event': 'pagination', 'url': category_url, 'count': len(pagination_links)})
     
     return product_links, pagination_links
 
 
+def split_page_number(url):
+    """
+    Split a paginated category URL into (base_url, page_number, style).
+    style is 'path' for /page/N/, the query key for ?paged=N, or None.
+    """
+    parsed = urllib.parse.urlparse(url)._replace(fragment='')
+    match = PAGE_PATH_RE.search(parsed.path)
+    if match:
+        base_path = parsed.path[:match.start()] + '/'
+        return urllib.parse.urlunparse(parsed._replace(path=base_path)), int(match.group(1)), 'path'
+
+    query = urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)
+    for key, value in query:
+        if key in PAGE_QUERY_KEYS and value.isdigit():
+            rest = urllib.parse.urlencode([(k, v) for k, v in query if k != key])
+            return urllib.parse.urlunparse(parsed._replace(query=rest)), int(value), key
+
+    return urllib.parse.urlunparse(parsed), 1, None
+
+
+def build_page_url(base_url, page_number, style):
+    """Inverse of split_page_number()."""
+    if page_number <= 1 or style is None:
+        return base_url
+    parsed = urllib.parse.urlparse(base_url)
+    if style == 'path':
+        path = parsed.path.rstrip('/') + f'/page/{page_number}/'
+        return urllib.parse.urlunparse(parsed._replace(path=path))
+    query = urllib.parse.parse_qsl(parsed.query, keep_blank_values=True) + [(style, str(page_number))]
+    return urllib.parse.urlunparse(parsed._replace(query=urllib.parse.urlencode(query)))
+
+
+def discover_category_pages(category_url, pagination_links, max_pages):
+    """
+    Return the category page URLs implied by a page's pagination links.
+    When page numbers are visible (1 2 3 ... 40) the whole range is generated,
+    so truncated pagination widgets still give full coverage. Links to other
+    categories or menus are ignored.
+    """
+    category_root = split_page_number(category_url)[0]
+    category_base = category_root.rstrip('/')
+    pages = {}
+    highest, highest_style = 1, None
+
+    for link in pagination_links:
+        base, number, style = split_page_number(link)
+        if base.rstrip('/') != category_base:
+            continue
+        if number <= max_pages:
+            pages[number] = link
+        if style and number > highest:
+            highest, highest_style = number, style
+
+    for number in range(2, min(highest, max_pages) + 1):
+        pages.setdefault(number, build_page_url(category_root, number, highest_style))
+
+    return [pages[number] for number in sorted(pages) if number > 1]
+
+
+def list_store_products(session, category_urls):
+    """
+    --store-api: {category URL: product URLs} from the Store API of the markets that offer it, so those
+    categories need no category or pagination pages. Other categories are left to the HTML crawl.
+    """
+    listed = {}
+    by_market = {}
+    for category_url in category_urls:
+        by_market.setdefault(urllib.parse.urlparse(category_url).netloc, []).append(category_url)
+    for market, urls in by_market.items():
+        source = store_api.discover(session, urls[0])
+        if source is None:
+            continue
+        if source.kind != 'api':
+            # A sitemap lists the whole shop, not one category
+            print(colored(f"   {market}: categories are crawled from their pages (only the Store API lists a "
+                          f"category)", "yellow"))
+            continue
+        served = [url for url in urls if url not in source.unlisted(session, urls)]
+        try:
+            found = {url: [] for url in served}
+            for category_url, product_url, _ in source.listings(session, served):
+                found[category_url].append(mirrors.canonical(product_url))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(colored(f"   {market}: Store API failed ({e}); crawling its category pages", "yellow"))
+            continue
+        # A category the API lists nothing for is crawled through its pages
+        found = {url: links for url, links in found.items() if links}
+        listed.update(found)
+        print(colored(f"   {market}: {sum(len(links) for links in found.values())} products in {len(found)} "
+                      f"categories from the Store API", "cyan"))
+    return listed
+
+
+def crawl_categories(session, category_urls, pool, workers, limiter, dedupe, budget,
+                     delay, max_pages, paginate=False, listed=None):
+    """
+    Fetch all categories (with paginate, all of their pages) and their
+    products concurrently.
+
+    Every category has its own work queue and the scheduler takes the next
+    fetch from each category in turn, so one huge category cannot starve the
+    others. Product URLs are claimed in the shared dedupe index (a product
+    listed in two categories is fetched once) and fetched only while the
+    shared --max-products budget lasts. Categories in listed (--store-api)
+    skip their category pages and go straight to the listed product URLs.
+    Yields product records (or None for failed fetches) as they complete.
+    """
+    scheduler = FairScheduler(pool, workers)
+    seen_pages = DedupeIndex()
+
+    def politely(fn, url, *fn_args):
+        with limiter.slot(url):
+            try:
+                return fn(session, url, *fn_args)
+            finally:
+                fetch_replay.pause(delay + random.uniform(0, 1))
+
+    def fetch_product(url, category_url, market_name):
+        # Budget is taken when the fetch starts, so queued work beyond it is never sent
+        if not budget.acquire():
+            return OVER_BUDGET
+        product = politely(scrape_product_page, url, category_url, market_name)
+        if product is None:
+            budget.release()
+        return product
+
+    def push_page(category_url, url):
+        if seen_pages.claim(url.rstrip('/')):
+            scheduler.push(category_url, ('page', url), politely, scrape_category_page, url)
+
+    def push_products(category_url, product_links):
+        market_name = urllib.parse.urlparse(category_url).netloc
+        for product_url in product_links:
+            if dedupe.claim(product_url):
+                crawl_log.add_total(1)
+                scheduler.push(category_url, ('product', product_url), fetch_product,
+                               product_url, category_url, market_name)
+
+    listed = listed or {}
+    for category_url in category_urls:
+        if category_url in listed:
+            push_products(category_url, listed[category_url])
+        else:
+            push_page(category_url, category_url)
+
+    for category_url, (kind, url), result, error in scheduler.run():
+        if error is not None:
+            log.error("❌ Error fetching %s: %s", url, error, extra={'event': 'fetch_error', 'url': url})
+            result = None if kind == 'product' else ([], [])
+
+        if kind == 'product':
+            if result is OVER_BUDGET:
+                continue
+            if result is None:
+                dedupe.release(url)
+            yield result
+            if budget.exhausted:
+                scheduler.clear()
+            continue
+
+        if budget.exhausted:
+            continue
+        product_links, pagination_links = result
+        if paginate:
+            for page_url in discover_category_pages(category_url, pagination_links, max_pages):
+                push_page(category_url, page_url)
+        push_products(category_url, product_links)
+
+
 def scrape_product_page(session, product_url, category_url, market_name):
     """Scrape a single product page and return HTML data"""
-    print(colored(f"  📦 Fetching: {product_url}", "blue"))
+    log.info("  📦 Fetching: %s", product_url, extra={'event': 'fetching', 'url': product_url})
     
-    html = fetch_page_html(session, product_url)
+    html = fetch_page_html(session, product_url, page_type='product')
     if not html:
         return None
     
@@ -232,36 +570,13 @@ def scrape_product_page(session, product_url, category_url, market_name):
     }
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Simple HTML scraper for dark web marketplaces')
-    parser.add_argument('--manual', action='store_true', 
-                       help='Open browser and wait for manual CAPTCHA solving')
-    parser.add_argument('--socks', action='store_true', 
-                       help='Use Tor SOCKS5 (default uses HTTP proxy on 8118)')
-    parser.add_argument('--socks-port', type=int, default=TOR_SOCKS_PORT,
-                       help='Tor SOCKS port (default: 9050)')
-    parser.add_argument('--page-timeout', type=int, default=300,
-                       help='Selenium page load timeout in seconds')
-    parser.add_argument('--tor-binary', type=str, default=None,
-                       help='Path to Tor Browser firefox binary')
-    parser.add_argument('--delay', type=float, default=2.0,
-                       help='Delay between requests in seconds (default: 2)')
-    parser.add_argument('--max-products', type=int, default=None,
-                       help='Maximum number of products to scrape (default: unlimited)')
-    
-    args = parser.parse_args()
-    
-    # Load category URLs
-    category_urls = load_pages_urls()
-    if not category_urls:
-        print(colored("\n❌ No URLs to scrape. Exiting.", "red"))
-        return
-    
-    print(colored(f"\n🚀 Starting scraper...", "cyan", attrs=['bold']))
-    print(colored(f"   Categories to scrape: {len(category_urls)}", "white"))
-    print(colored(f"   Delay between requests: {args.delay}s", "white"))
-    
-    # Initialize browser for CAPTCHA solving
+def establish_session(args, first_url):
+    """
+    Open the first category in Firefox through the proxy (solving CAPTCHAs
+    with --manual) and return (session, driver): a requests session carrying
+    its cookies, and the browser when --keep-browser keeps it for cookie
+    refreshes (else None).
+    """
     driver = None
     try:
         # Setup Firefox with proxy
@@ -287,7 +602,6 @@ def main():
         driver.set_page_load_timeout(args.page_timeout)
         
         # Open first category URL for session establishment
-        first_url = category_urls[0]
         print(colored(f"\n🌐 Opening: {first_url}", "blue"))
         
         try:
@@ -308,76 +622,213 @@ def main():
             input(colored("   Press Enter when ready to continue...", "yellow"))
         
         # Extract cookies
-        cookies = extract_cookies(driver, do_quit=True)
+        cookies = extract_cookies(driver, do_quit=not args.keep_browser)
+        kept_driver = driver if args.keep_browser else None
         driver = None
+    finally:
+        if driver:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+    
+    print(colored(f"✅ Session established, extracted {len(cookies)} cookies", "green"))
+    return setup_requests_session(cookies, args.socks, args.socks_port), kept_driver
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simple HTML scraper for dark web marketplaces')
+    parser.add_argument('--manual', action='store_true', 
+                       help='Open browser and wait for manual CAPTCHA solving')
+    parser.add_argument('--socks', action='store_true', 
+                       help='Use Tor SOCKS5 (default uses HTTP proxy on 8118)')
+    parser.add_argument('--socks-port', type=int, default=TOR_SOCKS_PORT,
+                       help='Tor SOCKS port (default: 9050)')
+    parser.add_argument('--page-timeout', type=int, default=300,
+                       help='Selenium page load timeout in seconds')
+    parser.add_argument('--tor-binary', type=str, default=None,
+                       help='Path to Tor Browser firefox binary')
+    parser.add_argument('--delay', type=float, default=2.0,
+                       help='Delay between requests in seconds (default: 2)')
+    parser.add_argument('--max-products', type=int, default=None,
+                       help='Maximum number of products to scrape (default: unlimited)')
+    parser.add_argument('--resume', action='store_true',
+                       help=f'Continue {PRODUCTS_HTML_FILE} from an earlier run, skipping products already saved')
+    parser.add_argument('--paginate', action='store_true',
+                       help='Follow category pagination (all pages of each category)')
+    parser.add_argument('--max-pages', type=int, default=100,
+                       help='With --paginate: highest page number to fetch per category (default: 100)')
+    parser.add_argument('--workers', type=int, default=4,
+                       help='Concurrent fetches in total, shared fairly by all categories (default: 4)')
+    parser.add_argument('--per-host', type=int, default=2,
+                       help='Concurrent fetches per host (default: 2)')
+    parser.add_argument('--max-page-bytes', type=int, default=http_fetch.MAX_PAGE_BYTES,
+                       help=f'Abort pages larger than this many bytes (default: {http_fetch.MAX_PAGE_BYTES})')
+    parser.add_argument('--total-timeout', type=int, default=http_fetch.TOTAL_TIMEOUT,
+                       help=f'Abort page downloads taking longer than this in total (default: {http_fetch.TOTAL_TIMEOUT}s)')
+    parser.add_argument('--max-retries', type=int, default=retry_policy.MAX_ATTEMPTS,
+                       help=f'Attempts per page for connection errors, timeouts, 429 and 5xx (at least 1, default: {retry_policy.MAX_ATTEMPTS})')
+    parser.add_argument('--breaker-threshold', type=int, default=retry_policy.BREAKER_THRESHOLD,
+                       help=f'Consecutive failures before a host is paused (default: {retry_policy.BREAKER_THRESHOLD})')
+    parser.add_argument('--breaker-cooldown', type=float, default=retry_policy.BREAKER_COOLDOWN,
+                       help=f'Seconds a paused host is skipped before a probe request (default: {retry_policy.BREAKER_COOLDOWN:.0f})')
+    parser.add_argument('--record', type=str, default=None, metavar='DIR',
+                       help='Record every fetch (status, headers, body, latency) into a replay bundle')
+    parser.add_argument('--replay', type=str, default=None, metavar='DIR',
+                       help='Crawl from a replay bundle instead of the network (no browser, no delays)')
+    parser.add_argument('--replay-latency', action='store_true',
+                       help='With --replay: wait the recorded latency of each fetch instead of answering at once')
+    parser.add_argument('--adaptive-timeouts', action='store_true',
+                       help=f'Set each host\'s timeouts from its observed latency per page type (kept in {adaptive_timeouts.TIMEOUTS_FILE})')
+    parser.add_argument('--hedge', action='store_true',
+                       help='With --adaptive-timeouts: send a duplicate request when a fetch is slower than 95%% of its host\'s, use the first answer')
+    parser.add_argument('--mirrors', type=str, nargs='?', const=mirrors.MIRRORS_FILE, default=None, metavar='FILE',
+                       help=f'Send each market\'s fetches to its fastest healthy mirror from the mirror sets in FILE (default: {mirrors.MIRRORS_FILE}); records keep the canonical address')
+    parser.add_argument('--probe-interval', type=float, default=mirrors.PROBE_INTERVAL,
+                       help=f'With --mirrors: seconds between mirror probes (default: {mirrors.PROBE_INTERVAL})')
+    parser.add_argument('--tor-control', action='store_true',
+                       help='Send NEWNYM through the Tor control port when a market\'s circuit turns slow or fails, then re-warm the session')
+    parser.add_argument('--tor-control-port', type=int, default=tor_control.CONTROL_PORT,
+                       help=f'Tor control port (default: {tor_control.CONTROL_PORT})')
+    parser.add_argument('--tor-password', type=str, default=None,
+                       help='Control port password (default: $TOR_CONTROL_PASSWORD, else cookie or no authentication)')
+    parser.add_argument('--tor-cookie', type=str, default=None,
+                       help='Control port auth cookie file (CookieAuthentication 1)')
+    parser.add_argument('--renew-latency', type=float, default=tor_control.LATENCY_THRESHOLD,
+                       help=f'With --tor-control: renew when a market\'s median fetch time exceeds this (default: {tor_control.LATENCY_THRESHOLD:.0f}s)')
+    parser.add_argument('--renew-error-rate', type=float, default=tor_control.MAX_ERROR_RATE,
+                       help=f'With --tor-control: renew when more than this share of a market\'s recent fetches fail (default: {tor_control.MAX_ERROR_RATE})')
+    parser.add_argument('--keep-browser', action='store_true',
+                       help='Keep the Firefox session open to refresh cookies when a market answers with a CAPTCHA or login page')
+    parser.add_argument('--no-challenge-check', action='store_true',
+                       help='Do not check fetched pages for CAPTCHA, DDoS-guard and login pages')
+    parser.add_argument('--challenge-config', type=str, default=challenge_guard.CHALLENGES_FILE,
+                       help=f'Extra challenge signatures and product markers, global or per host (default: {challenge_guard.CHALLENGES_FILE})')
+    parser.add_argument('--no-profiles', action='store_true',
+                       help=f'Use the default selector chains instead of the learned per-market profiles ({PROFILES_FILE})')
+    parser.add_argument('--search-index', action='store_true',
+                       help='Feed product pages into the local full-text index (search_index.db)')
+    parser.add_argument('--near-duplicates', action='store_true',
+                       help=f'Tag each product with a near-duplicate cluster_id (index kept in {NEAR_DUPLICATES_FILE})')
+    parser.add_argument('--store-api', action='store_true',
+                       help=f'Take the product URLs of each category from the market\'s WooCommerce Store API when it offers one, instead of category and pagination pages (probe results kept in {store_api.STORE_API_FILE})')
+    parser.add_argument('--log-level', type=str, default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                       help='Lowest level of per-page messages to show (default: INFO)')
+    parser.add_argument('--log-file', type=str, default=None, metavar='FILE',
+                       help='Also write every log record as a JSON line to FILE')
+    parser.add_argument('--progress', action='store_true',
+                       help='Show a live progress line (pages/s, error rate, ETA) instead of a line per product; warnings and errors are still printed')
+    
+    args = parser.parse_args()
+    global extraction_profiles
+    if not args.no_profiles:
+        extraction_profiles = ProfileStore(PROFILES_FILE)
+    crawl_log.setup(args.log_level, args.log_file, show_progress=args.progress, limit=args.max_products)
+    http_fetch.configure(max_bytes=args.max_page_bytes, total_timeout=args.total_timeout)
+    retry_policy.configure(max_attempts=args.max_retries, breaker_threshold=args.breaker_threshold,
+                           breaker_cooldown=args.breaker_cooldown)
+    fetch_replay.start(record=args.record, replay=args.replay, latency=args.replay_latency)
+    if args.adaptive_timeouts or args.hedge:
+        adaptive_timeouts.start(hedge=args.hedge)
+    
+    # Load category URLs
+    category_urls = load_pages_urls()
+    if not category_urls:
+        print(colored("\n❌ No URLs to scrape. Exiting.", "red"))
+        return
+    
+    print(colored(f"\n🚀 Starting scraper...", "cyan", attrs=['bold']))
+    print(colored(f"   Categories to scrape: {len(category_urls)}", "white"))
+    print(colored(f"   Delay between requests: {args.delay}s", "white"))
+    
+    search_conn = open_search_index() if args.search_index else None
+
+    near_duplicate_index = None
+    if args.near_duplicates:
+        near_duplicate_index = load_near_duplicate_index(NEAR_DUPLICATES_FILE)
+        print(colored(f"   Near-duplicate index: {len(near_duplicate_index)} listings", "white"))
+    
+    output = None
+    archive_index = None
+    pool = None
+    driver = None
+    saved_count = 0
+    try:
+        if fetch_replay.replaying():
+            session = setup_requests_session({}, args.socks, args.socks_port)
+            if not args.no_challenge_check:
+                challenge_guard.start(config_path=args.challenge_config)
+        else:
+            session, driver = establish_session(args, category_urls[0])
+            if not args.no_challenge_check:
+                if driver is not None:
+                    refresher = challenge_guard.browser_refresher(driver, manual=args.manual)
+                elif args.manual:
+                    refresher = challenge_guard.prompt_refresher()
+                else:
+                    refresher = None
+                challenge_guard.start(refresher, args.challenge_config)
+            if args.tor_control:
+                tor_control.start(session, port=args.tor_control_port, password=args.tor_password,
+                                  cookie_file=args.tor_cookie, latency_threshold=args.renew_latency,
+                                  max_error_rate=args.renew_error_rate)
         
-        print(colored(f"✅ Session established, extracted {len(cookies)} cookies", "green"))
-        
-        # Setup requests session
-        session = setup_requests_session(cookies, args.socks, args.socks_port)
+        if args.mirrors:
+            mirrors.start(session, args.mirrors, interval=args.probe_interval)
         
-        # Scrape all categories
-        all_products = []
-        scraped_urls = set()
+        # Scrape all categories, writing each product as soon as it arrives
+        archive_index = ArchiveIndex()
+        output = open_products_output(args.resume, archive_index)
+        dedupe = DedupeIndex(output.seen_urls)
+        budget = Budget(args.max_products)
         
-        for category_url in category_urls:
-            print(colored(f"\n{'='*80}", "cyan"))
-            print(colored(f"CATEGORY: {category_url}", "cyan", attrs=['bold']))
-            print(colored(f"{'='*80}", "cyan"))
-            
-            # Extract market name from URL
-            parsed = urllib.parse.urlparse(category_url)
-            market_name = parsed.netloc
-            
-            # Scrape category page (no pagination - only the given URL)
-            product_links, _ = scrape_category_page(session, category_url)
-            all_product_links = set(product_links)
-            
-            print(colored(f"\n📊 Products found on this page: {len(all_product_links)}", "green", attrs=['bold']))
-            
-            # Scrape each product page
-            for i, product_url in enumerate(all_product_links, 1):
-                if product_url in scraped_urls:
-                    print(colored(f"  ⏭️  Skipping duplicate: {product_url}", "yellow"))
-                    continue
-                
-                if args.max_products and len(all_products) >= args.max_products:
-                    print(colored(f"\n⚠️  Reached max products limit ({args.max_products})", "yellow"))
-                    break
-                
-                print(colored(f"  [{i}/{len(all_product_links)}]", "white"), end=" ")
-                
-                product_data = scrape_product_page(session, product_url, category_url, market_name)
-                
-                if product_data:
-                    all_products.append(product_data)
-                    scraped_urls.add(product_url)
-                    print(colored(f"    ✅ Saved (total: {len(all_products)})", "green"))
-                else:
-                    print(colored(f"    ❌ Failed", "red"))
-                
-                # Delay between requests
-                time.sleep(args.delay + random.uniform(0, 1))
-            
-            if args.max_products and len(all_products) >= args.max_products:
-                break
+        def store_product(product_data):
+            nonlocal saved_count
+            if near_duplicate_index is not None:
+                cluster_id = near_duplicate_index.add(product_data['product_url'],
+                                                      listing_text_from_html(product_data['html']))
+                if cluster_id:
+                    product_data['cluster_id'] = cluster_id
+            if search_conn is not None:
+                try:
+                    index_page(search_conn, product_data['product_url'], html=product_data['html'],
+                               market=product_data['market'], kind='listing')
+                except Exception as e:
+                    log.error("❌ Failed indexing listing text: %s", e,
+                              extra={'event': 'index_error', 'url': product_data['product_url']})
+            output.write(product_data)
+            saved_count += 1
         
-        # Save all products to JSON (overwrite mode)
+        # All categories are crawled at once, sharing the workers fairly
+        pool = ThreadPoolExecutor(max_workers=args.workers)
+        limiter = HostLimiter(args.per_host)
         print(colored(f"\n{'='*80}", "cyan"))
-        print(colored(f"💾 SAVING RESULTS", "cyan", attrs=['bold']))
+        print(colored(f"CATEGORIES: {len(category_urls)} ({args.workers} workers, {args.per_host} per host)",
+                      "cyan", attrs=['bold']))
         print(colored(f"{'='*80}", "cyan"))
         
-        save_products_html(all_products, overwrite=True)
+        listed = list_store_products(session, category_urls) if args.store_api else None
+        for product_data in crawl_categories(session, category_urls, pool, args.workers, limiter, dedupe, budget,
+                                             args.delay, args.max_pages, paginate=args.paginate, listed=listed):
+            crawl_log.item_done(product_data is not None)
+            if product_data:
+                store_product(product_data)
+                log.info("    ✅ Saved %s (total: %d)", product_data['product_url'], saved_count,
+                         extra={'event': 'saved', 'url': product_data['product_url']})
+            else:
+                log.warning("    ❌ Failed", extra={'event': 'failed'})
+        
+        crawl_log.stop()
+        if budget.exhausted:
+            print(colored(f"\n⚠️  Reached max products limit ({args.max_products})", "yellow"))
         
         print(colored(f"\n✅ Scraping complete!", "green", attrs=['bold']))
-        print(colored(f"   Total products scraped: {len(all_products)}", "green"))
+        print(colored(f"   Total products scraped: {saved_count}", "green"))
         print(colored(f"   Saved to: {PRODUCTS_HTML_FILE}", "green"))
         
     except KeyboardInterrupt:
         print(colored("\n\n⚠️  Scraping interrupted by user", "yellow"))
-        if all_products:
-            print(colored(f"💾 Saving {len(all_products)} products collected so far...", "yellow"))
-            save_products_html(all_products, overwrite=True)
+        print(colored(f"💾 {saved_count} products collected so far are saved in {PRODUCTS_HTML_FILE}", "yellow"))
     
     except Exception as e:
         print(colored(f"\n❌ Error: {e}", "red"))
@@ -385,11 +836,30 @@ def main():
         traceback.print_exc()
     
     finally:
-        if driver:
+        if output is not None:
+            output.close()
+        if archive_index is not None:
+            archive_index.close()
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        crawl_log.stop()
+        print_fetch_stats()
+        store_api.print_store_api_stats()
+        print_retry_stats()
+        challenge_guard.stop()
+        tor_control.stop()
+        mirrors.stop()
+        adaptive_timeouts.stop()
+        fetch_replay.stop()
+        if driver is not None:
             try:
                 driver.quit()
             except Exception:
                 pass
+        extraction_profiles.save()
+        extraction_profiles.print_stats()
+        if near_duplicate_index is not None:
+            save_near_duplicate_index(near_duplicate_index, NEAR_DUPLICATES_FILE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Local full-text search over crawled pages (SQLite FTS5)
+
+The scrapers feed this index as they crawl (--search-index), and it can be
+rebuilt from the JSON archives. Keyword discovery against pages we already
+hold then needs no Tor round-trips:
+
+    python3 search_index.py "buy steroids" viagra --market drugj7...onion
+    python3 search_index.py --rebuild products_html.json scraped_pages_warc/*.warc.gz
+
+Each indexed page stores its URL, market (netloc), kind ("listing",
+"category" or "page"), title, description and visible text.
+"""
+
+import argparse
+import html as html_lib
+import os
+import re
+import sqlite3
+import time
+import urllib.parse
+from termcolor import colored
+
+from archive_io import iter_json_array, record_url
+from warc_archive import iter_warc_pages
+
+
+SEARCH_INDEX_FILE = "search_index.db"
+
+_SCRIPT_STYLE_RE = re.compile(r'<(script|style|noscript)\b[^>]*>.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+_TAG_RE = re.compile(r'<[^>]+>')
+_SPACE_RE = re.compile(r'\s+')
+_TITLE_RE = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+
+
+def visible_text(page_html):
+    """Strip scripts, styles, comments and tags from HTML without building a DOM."""
+    text = _SCRIPT_STYLE_RE.sub(' ', page_html or '')
+    text = _COMMENT_RE.sub(' ', text)
+    text = _TAG_RE.sub(' ', text)
+    return _SPACE_RE.sub(' ', html_lib.unescape(text)).strip()
+
+
+def html_title(page_html):
+    match = _TITLE_RE.search(page_html or '')
+    return _SPACE_RE.sub(' ', html_lib.unescape(match.group(1))).strip() if match else None
+
+
+def open_index(path=SEARCH_INDEX_FILE):
+    """Open (and create if needed) the search index database."""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS pages (
+            id INTEGER PRIMARY KEY,
+            url TEXT UNIQUE NOT NULL,
+            market TEXT,
+            kind TEXT,
+            fetched_at INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS pages_market ON pages(market);
+        CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
+            title, description, body,
+            tokenize = 'unicode61 remove_diacritics 2'
+        );
+    """)
+    return conn
+
+
+def index_page(conn, url, html=None, title=None, description=None, market=None, kind='page',
+               fetched_at=None, text=None, commit=True):
+    """Insert or replace one page in the index."""
+    if market is None:
+        market = urllib.parse.urlparse(url).netloc
+    if text is None:
+        text = visible_text(html)
+    if title is None:
+        title = html_title(html)
+
+    row = conn.execute("SELECT id FROM pages WHERE url = ?", (url,)).fetchone()
+    if row:
+        page_id = row[0]
+        conn.execute("UPDATE pages SET market = ?, kind = ?, fetched_at = ? WHERE id = ?",
+                     (market, kind, fetched_at or int(time.time()), page_id))
+        conn.execute("DELETE FROM pages_fts WHERE rowid = ?", (page_id,))
+    else:
+        cur = conn.execute("INSERT INTO pages (url, market, kind, fetched_at) VALUES (?, ?, ?, ?)",
+                           (url, market, kind, fetched_at or int(time.time())))
+        page_id = cur.lastrowid
+    conn.execute("INSERT INTO pages_fts (rowid, title, description, body) VALUES (?, ?, ?, ?)",
+                 (page_id, title or '', description or '', text or ''))
+    if commit:
+        conn.commit()
+    return page_id
+
+
+def build_match_query(keywords):
+    """OR together keywords, each matched as an exact phrase."""
+    phrases = ['"' + keyword.replace('"', '""') + '"' for keyword in keywords if keyword.strip()]
+    return ' OR '.join(phrases)
+
+
+def search(conn, keywords, market=None, kind=None, limit=50):
+    """Return matching pages (best first) with a highlighted snippet."""
+    match = build_match_query(keywords)
+    if not match:
+        return []
+
+    sql = """
+        SELECT p.url, p.market, p.kind, p.fetched_at, f.title,
+               snippet(pages_fts, -1, '[', ']', '…', 12)
+        FROM pages_fts f JOIN pages p ON p.id = f.rowid
+        WHERE pages_fts MATCH ?
+    """
+    params = [match]
+    if market:
+        sql += " AND p.market = ?"
+        params.append(market)
+    if kind:
+        sql += " AND p.kind = ?"
+        params.append(kind)
+    sql += " ORDER BY rank LIMIT ?"
+    params.append(limit)
+
+    return [
+        {'url': url, 'market': mkt, 'kind': knd, 'fetched_at': fetched_at, 'title': title, 'snippet': snippet}
+        for url, mkt, knd, fetched_at, title, snippet in conn.execute(sql, params)
+    ]
+
+
+def rebuild_from_archive(conn, path):
+    """Index every record of a products_html.json archive or a --save-pages .warc.gz file."""
+    count = 0
+    records = iter_warc_pages(path) if path.endswith('.warc.gz') else iter_json_array(path)
+    for record in records:
+        url = record_url(record) or record.get('url')
+        if not url or not record.get('html'):
+            continue
+        if record_url(record):
+            kind = 'listing'
+        else:
+            kind = 'category' if '/product-category/' in urllib.parse.urlparse(url).path else 'page'
+        index_page(
+            conn, url,
+            html=record['html'],
+            title=record.get('title'),
+            description=record.get('description'),
+            market=record.get('market'),
+            kind=kind,
+            fetched_at=record.get('fetched_at') or record.get('timestamp'),
+            commit=False,
+        )
+        count += 1
+        if count % 1000 == 0:
+            conn.commit()
+    conn.commit()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the local full-text index of crawled pages')
+    parser.add_argument('keywords', nargs='*', help='Keywords or phrases to look for (any may match)')
+    parser.add_argument('--index', type=str, default=SEARCH_INDEX_FILE,
+                       help=f'Index database (default: {SEARCH_INDEX_FILE})')
+    parser.add_argument('--market', type=str, default=None,
+                       help='Only return pages from this market (netloc)')
+    parser.add_argument('--kind', choices=['listing', 'category', 'page'], default=None,
+                       help='Only return pages of this kind')
+    parser.add_argument('--limit', type=int, default=50,
+                       help='Maximum number of results (default: 50)')
+    parser.add_argument('--rebuild', nargs='+', metavar='ARCHIVE',
+                       help='Index these archives (products_html.json, scraped_pages_warc/*.warc.gz) first')
+
+    args = parser.parse_args()
+
+    conn = open_index(args.index)
+
+    if args.rebuild:
+        for path in args.rebuild:
+            if not os.path.exists(path):
+                print(colored(f"❌ {path} not found!", "red"))
+                continue
+            count = rebuild_from_archive(conn, path)
+            print(colored(f"✅ Indexed {count} pages from {path}", "green"))
+
+    if not args.keywords:
+        return
+
+    start = time.perf_counter()
+    results = search(conn, args.keywords, market=args.market, kind=args.kind, limit=args.limit)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    for result in results:
+        print(colored(f"{result['url']}", "green") + colored(f"  [{result['kind']}] {result['title'] or ''}", "white"))
+        print(f"    {result['snippet']}")
+    print(colored(f"\n{len(results)} matches in {elapsed_ms:.1f} ms", "blue"))
+
+
+if __name__ == "__main__":
+    main()
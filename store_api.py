@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+WooCommerce Store API / product sitemap backend (--store-api)
+
+The markets are WooCommerce shops. Many of them still expose the public
+Store API, which lists products as paginated JSON with the fields the HTML
+path has to dig out of two pages per listing (category card + detail page):
+
+    /wp-json/wc/store/v1/products?per_page=100&page=N[&category=ID]
+
+and, failing that, a product sitemap (/wp-sitemap.xml → wp-sitemap-posts-
+product-N.xml, or Yoast's /product-sitemap.xml) that lists every listing URL
+without any category pages. discover() probes a market once and remembers
+the answer in store_api.json for PROBE_TTL seconds:
+
+- "api": products and their fields come from the Store API, no HTML at all
+- "sitemap": listing URLs come from the sitemap, detail pages are fetched
+  as usual (category pages are skipped)
+- null: the market offers neither and is crawled through its HTML pages
+
+Permalinks are moved onto the address the crawl uses (WordPress writes its
+own configured site URL into them, often another mirror).
+
+    python3 store_api.py http://market.onion/ --socks     # what a market offers, and a sample product
+"""
+
+import argparse
+import html as html_lib
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+import requests
+from bs4 import BeautifulSoup
+from termcolor import colored
+
+import crawl_log
+import http_fetch
+from retry_policy import fetch_with_retry
+
+
+STORE_API_FILE = "store_api.json"
+STORE_API_PATHS = ('/wp-json/wc/store/v1/products', '/wp-json/wc/store/products')
+SITEMAP_PATHS = ('/wp-sitemap.xml', '/product-sitemap.xml', '/sitemap_index.xml')
+PER_PAGE = 100
+PROBE_TTL = 24 * 3600
+MAX_SITEMAPS = 50
+
+JSON_CONTENT_TYPES = ('application/json', 'text/plain')
+XML_CONTENT_TYPES = ('application/xml', 'text/xml', 'text/plain')
+
+_LOC_RE = re.compile(r'<loc>\s*(.*?)\s*</loc>', re.S)
+# Product post sitemaps only: WordPress's wp-sitemap-posts-product-N.xml and Yoast's product-sitemapN.xml
+# (not the product_cat / product_tag taxonomy sitemaps, which list archive pages)
+_PRODUCT_SITEMAP_RE = re.compile(r'(?:^|/)(?:wp-sitemap-posts-product-\d+|product-sitemap\d*)\.xml$', re.I)
+
+STORE_API_STATS = {
+    'api_markets': 0,
+    'sitemap_markets': 0,
+    'html_markets': 0,
+    'requests': 0,
+    'products': 0,
+    'listing_urls': 0,
+}
+_stats_lock = threading.Lock()
+
+log = crawl_log.get_logger('store_api')
+
+
+def _record(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            STORE_API_STATS[key] = STORE_API_STATS.get(key, 0) + value
+
+
+def _on_base(url, base_url):
+    """url's path and query on the scheme and address of base_url."""
+    base = urllib.parse.urlparse(base_url)
+    return urllib.parse.urlparse(url)._replace(scheme=base.scheme, netloc=base.netloc).geturl()
+
+
+def _root(url):
+    parts = urllib.parse.urlparse(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _text(fragment):
+    if not fragment:
+        return ''
+    return BeautifulSoup(fragment, 'html.parser').get_text(separator='\n', strip=True)
+
+
+def _get(session, url, allowed_types, params=None):
+    """GET for the backend's JSON/XML documents (None unless it answers 200)."""
+    if params:
+        url = f"{url}?{urllib.parse.urlencode(params)}"
+    _record(requests=1)
+    try:
+        response = fetch_with_retry(session, url, timeout=30, allowed_types=allowed_types, page_type='api')
+    except requests.exceptions.RequestException as e:
+        log.warning("Store backend request failed %s: %s", url, e, extra={'event': 'store_api_error', 'url': url})
+        return None
+    return response if response.status_code == 200 else None
+
+
+def _json(response):
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+def is_product_sitemap(url):
+    """True for a sitemap that lists product pages (not product categories or tags)."""
+    return bool(_PRODUCT_SITEMAP_RE.search(urllib.parse.urlparse(html_lib.unescape(url)).path))
+
+
+def category_slug(category_url):
+    """Slug of a /product-category/<parent>/<slug>/ URL (None for other URLs)."""
+    segments = [segment for segment in urllib.parse.urlparse(category_url).path.split('/') if segment]
+    if 'product-category' not in segments or segments[-1] == 'product-category':
+        return None
+    # /product-category/slug/page/3/ → slug
+    if len(segments) >= 2 and segments[-2] == 'page' and segments[-1].isdigit():
+        segments = segments[:-2]
+    return urllib.parse.unquote(segments[-1])
+
+
+def price_details(prices):
+    """price / price_numeric / currency the way the HTML path writes them, from the Store API's minor units."""
+    details = {}
+    if not prices:
+        return details
+    minor = int(prices.get('currency_minor_unit') or 0)
+    prefix, suffix = prices.get('currency_prefix') or '', prices.get('currency_suffix') or ''
+
+    def amount(raw):
+        return f"{int(raw) / 10 ** minor:.{minor}f}"
+
+    price_range = prices.get('price_range')
+    if price_range and price_range.get('min_amount') and price_range.get('max_amount'):
+        low, high = amount(price_range['min_amount']), amount(price_range['max_amount'])
+        details['price'] = f"{prefix}{low}{suffix} – {prefix}{high}{suffix}"
+        details['price_numeric'] = low
+    elif prices.get('price'):
+        details['price'] = f"{prefix}{amount(prices['price'])}{suffix}"
+        details['price_numeric'] = amount(prices['price'])
+    if prices.get('currency_code'):
+        details['currency'] = prices['currency_code']
+    return details
+
+
+def details_from_api(item):
+    """extract_product_details()-shaped fields of one Store API product."""
+    details = {}
+    if item.get('name'):
+        details['title'] = html_lib.unescape(_text(item['name']))
+    details.update(price_details(item.get('prices')))
+
+    if 'is_in_stock' in item:
+        details['stock_status'] = 'in stock' if item['is_in_stock'] else 'out of stock'
+    availability = (item.get('stock_availability') or {}).get('text')
+    if availability:
+        details['stock_raw'] = availability
+    if item.get('low_stock_remaining'):
+        details['in_stock_count'] = str(item['low_stock_remaining'])
+
+    description = _text(item.get('description') or item.get('short_description'))
+    if description:
+        details['description'] = description
+        for line in description.split('\n'):
+            if ':' in line:
+                key, value = line.split(':', 1)
+                details[f"desc_{key.strip().lower().replace(' ', '_')}"] = value.strip()
+
+    categories = [html_lib.unescape(category['name']) for category in item.get('categories') or []
+                  if category.get('name')]
+    if categories:
+        details['categories'] = list(dict.fromkeys(categories))
+        details['primary_category'] = categories[-1]
+    if item.get('sku'):
+        details['sku'] = item['sku']
+
+    review_count = item.get('review_count') or 0
+    if review_count:
+        details['review_count'] = int(review_count)
+        try:
+            details['rating_stars'] = float(item.get('average_rating'))
+        except (TypeError, ValueError):
+            pass
+
+    variations = [{'option': attribute['name'], 'value': ', '.join(term['name'] for term in attribute['terms'])}
+                  for attribute in item.get('attributes') or [] if attribute.get('name') and attribute.get('terms')]
+    if variations:
+        details['variations'] = variations
+
+    images = [image['src'] for image in item.get('images') or [] if image.get('src')]
+    if images:
+        details['images'] = list(dict.fromkeys(images))
+        details['main_image'] = images[0]
+    return details
+
+
+class StoreSource:
+    """What a market offers: the Store API (kind "api") or a product sitemap (kind "sitemap")."""
+
+    def __init__(self, base_url, kind, path):
+        self.base_url = _root(base_url)
+        self.kind = kind
+        self.path = path
+        self._category_ids = None
+
+    def products(self, session, category_id=None):
+        """Yield the Store API's product objects, page by page."""
+        url = self.base_url + self.path
+        page, total_pages = 1, None
+        while total_pages is None or page <= total_pages:
+            params = {'per_page': PER_PAGE, 'page': page}
+            if category_id is not None:
+                params['category'] = category_id
+            response = _get(session, url, JSON_CONTENT_TYPES, params)
+            items = _json(response) if response is not None else None
+            if not isinstance(items, list):
+                if page == 1:
+                    raise ValueError(f"Store API stopped answering at {url}")
+                return
+            try:
+                total_pages = int(response.headers.get('X-WP-TotalPages', 0)) or None
+            except ValueError:
+                total_pages = None
+            for item in items:
+                if isinstance(item, dict) and item.get('permalink'):
+                    _record(products=1)
+                    yield item
+            if len(items) < PER_PAGE:
+                return
+            page += 1
+
+    def category_ids(self, session):
+        """{slug: id} of the shop's product categories."""
+        if self._category_ids is not None:
+            return self._category_ids
+        self._category_ids = {}
+        response = _get(session, self.base_url + self.path + '/categories', JSON_CONTENT_TYPES,
+                        {'per_page': PER_PAGE})
+        categories = _json(response) if response is not None else None
+        if isinstance(categories, list):
+            self._category_ids = {category['slug']: category['id'] for category in categories
+                                  if isinstance(category, dict) and 'slug' in category and 'id' in category}
+        return self._category_ids
+
+    def listings(self, session, category_urls=None):
+        """
+        Yield (category page, listing URL, details or None) for the market, or for the given
+        /product-category/ URLs. Details are None for sitemap URLs (their detail page still has to be fetched).
+        """
+        if self.kind == 'sitemap':
+            for listing_url in self.sitemap_urls(session):
+                yield self.base_url + '/', listing_url, None
+            return
+        if not category_urls:
+            for item in self.products(session):
+                yield self.base_url + '/', _on_base(item['permalink'], self.base_url), details_from_api(item)
+            return
+        ids = self.category_ids(session)
+        for category_url in category_urls:
+            category_id = ids.get(category_slug(category_url))
+            if category_id is None:
+                continue
+            for item in self.products(session, category_id):
+                yield category_url, _on_base(item['permalink'], self.base_url), details_from_api(item)
+
+    def unlisted(self, session, category_urls):
+        """The category URLs listings() cannot serve (they are crawled through their HTML pages)."""
+        if self.kind == 'sitemap':
+            return list(category_urls)
+        ids = self.category_ids(session)
+        return [url for url in category_urls if ids.get(category_slug(url)) is None]
+
+    def sitemap_urls(self, session):
+        """Listing URLs from the product sitemaps under self.path."""
+        pending, seen, found = [self.base_url + self.path], set(), set()
+        while pending and len(seen) < MAX_SITEMAPS:
+            sitemap_url = pending.pop(0)
+            if sitemap_url in seen:
+                continue
+            seen.add(sitemap_url)
+            response = _get(session, sitemap_url, XML_CONTENT_TYPES)
+            if response is None:
+                continue
+            text = http_fetch.page_text(response)
+            locations = [html_lib.unescape(location) for location in _LOC_RE.findall(text)]
+            if '<sitemapindex' in text:
+                pending.extend(_on_base(location, self.base_url) for location in locations
+                               if is_product_sitemap(location))
+                continue
+            for location in locations:
+                listing_url = _on_base(location, self.base_url)
+                if listing_url not in found:
+                    found.add(listing_url)
+                    _record(listing_urls=1)
+                    yield listing_url
+
+
+def _probe_api(session, base_url):
+    for path in STORE_API_PATHS:
+        response = _get(session, base_url + path, JSON_CONTENT_TYPES, {'per_page': 1})
+        items = _json(response) if response is not None else None
+        # An empty list says nothing (a disabled or filtered endpoint answers [] too)
+        if isinstance(items, list) and items and all(isinstance(item, dict) and 'permalink' in item
+                                                      for item in items):
+            return path
+    return None
+
+
+def _probe_sitemap(session, base_url):
+    for path in SITEMAP_PATHS:
+        response = _get(session, base_url + path, XML_CONTENT_TYPES)
+        text = http_fetch.page_text(response) if response is not None else ''
+        if '<loc>' not in text:
+            continue
+        if '<sitemapindex' not in text or any(is_product_sitemap(location) for location in _LOC_RE.findall(text)):
+            return path
+    return None
+
+
+def _load_cache(path):
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('markets', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(path, markets):
+    """Write the probe results (atomic replace)."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'markets': markets}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def discover(session, base_url, cache_path=STORE_API_FILE, refresh=False):
+    """The market's StoreSource, or None when it has to be crawled through its HTML pages."""
+    base_url = _root(base_url)
+    market = urllib.parse.urlparse(base_url).netloc
+    markets = _load_cache(cache_path)
+    entry = markets.get(market)
+    if refresh or entry is None or time.time() - entry.get('checked_at', 0) > PROBE_TTL:
+        kind, path = None, _probe_api(session, base_url)
+        if path:
+            kind = 'api'
+        else:
+            path = _probe_sitemap(session, base_url)
+            kind = 'sitemap' if path else None
+        entry = {'kind': kind, 'path': path, 'checked_at': int(time.time())}
+        if cache_path:
+            markets[market] = entry
+            try:
+                _save_cache(cache_path, markets)
+            except OSError as e:
+                print(colored(f"Failed saving {cache_path}: {e}", "red"))
+
+    kind = entry.get('kind')
+    _record(**{f"{kind or 'html'}_markets": 1})
+    if kind is None:
+        print(colored(f"🛒 {market}: no Store API or product sitemap; crawling its HTML pages", "yellow"))
+        return None
+    print(colored(f"🛒 {market}: listing products through the {'Store API' if kind == 'api' else 'product sitemap'} "
+                  f"({entry['path']})", "cyan"))
+    return StoreSource(base_url, kind, entry['path'])
+
+
+def print_store_api_stats():
+    """Print the Store API section of the run summary."""
+    with _stats_lock:
+        stats = dict(STORE_API_STATS)
+    if not (stats['api_markets'] or stats['sitemap_markets'] or stats['html_markets']):
+        return
+    print(colored(f"🛒 Store backend: {stats['api_markets']} markets via Store API, {stats['sitemap_markets']} via "
+                  f"sitemap, {stats['html_markets']} via HTML; {stats['requests']} requests, "
+                  f"{stats['products']} products from the API, {stats['listing_urls']} listing URLs from sitemaps",
+                  "white"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Probe a WooCommerce market for the Store API and product sitemaps')
+    parser.add_argument('url', type=str, help='Any URL of the market')
+    parser.add_argument('--category', type=str, default=None, help='A /product-category/ URL to list')
+    parser.add_argument('--socks', action='store_true', help='Use Tor SOCKS5 (default uses HTTP proxy on 8118)')
+    parser.add_argument('--socks-port', type=int, default=9050, help='Tor SOCKS port (default: 9050)')
+
+    args = parser.parse_args()
+
+    session = requests.Session()
+    proxy = f'socks5h://127.0.0.1:{args.socks_port}' if args.socks else 'http://127.0.0.1:8118'
+    session.proxies = {'http': proxy, 'https': proxy}
+    source = discover(session, args.url, cache_path=None)
+    if source is None:
+        return
+    count = 0
+    for category_page, listing_url, details in source.listings(session, [args.category] if args.category else None):
+        count += 1
+        if count <= 3:
+            print(colored(listing_url, "green"))
+            if details:
+                print(json.dumps(details, ensure_ascii=False, indent=2)[:2000])
+    print(colored(f"{count} listings", "cyan"))
+
+
+if __name__ == "__main__":
+    main()
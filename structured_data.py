@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Structured-data fast path for listing pages (JSON-LD and microdata)
+
+WooCommerce and most shop themes describe the product in the page itself:
+an <script type="application/ld+json"> Product block with its Offer(s) and
+aggregateRating, or itemprop microdata inside an itemscope of type
+schema.org/Product. Those give the exact name, price, currency,
+availability, SKU and rating, where the selector chains of
+extract_product_details() have to guess from the visible text.
+
+product_fields() is called first; the selector chains then only look for
+the fields it did not fill. JSON-LD blocks are cut out of the raw HTML with
+a regular expression when it is at hand, so pages without structured data
+cost one substring search; microdata needs the parsed tree and is only
+looked at when the page mentions itemprop.
+
+    python3 structured_data.py products_html.json     # which archived listings carry structured data
+"""
+
+import argparse
+import json
+import re
+import threading
+from termcolor import colored
+
+from archive_io import iter_json_array
+
+
+# field_sources values
+JSON_LD = 'json-ld'
+MICRODATA = 'microdata'
+SELECTOR = 'selector'
+
+_JSON_LD_RE = re.compile(r'<script[^>]+type=["\']?application/ld\+json["\']?[^>]*>(.*?)</script>', re.I | re.S)
+_PRODUCT_TYPE_RE = re.compile(r'schema\.org/Product/?$', re.I)
+# A comma grouping thousands ("1,299.00"); any other comma is a decimal comma ("12,50", "1.299,00", "0,125")
+_THOUSANDS_COMMA_RE = re.compile(r',(?=\d{3}(?!\d))')
+
+AVAILABILITY = {
+    'instock': 'in stock',
+    'instoreonly': 'in stock',
+    'limitedavailability': 'in stock',
+    'onlineonly': 'in stock',
+    'preorder': 'available',
+    'backorder': 'available',
+    'outofstock': 'out of stock',
+    'soldout': 'out of stock',
+    'discontinued': 'unavailable',
+}
+
+STRUCTURED_DATA_STATS = {
+    'listings': 0,
+    JSON_LD: 0,
+    MICRODATA: 0,
+    'fields': 0,
+    'selector_fields': 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _record(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            STRUCTURED_DATA_STATS[key] = STRUCTURED_DATA_STATS.get(key, 0) + value
+
+
+def _first(value):
+    """The first element of a list, or the value itself."""
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def _is_product(node):
+    types = node.get('@type') or node.get('type')
+    types = types if isinstance(types, list) else [types]
+    return any(isinstance(t, str) and (t == 'Product' or _PRODUCT_TYPE_RE.search(t)) for t in types)
+
+
+def _find_product(node):
+    """The first Product object in a JSON-LD document (top level, list or @graph)."""
+    if isinstance(node, list):
+        for item in node:
+            product = _find_product(item)
+            if product is not None:
+                return product
+        return None
+    if not isinstance(node, dict):
+        return None
+    if _is_product(node):
+        return node
+    return _find_product(node.get('@graph') or [])
+
+
+def json_ld_product(html=None, soup=None):
+    """The Product object of the page's JSON-LD blocks, or None."""
+    if html is not None:
+        if 'application/ld+json' not in html:
+            return None
+        blocks = _JSON_LD_RE.findall(html)
+    else:
+        blocks = [script.string or '' for script in soup.find_all('script', type='application/ld+json')]
+    for block in blocks:
+        try:
+            document = json.loads(block.strip())
+        except ValueError:
+            # Some themes leave raw control characters in descriptions
+            try:
+                document = json.loads(block.strip(), strict=False)
+            except ValueError:
+                continue
+        product = _find_product(document)
+        if product is not None:
+            return product
+    return None
+
+
+def _microdata_value(elem):
+    for attribute in ('content', 'href', 'src', 'datetime'):
+        if elem.has_attr(attribute):
+            return elem[attribute].strip()
+    return elem.get_text(' ', strip=True)
+
+
+def _microdata_item(scope):
+    """{property: value} of one itemscope; nested itemscopes (offers, aggregateRating) become dicts."""
+    props = {}
+
+    def walk(node):
+        for child in node.find_all(True, recursive=False):
+            names = child.get('itemprop')
+            nested = child.has_attr('itemscope')
+            if names:
+                value = _microdata_item(child) if nested else _microdata_value(child)
+                for name in (names.split() if isinstance(names, str) else names):
+                    props.setdefault(name, value)
+            if not nested:
+                walk(child)
+    walk(scope)
+    return props
+
+
+def microdata_product(soup, html=None):
+    """The schema.org/Product microdata of the page as a JSON-LD-like dict, or None."""
+    if html is not None and 'itemprop' not in html:
+        return None
+    scope = soup.find(attrs={'itemscope': True, 'itemtype': _PRODUCT_TYPE_RE})
+    if scope is None:
+        return None
+    return _microdata_item(scope) or None
+
+
+def _number(value):
+    """'1299.00' / 1299 / '1,299.00' / '1.299,00' → '1299.00', '12,50' → '12.50' (None when it is not a number)."""
+    if value is None or isinstance(value, bool):
+        return None
+    text = str(value).strip()
+    if not text.startswith('0,'):
+        text = _THOUSANDS_COMMA_RE.sub('', text)
+    if ',' in text:
+        text = text.replace('.', '').replace(',', '.')
+    try:
+        float(text)
+    except ValueError:
+        return None
+    return text
+
+
+def _offer_fields(offers):
+    fields = {}
+    offer = _first(offers)
+    if not isinstance(offer, dict):
+        return fields
+    spec = _first(offer.get('priceSpecification'))
+    spec = spec if isinstance(spec, dict) else {}
+    currency = offer.get('priceCurrency') or spec.get('priceCurrency')
+    low, high = _number(offer.get('lowPrice')), _number(offer.get('highPrice'))
+    price = _number(offer.get('price')) or _number(spec.get('price'))
+    suffix = f" {currency}" if currency else ''
+    if low and high and low != high:
+        fields['price'] = f"{low}{suffix} – {high}{suffix}"
+        fields['price_numeric'] = low
+    elif price or low:
+        fields['price'] = f"{price or low}{suffix}"
+        fields['price_numeric'] = price or low
+    if currency and 'price' in fields:
+        fields['currency'] = str(currency)
+
+    availability = offer.get('availability')
+    if isinstance(availability, str):
+        status = AVAILABILITY.get(availability.rstrip('/').rsplit('/', 1)[-1].lower())
+        if status:
+            fields['stock_status'] = status
+    inventory = offer.get('inventoryLevel')
+    count = _number(inventory.get('value') if isinstance(inventory, dict) else inventory)
+    if count is not None:
+        fields['in_stock_count'] = str(int(float(count)))
+    return fields
+
+
+def _rating_fields(rating):
+    fields = {}
+    rating = _first(rating)
+    if not isinstance(rating, dict):
+        return fields
+    value, best = _number(rating.get('ratingValue')), _number(rating.get('bestRating'))
+    if value is not None:
+        stars = float(value)
+        if best is not None and float(best) not in (0.0, 5.0):
+            stars = stars * 5 / float(best)
+        fields['rating_stars'] = round(stars, 2)
+        # Same field the .star-rating width gives on the selector path
+        fields['rating_percent'] = f"{round(stars * 20, 1):g}"
+    count = _number(rating.get('reviewCount')) or _number(rating.get('ratingCount'))
+    if count is not None:
+        fields['review_count'] = int(float(count))
+    return fields
+
+
+def fields_from_product(product):
+    """extract_product_details()-shaped fields of a schema.org Product (JSON-LD or microdata)."""
+    fields = {}
+    name = _first(product.get('name'))
+    if isinstance(name, str) and name.strip():
+        fields['title'] = ' '.join(name.split())
+    fields.update(_offer_fields(product.get('offers')))
+    sku = _first(product.get('sku'))
+    if isinstance(sku, (str, int)) and str(sku).strip():
+        fields['sku'] = str(sku).strip()
+    fields.update(_rating_fields(product.get('aggregateRating')))
+    return fields
+
+
+def product_fields(soup, html=None):
+    """
+    (fields, source) from the page's structured data: JSON-LD first, then microdata.
+    ({}, None) when the page has neither.
+    """
+    product = json_ld_product(html, soup)
+    if product is not None:
+        fields = fields_from_product(product)
+        if fields:
+            return fields, JSON_LD
+    product = microdata_product(soup, html)
+    if product is not None:
+        fields = fields_from_product(product)
+        if fields:
+            return fields, MICRODATA
+    return {}, None
+
+
+def tally(details):
+    """Count one stored listing's field sources toward the run summary."""
+    sources = details.get('field_sources')
+    if not sources:
+        return
+    structured = [source for source in sources.values() if source != SELECTOR]
+    _record(listings=1, fields=len(structured), selector_fields=len(sources) - len(structured),
+            **({structured[0]: 1} if structured else {}))
+
+
+def print_structured_data_stats():
+    """Print the structured-data section of the run summary."""
+    with _stats_lock:
+        stats = dict(STRUCTURED_DATA_STATS)
+    if not stats['listings']:
+        return
+    print(colored(f"🏷️  Structured data: {stats[JSON_LD]} of {stats['listings']} listings from JSON-LD, "
+                  f"{stats[MICRODATA]} from microdata; {stats['fields']} fields from structured data, "
+                  f"{stats['selector_fields']} from selector chains", "white"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show which archived listings carry structured product data')
+    parser.add_argument('archive', nargs='?', default='products_html.json', help='Archive (default: products_html.json)')
+    parser.add_argument('--limit', type=int, default=None, help='Only the first N listings')
+    args = parser.parse_args()
+
+    from bs4 import BeautifulSoup
+
+    counts = {JSON_LD: 0, MICRODATA: 0, None: 0}
+    fields = {}
+    for index, record in enumerate(iter_json_array(args.archive)):
+        if args.limit is not None and index >= args.limit:
+            break
+        html = record.get('html') if isinstance(record, dict) else None
+        if not html:
+            continue
+        found, source = product_fields(BeautifulSoup(html, 'html.parser'), html)
+        counts[source] += 1
+        for field in found:
+            fields[field] = fields.get(field, 0) + 1
+
+    total = sum(counts.values())
+    print(colored(f"{total} listings: {counts[JSON_LD]} JSON-LD, {counts[MICRODATA]} microdata, "
+                  f"{counts[None]} without structured product data", "cyan"))
+    for field, count in sorted(fields.items(), key=lambda item: -item[1]):
+        print(f"  {field}: {count}")
+
+
+if __name__ == "__main__":
+    main()
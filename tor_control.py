@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Latency-aware Tor circuit renewal through the control port (--tor-control)
+
+Every onion service is reached over its own circuit, and when one turns slow
+every request to that market crawls until the 20–30 s timeouts fire; the
+crawl never gets off the bad circuit on its own. The circuit monitor watches
+every fetch (http_fetch.observers) and keeps, per host, the last WINDOW
+latencies and outcomes. When a host's median latency passes the threshold
+or its error rate gets too high, it sends SIGNAL NEWNYM to Tor's control
+port (at most once per RENEW_COOLDOWN, and never faster than Tor's own
+10 s NEWNYM rate limit), then re-warms the session: pooled keep-alive
+connections still ride the old circuits, so they are dropped and the host
+is fetched once to build the new circuit before the crawl needs it.
+
+Each renewal is logged with the host's median latency and throughput
+before it, and again once enough fetches have completed on the new circuit,
+so the run summary shows whether renewing helped.
+
+Tor needs a control port (torrc):
+
+    ControlPort 9051
+    HashedControlPassword 16:...        # tor --hash-password <password>
+
+    python3 tor_control.py --newnym --password <password>     # renew once by hand
+    python3 tor_control.py --mock-server 9151                  # fake control port for dry runs
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import threading
+import time
+import urllib.parse
+from collections import deque
+from termcolor import colored
+
+import http_fetch
+from http_fetch import FetchAborted
+
+
+CONTROL_PORT = 9051
+NEWNYM_INTERVAL = 10          # Tor ignores NEWNYM more often than this
+RENEW_COOLDOWN = 60           # our own minimum time between renewals
+LATENCY_THRESHOLD = 15.0      # median seconds per fetch that counts as a slow circuit
+MAX_ERROR_RATE = 0.5
+WINDOW = 20                   # recent fetches kept per host
+MIN_SAMPLES = 6               # fetches needed before a host can be judged (and after a renewal)
+WARM_TIMEOUT = 60
+
+TOR_STATS = {
+    'renewals': 0,
+    'renewal_failures': 0,
+    'rate_limited': 0,
+    'warm_failures': 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _record(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            TOR_STATS[key] = TOR_STATS.get(key, 0) + value
+
+
+class ControlError(Exception):
+    """Tor's control port refused a command or could not be reached."""
+
+
+class TorController:
+    """Minimal Tor control protocol client: authenticate and send signals."""
+
+    def __init__(self, host='127.0.0.1', port=CONTROL_PORT, password=None, cookie_file=None, timeout=10):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.cookie_file = cookie_file
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        try:
+            self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError as e:
+            raise ControlError(f"cannot reach control port {self.host}:{self.port}: {e}")
+        self._reader = self._sock.makefile('rb')
+        if self.password is not None:
+            escaped = self.password.replace('\\', '\\\\').replace('"', '\\"')
+            self._command(f'AUTHENTICATE "{escaped}"')
+        elif self.cookie_file:
+            with open(self.cookie_file, 'rb') as f:
+                self._command(f"AUTHENTICATE {f.read().hex()}")
+        else:
+            self._command("AUTHENTICATE")
+
+    def _command(self, line):
+        """Send one command; returns the reply lines, raises ControlError unless it is 250."""
+        try:
+            self._sock.sendall(line.encode('utf-8') + b'\r\n')
+            replies = []
+            while True:
+                reply = self._reader.readline().decode('utf-8', 'replace').rstrip('\r\n')
+                if not reply:
+                    raise ControlError("control connection closed")
+                replies.append(reply)
+                # "250-" and "250+" continue a reply, "250 " ends it
+                if len(reply) < 4 or reply[3] == ' ':
+                    break
+        except OSError as e:
+            self.close()
+            raise ControlError(f"control port error: {e}")
+        if not replies[-1].startswith('250'):
+            command = line.split(' ', 1)[0]
+            self.close()
+            raise ControlError(f"{command} refused: {replies[-1]}")
+        return replies
+
+    def connect(self):
+        """Connect and authenticate now (otherwise done on the first signal)."""
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+
+    def signal(self, name):
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            self._command(f"SIGNAL {name}")
+
+    def newnym(self):
+        """Ask Tor for new circuits for new streams."""
+        self.signal("NEWNYM")
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+            self._reader = None
+
+
+def _host_of(url):
+    return urllib.parse.urlparse(url).netloc
+
+
+class CircuitMonitor:
+    """Rolling per-host latency and error rate; renews the Tor circuits when a host degrades."""
+
+    def __init__(self, controller, session=None, latency_threshold=LATENCY_THRESHOLD,
+                 max_error_rate=MAX_ERROR_RATE, cooldown=RENEW_COOLDOWN, window=WINDOW, min_samples=MIN_SAMPLES):
+        self.controller = controller
+        self.session = session
+        self.latency_threshold = latency_threshold
+        self.max_error_rate = max_error_rate
+        self.cooldown = max(cooldown, NEWNYM_INTERVAL)
+        self.window = window
+        self.min_samples = min_samples
+        self.renewals = []            # {'at', 'host', 'reason', 'before', 'after'}
+        self._hosts = {}              # host → deque of (finished_at, seconds, ok)
+        self._lock = threading.Lock()
+        self._renewing = False
+        self._last_attempt = None
+        self._warming = threading.local()
+
+    def observe(self, url, seconds, error):
+        """http_fetch observer: record one fetch and renew the circuits if its host has degraded."""
+        if getattr(self._warming, 'active', False):
+            return
+        if isinstance(error, FetchAborted) and not error.reason.startswith('download exceeded'):
+            return  # the host answered; the payload just wasn't wanted
+        host = _host_of(url)
+        now = time.monotonic()
+        with self._lock:
+            samples = self._hosts.setdefault(host, deque(maxlen=self.window))
+            samples.append((now, seconds, error is None))
+            self._measure_after(host, samples)
+            reason = self._degraded(samples)
+            if reason is None or self._renewing:
+                return
+            if self._last_attempt is not None and now - self._last_attempt < self.cooldown:
+                _record(rate_limited=1)
+                return
+            self._renewing = True
+            self._last_attempt = now
+            before = self._summary(samples)
+        try:
+            self._renew(host, url, reason, before)
+        finally:
+            with self._lock:
+                self._renewing = False
+
+    def _degraded(self, samples):
+        if len(samples) < self.min_samples:
+            return None
+        failures = sum(1 for _, _, ok in samples if not ok)
+        if failures / len(samples) > self.max_error_rate:
+            return f"{failures}/{len(samples)} fetches failed"
+        latencies = [seconds for _, seconds, ok in samples if ok]
+        if latencies and statistics.median(latencies) > self.latency_threshold:
+            return f"median latency {statistics.median(latencies):.1f}s"
+        return None
+
+    @staticmethod
+    def _summary(samples):
+        """Median latency, error rate and fetches per minute of a window of samples."""
+        latencies = [seconds for _, seconds, ok in samples if ok]
+        span = samples[-1][0] - samples[0][0] if len(samples) > 1 else 0
+        return {
+            'median': statistics.median(latencies) if latencies else None,
+            'errors': sum(1 for _, _, ok in samples if not ok) / len(samples),
+            'per_minute': (len(latencies) - 1) * 60 / span if span > 0 and len(latencies) > 1 else None,
+        }
+
+    def _measure_after(self, host, samples):
+        """Once the new circuit has MIN_SAMPLES fetches, log the renewal's effect."""
+        for renewal in self.renewals:
+            if renewal['host'] == host and renewal['after'] is None and len(samples) >= self.min_samples:
+                renewal['after'] = self._summary(samples)
+                print(colored(f"🧅 After circuit renewal for {host}: "
+                              f"{_format_summary(renewal['after'])} (before: {_format_summary(renewal['before'])})",
+                              "cyan"))
+
+    def _renew(self, host, url, reason, before):
+        print(colored(f"🧅 Circuit to {host} degraded ({reason}); sending NEWNYM", "yellow"))
+        try:
+            self.controller.newnym()
+        except (ControlError, OSError) as e:
+            _record(renewal_failures=1)
+            print(colored(f"Tor circuit renewal failed: {e}", "red"))
+            return
+        _record(renewals=1)
+        with self._lock:
+            # Samples of the old circuits say nothing about the new ones
+            for samples in self._hosts.values():
+                samples.clear()
+            self.renewals.append({'at': time.time(), 'host': host, 'reason': reason, 'before': before, 'after': None})
+        self.rewarm(url)
+
+    def rewarm(self, url):
+        """Drop keep-alive connections (still on the old circuits) and build the new circuit to the host."""
+        if self.session is None:
+            return
+        for adapter in self.session.adapters.values():
+            adapter.close()
+        parts = urllib.parse.urlparse(url)
+        warm_url = f"{parts.scheme}://{parts.netloc}/"
+        started = time.monotonic()
+        self._warming.active = True
+        try:
+            response = http_fetch.fetch(self.session, warm_url, timeout=WARM_TIMEOUT)
+            print(colored(f"🧅 Re-warmed {parts.netloc} on the new circuit in {time.monotonic() - started:.1f}s "
+                          f"(HTTP {response.status_code})", "cyan"))
+        except Exception as e:
+            _record(warm_failures=1)
+            print(colored(f"Re-warming {parts.netloc} failed: {e}", "yellow"))
+        finally:
+            self._warming.active = False
+
+    def print_stats(self):
+        """Print the Tor section of the run summary."""
+        with _stats_lock:
+            stats = dict(TOR_STATS)
+        if not (stats['renewals'] or stats['renewal_failures']):
+            return
+        print(colored(f"🧅 Tor circuits: {stats['renewals']} renewals, {stats['renewal_failures']} failed, "
+                      f"{stats['rate_limited']} degraded checks within the cooldown", "white"))
+        for renewal in self.renewals:
+            after = _format_summary(renewal['after']) if renewal['after'] else "not enough fetches since"
+            print(colored(f"   {time.strftime('%H:%M:%S', time.localtime(renewal['at']))} {renewal['host']} "
+                          f"({renewal['reason']}): before {_format_summary(renewal['before'])}; after {after}",
+                          "white"))
+
+
+def _format_summary(summary):
+    median = f"median {summary['median']:.1f}s" if summary['median'] is not None else "no successful fetches"
+    rate = f", {summary['per_minute']:.1f} fetches/min" if summary['per_minute'] is not None else ""
+    return f"{median}, {summary['errors']:.0%} errors{rate}"
+
+
+# The active CircuitMonitor (set by start())
+monitor = None
+
+
+def start(session, port=CONTROL_PORT, password=None, cookie_file=None, latency_threshold=LATENCY_THRESHOLD,
+          max_error_rate=MAX_ERROR_RATE, host='127.0.0.1'):
+    """Connect to the control port and watch every fetch (called from the scrapers' main())."""
+    global monitor
+    password = password if password is not None else os.environ.get('TOR_CONTROL_PASSWORD')
+    controller = TorController(host, port, password=password, cookie_file=cookie_file)
+    try:
+        controller.connect()  # checks the port and the credentials up front
+    except (ControlError, OSError) as e:
+        print(colored(f"❌ Tor control port unavailable, circuit renewal disabled: {e}", "red"))
+        return None
+    monitor = CircuitMonitor(controller, session, latency_threshold=latency_threshold, max_error_rate=max_error_rate)
+    http_fetch.observers.append(monitor.observe)
+    print(colored(f"🧅 Renewing Tor circuits via {host}:{port} when a market's median latency exceeds "
+                  f"{latency_threshold:g}s or {max_error_rate:.0%} of its fetches fail", "cyan"))
+    return monitor
+
+
+def stop():
+    """Stop watching fetches and print the Tor section of the run summary."""
+    global monitor
+    if monitor is None:
+        return
+    active, monitor = monitor, None
+    if active.observe in http_fetch.observers:
+        http_fetch.observers.remove(active.observe)
+    active.controller.close()
+    active.print_stats()
+
+
+class MockControlPort:
+    """Fake Tor control port: accepts AUTHENTICATE (optionally checking a password) and SIGNAL."""
+
+    def __init__(self, port=0, password=None, host='127.0.0.1'):
+        self.password = password
+        self.signals = []
+        self._server = socket.create_server((host, port))
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        authenticated = False
+        with conn, conn.makefile('rb') as reader:
+            for raw in reader:
+                line = raw.decode('utf-8', 'replace').strip()
+                command, _, argument = line.partition(' ')
+                command = command.upper()
+                if command == 'AUTHENTICATE':
+                    given = argument[1:-1] if argument.startswith('"') else argument
+                    if self.password is not None and given != self.password:
+                        conn.sendall(b"515 Authentication failed: Password did not match HashedControlPassword.\r\n")
+                        return
+                    authenticated = True
+                    conn.sendall(b"250 OK\r\n")
+                elif not authenticated:
+                    conn.sendall(b"514 Authentication required.\r\n")
+                    return
+                elif command == 'SIGNAL':
+                    self.signals.append((time.time(), argument.upper()))
+                    print(colored(f"mock control port: SIGNAL {argument.upper()}", "white"))
+                    conn.sendall(b"250 OK\r\n")
+                elif command == 'QUIT':
+                    conn.sendall(b"250 closing connection\r\n")
+                    return
+                else:
+                    conn.sendall(f'510 Unrecognized command "{command}"\r\n'.encode())
+
+    def close(self):
+        self._server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Renew Tor circuits through the control port')
+    parser.add_argument('--port', type=int, default=CONTROL_PORT, help=f'Control port (default: {CONTROL_PORT})')
+    parser.add_argument('--password', type=str, default=None,
+                       help='Control port password (default: $TOR_CONTROL_PASSWORD, else cookie or no auth)')
+    parser.add_argument('--cookie', type=str, default=None, help='Control auth cookie file (CookieAuthentication 1)')
+    parser.add_argument('--newnym', action='store_true', help='Send NEWNYM once and exit')
+    parser.add_argument('--mock-server', type=int, default=None, metavar='PORT',
+                       help='Run a fake control port on PORT (for dry runs with --tor-control-port)')
+
+    args = parser.parse_args()
+
+    if args.mock_server is not None:
+        server = MockControlPort(args.mock_server, password=args.password)
+        print(colored(f"Mock Tor control port listening on 127.0.0.1:{server.port} (Ctrl-C to stop)", "cyan"))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.close()
+        return
+
+    if args.newnym:
+        password = args.password if args.password is not None else os.environ.get('TOR_CONTROL_PASSWORD')
+        controller = TorController(port=args.port, password=password, cookie_file=args.cookie)
+        try:
+            controller.newnym()
+            print(colored("✅ NEWNYM sent; new streams will use new circuits", "green"))
+        except ControlError as e:
+            print(colored(f"❌ {e}", "red"))
+        finally:
+            controller.close()
+        return
+
+    parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+WARC archive of fetched pages (--save-pages)
+
+Pages are written as standard WARC/1.1 files, one gzip member per record, so
+they open in warcio, pywb, wget --warc-file tooling, etc. Each fetch made
+with requests produces a "request" and a "response" record (status line,
+headers and body); pages taken from the browser produce a "resource" record.
+Files rotate once they reach a size limit:
+
+    scraped_pages_warc/scraped_pages-20261019120000-00000.warc.gz
+    scraped_pages_warc/index.cdx
+
+index.cdx gets one CDX line per capture (SURT key, timestamp, URL, MIME type,
+status, digest, compressed length, offset, file name). Writing a page costs
+the same whatever the archive size. Lookups go through index.cdx.db, a
+SQLite copy of the CDX lines keyed by (SURT key, timestamp) that picks up
+only the lines appended since it was last opened, so a capture is found by
+URL (and timestamp) without loading the CDX or scanning the WARC files:
+
+    python3 warc_archive.py http://market.onion/page/2/            # list captures
+    python3 warc_archive.py http://market.onion/page/2/ --html     # print the page
+"""
+
+import argparse
+import base64
+import calendar
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+import uuid
+from termcolor import colored
+
+
+WARC_DIR = "scraped_pages_warc"
+WARC_PREFIX = "scraped_pages"
+CDX_FILE = "index.cdx"
+CDX_DB_FILE = "index.cdx.db"
+MAX_WARC_BYTES = 1024 * 1024 * 1024  # rotate after 1 GB
+CDX_HEADER = " CDX N b a m s k r M S V g\n"
+
+# Headers describing the transfer, not the stored (already decoded) body
+_TRANSFER_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length')
+
+
+def surt(url):
+    """Sort-friendly URL key used by CDX indexes (host reversed, lowercase)."""
+    parsed = urllib.parse.urlsplit(url.strip())
+    host = (parsed.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    key = ','.join(reversed(host.split('.'))) + ')'
+    key += (parsed.path or '/').lower()
+    if parsed.query:
+        key += '?' + '&'.join(sorted(parsed.query.lower().split('&')))
+    return key
+
+
+def _digest(data):
+    return 'sha1:' + base64.b32encode(hashlib.sha1(data).digest()).decode('ascii')
+
+
+def _warc_date(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+def _cdx_timestamp(timestamp):
+    return time.strftime('%Y%m%d%H%M%S', time.gmtime(timestamp))
+
+
+def _header_block(first_line, headers):
+    lines = [first_line] + [f"{name}: {value}" for name, value in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8', errors='replace')
+
+
+def _status_line(response):
+    reason = response.reason or ''
+    version = {10: 'HTTP/1.0', 11: 'HTTP/1.1'}.get(getattr(response.raw, 'version', 11), 'HTTP/1.1')
+    return f"{version} {response.status_code} {reason}".rstrip()
+
+
+class WarcWriter:
+    """Append-only, rotating WARC writer with a CDX index next to the files."""
+
+    def __init__(self, directory=WARC_DIR, prefix=WARC_PREFIX, max_bytes=MAX_WARC_BYTES):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.records = 0
+        self._file = None
+        self._filename = None
+        self._sequence = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        cdx_path = os.path.join(directory, CDX_FILE)
+        new_index = not os.path.exists(cdx_path)
+        self._cdx = open(cdx_path, 'a', encoding='utf-8')
+        if new_index:
+            self._cdx.write(CDX_HEADER)
+            self._cdx.flush()
+
+    def _rotate(self):
+        if self._file:
+            self._file.close()
+        while True:
+            name = f"{self.prefix}-{_cdx_timestamp(time.time())}-{self._sequence:05d}.warc.gz"
+            self._sequence += 1
+            if not os.path.exists(os.path.join(self.directory, name)):
+                break
+        self._filename = name
+        self._file = open(os.path.join(self.directory, name), 'ab')
+        info = 'software: scrape_old.py\r\nformat: WARC File Format 1.1\r\n'.encode('utf-8')
+        self._write_record('warcinfo', None, info, 'application/warc-fields', time.time(),
+                           extra=[('WARC-Filename', name)])
+
+    def _write_record(self, warc_type, url, block, content_type, timestamp, extra=()):
+        """Write one gzip-compressed record; returns (record_id, offset, compressed length)."""
+        record_id = f"<urn:uuid:{uuid.uuid4()}>"
+        headers = [
+            ('WARC-Type', warc_type),
+            ('WARC-Record-ID', record_id),
+            ('WARC-Date', _warc_date(timestamp)),
+        ]
+        if url:
+            headers.append(('WARC-Target-URI', url))
+        headers.extend(extra)
+        headers.extend([
+            ('WARC-Block-Digest', _digest(block)),
+            ('Content-Type', content_type),
+            ('Content-Length', str(len(block))),
+        ])
+        record = _header_block('WARC/1.1', headers) + block + b'\r\n\r\n'
+        compressed = gzip.compress(record)
+        offset = self._file.tell()
+        self._file.write(compressed)
+        return record_id, offset, len(compressed)
+
+    def _index(self, url, timestamp, mime, status, digest, length, offset):
+        mime = (mime or '-').split(';', 1)[0].strip() or '-'
+        url = url.replace(' ', '%20')
+        self._cdx.write(f"{surt(url)} {_cdx_timestamp(timestamp)} {url} {mime} {status} "
+                        f"{digest[5:]} - - {length} {offset} {self._filename}\n")
+
+    def _before_write(self):
+        if self._file is None or self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def write_response(self, url, response, timestamp=None):
+        """Archive a requests.Response (request + response records)."""
+        timestamp = timestamp or time.time()
+        body = response.content or b''
+        with self._lock:
+            self._before_write()
+
+            request = response.request
+            parsed = urllib.parse.urlsplit(request.url if request is not None else url)
+            target = parsed.path or '/'
+            if parsed.query:
+                target += '?' + parsed.query
+            request_headers = [('Host', parsed.netloc)]
+            if request is not None:
+                request_headers += [(k, v) for k, v in request.headers.items() if k.lower() != 'host']
+            request_block = _header_block(f"GET {target} HTTP/1.1", request_headers)
+
+            response_headers = [(k, v) for k, v in response.headers.items()
+                                if k.lower() not in _TRANSFER_HEADERS]
+            response_headers.append(('Content-Length', str(len(body))))
+            response_block = _header_block(_status_line(response), response_headers) + body
+
+            payload_digest = _digest(body)
+            response_id, offset, length = self._write_record(
+                'response', url, response_block, 'application/http; msgtype=response', timestamp,
+                extra=[('WARC-Payload-Digest', payload_digest)])
+            self._write_record('request', url, request_block, 'application/http; msgtype=request', timestamp,
+                               extra=[('WARC-Concurrent-To', response_id)])
+            self._file.flush()
+
+            self._index(url, timestamp, response.headers.get('Content-Type', 'text/html'), response.status_code,
+                        payload_digest, length, offset)
+            self._cdx.flush()
+            self.records += 1
+
+    def write_resource(self, url, html, timestamp=None, content_type='text/html; charset=utf-8'):
+        """Archive page HTML that did not come from requests (browser page source)."""
+        timestamp = timestamp or time.time()
+        body = html.encode('utf-8') if isinstance(html, str) else html
+        with self._lock:
+            self._before_write()
+            digest = _digest(body)
+            _, offset, length = self._write_record('resource', url, body, content_type, timestamp,
+                                                   extra=[('WARC-Payload-Digest', digest)])
+            self._file.flush()
+            self._index(url, timestamp, content_type, 200, digest, length, offset)
+            self._cdx.flush()
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+            self._cdx.close()
+
+
+class WarcIndex:
+    """index.cdx mirrored into SQLite (index.cdx.db): URL → captures, for direct record reads."""
+
+    _COLUMNS = ('url', 'timestamp', 'mime', 'status', 'digest', 'length', 'offset', 'filename')
+
+    def __init__(self, directory=WARC_DIR):
+        self.directory = directory
+        self.conn = sqlite3.connect(os.path.join(directory, CDX_DB_FILE), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cdx (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                indexed_bytes INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS captures (
+                key TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                url TEXT NOT NULL,
+                mime TEXT,
+                status TEXT,
+                digest TEXT,
+                length INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                filename TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS captures_key ON captures(key, timestamp);
+            INSERT OR IGNORE INTO cdx (id, indexed_bytes) VALUES (0, 0);
+        """)
+        self.update()
+
+    def update(self):
+        """Copy the CDX lines appended since the last update; returns how many were added."""
+        cdx_path = os.path.join(self.directory, CDX_FILE)
+        size = os.path.getsize(cdx_path) if os.path.exists(cdx_path) else 0
+        start = self.conn.execute("SELECT indexed_bytes FROM cdx").fetchone()[0]
+        if start > size:
+            # index.cdx was replaced: start over
+            self.conn.execute("DELETE FROM captures")
+            start = 0
+        if start == size:
+            self.conn.commit()
+            return 0
+
+        rows = []
+        offset = start
+        with open(cdx_path, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # a line the writer is still appending
+                offset += len(line)
+                fields = line.decode('utf-8').rstrip('\n').split(' ')
+                if line.startswith(b' CDX') or len(fields) != 11:
+                    continue
+                key, timestamp, url, mime, status, digest, _, _, length, line_offset, filename = fields
+                rows.append((key, timestamp, url, mime, status, digest, int(length), int(line_offset), filename))
+        self.conn.executemany("INSERT INTO captures (key, timestamp, url, mime, status, digest, length, offset, "
+                              "filename) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.conn.execute("UPDATE cdx SET indexed_bytes = ?", (offset,))
+        self.conn.commit()
+        return len(rows)
+
+    def _captures(self, where, params):
+        query = f"SELECT {', '.join(self._COLUMNS)} FROM captures WHERE {where}"
+        return [dict(zip(self._COLUMNS, row)) for row in self.conn.execute(query, params)]
+
+    def lookup(self, url, timestamp=None):
+        """Captures of a URL (oldest first), or the one closest to a 14-digit timestamp."""
+        key = surt(url)
+        if timestamp is None:
+            return self._captures("key = ? ORDER BY timestamp, rowid", (key,))
+        # 14-digit timestamps sort as text: the closest capture is the last one before or the first one after
+        target = str(timestamp).ljust(14, '0')[:14]
+        candidates = (self._captures("key = ? AND timestamp <= ? ORDER BY timestamp DESC LIMIT 1", (key, target)) +
+                      self._captures("key = ? AND timestamp > ? ORDER BY timestamp LIMIT 1", (key, target)))
+        if not candidates:
+            return None
+        return min(candidates, key=lambda c: abs(int(c['timestamp']) - int(target)))
+
+    def read_record(self, capture):
+        """Return (warc_headers, http_headers, body) of a capture."""
+        with open(os.path.join(self.directory, capture['filename']), 'rb') as f:
+            f.seek(capture['offset'])
+            record = gzip.decompress(f.read(capture['length']))
+        return parse_record(record)
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM captures").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def parse_record(record):
+    """Split a decompressed WARC record into (warc_headers, http_headers, body)."""
+    warc_head, _, block = record.partition(b'\r\n\r\n')
+    warc_headers = dict(line.split(': ', 1) for line in warc_head.decode('utf-8').split('\r\n')[1:] if ': ' in line)
+    block = block[:int(warc_headers.get('Content-Length', len(block)))]
+    http_headers = {}
+    if warc_headers.get('WARC-Type') == 'response':
+        http_head, _, block = block.partition(b'\r\n\r\n')
+        lines = http_head.decode('utf-8', errors='replace').split('\r\n')
+        http_headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+        http_headers[':status'] = lines[0]
+    return warc_headers, http_headers, block
+
+
+def iter_warc_pages(path):
+    """Yield {'url', 'timestamp', 'html'} for every response/resource record of a .warc.gz file."""
+    with gzip.open(path, 'rb') as f:
+        while True:
+            head = []
+            line = f.readline()
+            while line and line not in (b'\r\n', b'\n'):
+                head.append(line)
+                line = f.readline()
+            if not head:
+                return
+            headers = dict(line.decode('utf-8', errors='replace').rstrip('\r\n').split(': ', 1)
+                           for line in head[1:] if b': ' in line)
+            block = f.read(int(headers.get('Content-Length', 0)))
+            f.read(4)
+            if headers.get('WARC-Type') not in ('response', 'resource'):
+                continue
+            _, _, body = parse_record(b''.join(head) + b'\r\n' + block)
+            yield {
+                'url': headers.get('WARC-Target-URI'),
+                'timestamp': calendar.timegm(time.strptime(headers['WARC-Date'], '%Y-%m-%dT%H:%M:%SZ')),
+                'html': body.decode('utf-8', errors='replace'),
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Look up pages in the --save-pages WARC archive')
+    parser.add_argument('url', help='Page URL to look up')
+    parser.add_argument('--dir', type=str, default=WARC_DIR, help=f'Archive directory (default: {WARC_DIR})')
+    parser.add_argument('--timestamp', type=str, default=None,
+                       help='Pick the capture closest to this time (YYYYMMDDhhmmss, may be shortened)')
+    parser.add_argument('--html', action='store_true', help='Print the archived page body')
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dir):
+        print(colored(f"❌ No archive directory {args.dir}", "red"))
+        raise SystemExit(1)
+    index = WarcIndex(args.dir)
+    try:
+        if args.timestamp or args.html:
+            capture = index.lookup(args.url, args.timestamp or '99999999999999')
+            captures = [capture] if capture else []
+        else:
+            captures = index.lookup(args.url)
+        if captures and args.html:
+            _, _, body = index.read_record(captures[0])
+    finally:
+        index.close()
+
+    if not captures:
+        print(colored(f"❌ No capture of {args.url} in {args.dir}", "red"))
+        raise SystemExit(1)
+
+    if args.html:
+        print(body.decode('utf-8', errors='replace'))
+        return
+
+    for capture in captures:
+        print(colored(f"{capture['timestamp']}  {capture['status']}  {capture['mime']}", "green") +
+              colored(f"  {capture['filename']}@{capture['offset']} ({capture['length']} bytes)", "white"))
+
+
+if __name__ == "__main__":
+    main()